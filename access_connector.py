@@ -138,6 +138,16 @@ class AccessConnector:
             self.logger.error(f"Error importing data from table {table_name}: {str(e)}")
             return []
     
+    def read_table_frame(self, table_name: str):
+        """Read a whole table into a pandas DataFrame (columnar, no per-row cleanup)"""
+        if not self.connection or not PANDAS_AVAILABLE:
+            return None
+
+        import warnings
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy connectable")
+            return pd.read_sql(f"SELECT * FROM [{table_name}]", self.connection)
+
     def preview_table_data(self, table_name: str, rows: int = 5) -> List[Dict]:
         """Preview first few rows of a table"""
         return self.import_table_data(table_name, limit=rows)
@@ -1,112 +1,217 @@
 # auth_models.py - User authentication and management
 import json
 import os
+import threading
+import time
 from werkzeug.security import generate_password_hash, check_password_hash
 from typing import Dict, List, Optional
-import uuid
 from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+
+# Seconds a worker trusts its cached user list before re-checking the users table version
+CACHE_CHECK_INTERVAL = 1.0
 
 class UserManager:
-    """User management system with file-based storage"""
-    
+    """User management backed by the users table, with a per-worker cache
+
+    Authorization checks run on every request, so lookups by ID or username
+    are served from an in-process dict. At most once a second the cache
+    compares the users table's write version (bumped on every committed
+    change, see db_models.TableVersion) and reloads the whole table if it
+    moved, so changes made by other workers show up within a second.
+    """
+
     def __init__(self):
         self.data_file = 'data/users.json'
-        self._ensure_data_file()
-        self._create_default_admin()
-    
-    def _ensure_data_file(self):
-        """Ensure the users data file exists"""
-        os.makedirs('data', exist_ok=True)
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+        self._by_id: Dict[str, Dict] = {}
+        self._by_username: Dict[str, Dict] = {}
+        self._by_email: Dict[str, Dict] = {}
+        self._setup_done = False
+
+    def _setup(self):
+        """Create the table, migrate users.json and seed the default admin (once per worker)"""
+        from db_service import UserService
+
+        with UserService() as service:
+            service.ensure_table()
+            if service.count() == 0:
+                self._migrate_json_users(service)
+            if service.count() == 0:
+                self._create_default_admin(service)
+        self._setup_done = True
+
+    def _migrate_json_users(self, service):
+        """Import users from the legacy data/users.json file"""
         if not os.path.exists(self.data_file):
-            with open(self.data_file, 'w') as f:
-                json.dump([], f)
-    
-    def _load_users(self) -> List[Dict]:
-        """Load users from file"""
+            return
         try:
             with open(self.data_file, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return []
-    
-    def _save_users(self, users: List[Dict]):
-        """Save users to file"""
-        with open(self.data_file, 'w') as f:
-            json.dump(users, f, indent=2)
-    
-    def _create_default_admin(self):
+                legacy_users = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+
+        for user in legacy_users:
+            try:
+                service.create({
+                    'id': user['id'],
+                    'username': user['username'],
+                    'email': user.get('email'),
+                    'password_hash': user['password_hash'],
+                    'role': user.get('role', 'user'),
+                    'is_active': user.get('is_active', True),
+                    'created_at': self._parse_time(user.get('created_at')) or datetime.utcnow(),
+                    'last_login': self._parse_time(user.get('last_login')),
+                })
+            except IntegrityError:
+                # Another worker is migrating at the same time
+                continue
+        try:
+            os.replace(self.data_file, self.data_file + '.migrated')
+        except FileNotFoundError:
+            return  # another worker finished the migration first
+        print(f"Migrated {len(legacy_users)} users from {self.data_file} to the database")
+
+    def _create_default_admin(self, service):
         """Create default admin user if no users exist"""
-        users = self._load_users()
-        if not users:
-            admin_user = {
-                'id': str(uuid.uuid4()),
+        try:
+            service.create({
                 'username': 'admin',
                 'password_hash': generate_password_hash('admin123'),
                 'role': 'admin',
-                'created_at': datetime.now().isoformat()
-            }
-            users.append(admin_user)
-            self._save_users(users)
-    
+            })
+        except IntegrityError:
+            pass
+
+    @staticmethod
+    def _parse_time(value) -> Optional[datetime]:
+        try:
+            return datetime.fromisoformat(value) if value else None
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _to_dict(user) -> Dict:
+        """Convert SQLAlchemy object to dictionary (timestamps as ISO strings)"""
+        return {
+            'id': user.id,
+            'username': user.username,
+            'email': user.email or '',
+            'password_hash': user.password_hash,
+            'role': user.role,
+            'is_active': user.is_active,
+            'created_at': user.created_at.isoformat() if user.created_at else None,
+            'last_login': user.last_login.isoformat() if user.last_login else None
+        }
+
+    def _refresh(self):
+        """Reload the cache if the users table changed since it was filled"""
+        now = time.monotonic()
+        if now - self._checked_at < CACHE_CHECK_INTERVAL:
+            return
+
+        from db_service import TableVersionService, UserService
+
+        with self._lock:
+            if now - self._checked_at < CACHE_CHECK_INTERVAL:
+                return
+            if not self._setup_done:
+                self._setup()
+            with TableVersionService() as service:
+                version = service.get_versions(['users'])['users']
+            if version != self._version or not self._by_id:
+                with UserService() as service:
+                    users = [self._to_dict(u) for u in service.get_all()]
+                self._by_id = {u['id']: u for u in users}
+                self._by_username = {u['username']: u for u in users}
+                self._by_email = {u['email']: u for u in users if u['email']}
+                self._version = version
+            self._checked_at = now
+
+    def _invalidate(self):
+        """Force a version check on the next lookup (after this worker wrote)"""
+        self._checked_at = 0.0
+
     def authenticate(self, username: str, password: str) -> Optional[Dict]:
         """Authenticate user and return user data if valid"""
-        users = self._load_users()
-        for user in users:
-            if user['username'] == username:
-                if check_password_hash(user['password_hash'], password):
-                    return user
+        user = self.get_user_by_username(username)
+        if user and user.get('is_active', True) and check_password_hash(user['password_hash'], password):
+            self.update_last_login(user['id'])
+            return user
         return None
-    
+
     def get_user_by_id(self, user_id: str) -> Optional[Dict]:
         """Get user by ID"""
-        users = self._load_users()
-        for user in users:
-            if user['id'] == user_id:
-                return user
-        return None
-    
-    def create_user(self, username: str, password: str, role: str = 'user') -> bool:
-        """Create a new user"""
-        users = self._load_users()
-        
-        # Check if username already exists
-        if any(user['username'] == username for user in users):
-            return False
-        
-        new_user = {
-            'id': str(uuid.uuid4()),
-            'username': username,
-            'password_hash': generate_password_hash(password),
-            'role': role,
-            'created_at': datetime.now().isoformat()
-        }
-        
-        users.append(new_user)
-        self._save_users(users)
-        return True
-    
+        self._refresh()
+        return self._by_id.get(user_id)
+
+    def get_user_by_username(self, username: str) -> Optional[Dict]:
+        """Get user by username"""
+        self._refresh()
+        return self._by_username.get(username)
+
+    def get_user_by_email(self, email: str) -> Optional[Dict]:
+        """Get user by email (case-insensitive)"""
+        from db_models import normalize_email
+
+        self._refresh()
+        return self._by_email.get(normalize_email(email))
+
+    def create_user(self, username: str, email: str, password: str, role: str = 'user') -> Dict:
+        """Create a new user; raises ValueError if the username or email is taken"""
+        from db_service import UserService
+
+        self._refresh()
+        try:
+            with UserService() as service:
+                user = self._to_dict(service.create({
+                    'username': username,
+                    'email': email,
+                    'password_hash': generate_password_hash(password),
+                    'role': role,
+                }))
+        except IntegrityError:
+            raise ValueError('Username or email already exists')
+        self._invalidate()
+        return {k: v for k, v in user.items() if k != 'password_hash'}
+
     def get_all_users(self) -> List[Dict]:
         """Get all users (without password hashes)"""
-        users = self._load_users()
-        return [{k: v for k, v in user.items() if k != 'password_hash'} for user in users]
-    
+        self._refresh()
+        return [{k: v for k, v in user.items() if k != 'password_hash'} for user in self._by_id.values()]
+
     def delete_user(self, user_id: str) -> bool:
-        """Delete a user by ID"""
-        users = self._load_users()
-        updated_users = [user for user in users if user['id'] != user_id]
-        
-        if len(updated_users) != len(users):
-            self._save_users(updated_users)
-            return True
-        return False
-    
+        """Delete a user by ID (the last admin cannot be deleted)"""
+        from db_service import UserService
+
+        self._refresh()
+        with UserService() as service:
+            user = service.get_by_id(user_id)
+            if not user:
+                return False
+            if user.role == 'admin' and service.count_admins() <= 1:
+                raise ValueError('Cannot delete the last admin user')
+            service.delete(user_id)
+        self._invalidate()
+        return True
+
     def update_user_role(self, user_id: str, new_role: str) -> bool:
         """Update user role"""
-        users = self._load_users()
-        for user in users:
-            if user['id'] == user_id:
-                user['role'] = new_role
-                user['updated_at'] = datetime.now().isoformat()
-                self._save_users(users)
-                return True
-        return False
\ No newline at end of file
+        from db_service import UserService
+
+        self._refresh()
+        with UserService() as service:
+            updated = service.update(user_id, {'role': new_role})
+        self._invalidate()
+        return updated
+
+    def update_last_login(self, user_id: str) -> bool:
+        """Record a successful login"""
+        from db_service import UserService
+
+        with UserService() as service:
+            updated = service.update(user_id, {'last_login': datetime.utcnow()})
+        self._invalidate()
+        return updated
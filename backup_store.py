@@ -0,0 +1,461 @@
+# backup_store.py - Incremental, deduplicated backup store
+"""
+Incremental backup store with content-addressed chunks
+
+Every table is split into buckets by a hash of each row's primary key, and
+each bucket is stored as one chunk named after the sha256 of its content.
+A snapshot manifest lists the chunk for every bucket, so each manifest is
+a complete, self-contained backup, yet unchanged buckets share the same
+chunk file on disk.
+
+An incremental run only reads rows whose updated_at/created_at is at or
+above the previous snapshot's high-water mark, plus a scan of the primary
+key column to notice inserts with old timestamps and deletions. Rows the
+change log shows were written since the previous snapshot are read too:
+upserted keys, and the rows now holding the values of each logged bulk
+UPDATE. Those catch in-place updates that stamp no updated_at
+(rental_history has none). Only the buckets touched by those rows are
+rewritten.
+
+Layout:
+    backups/store/chunks/<aa>/<sha256>   compressed JSON lines, sorted by key
+    backups/store/snapshots/<id>.json    snapshot manifests
+
+Old snapshots are pruned grandfather-father-son style (daily, weekly,
+monthly) and chunks no longer referenced are garbage collected.
+
+Usage:
+    python backup_store.py backup [--full]
+    python backup_store.py list
+    python backup_store.py verify [snapshot_id]
+    python backup_store.py prune [--daily 7] [--weekly 4] [--monthly 12]
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import DateTime, and_, func, or_, select
+
+from backup_engine import DATA_FILES, SKIPPED_TABLES, backup_engine, begin_snapshot, json_default
+from change_log import change_log, where_condition
+from db_models import Base
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Target rows per bucket when a table is first backed up (bucket count is then fixed)
+ROWS_PER_BUCKET = 2000
+MIN_BUCKETS = 16
+
+DIGEST_MODULUS = 2 ** 64
+
+# Re-read rows slightly older than the high-water mark to cover transactions
+# that stamped updated_at before the previous snapshot but committed after it
+HIGH_WATER_MARK_OVERLAP = timedelta(minutes=10)
+
+
+def _key_hash(key: str) -> int:
+    return int.from_bytes(hashlib.sha256(key.encode('utf-8')).digest()[:8], 'big')
+
+
+def _row_key(values) -> str:
+    return '|'.join(str(v) for v in values)
+
+
+def _logged_value(column, value):
+    """A change log value (JSON) as the column's Python type"""
+    if isinstance(value, str) and isinstance(column.type, DateTime):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def _has_value(column, value):
+    return column.is_(None) if value is None else column == _logged_value(column, value)
+
+
+class BackupStore:
+    """Create, verify and prune incremental snapshots"""
+
+    def __init__(self, store_dir: str = os.path.join('backups', 'store'), data_dir: str = 'data',
+                 batch_size: int = 5000):
+        self.store_dir = store_dir
+        self.chunk_dir = os.path.join(store_dir, 'chunks')
+        self.snapshot_dir = os.path.join(store_dir, 'snapshots')
+        self.data_dir = data_dir
+        self.batch_size = batch_size
+        self.chunks_written = 0
+
+    # Chunks
+
+    def _chunk_path(self, chunk: str) -> str:
+        return os.path.join(self.chunk_dir, chunk[:2], chunk)
+
+    def put_chunk(self, content: bytes) -> str:
+        """Store content under its sha256 (no-op if already stored) and return the hash"""
+        chunk = hashlib.sha256(content).hexdigest()
+        path = self._chunk_path(chunk)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+            with backup_engine.open_compressed(tmp_path) as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+            self.chunks_written += 1
+        return chunk
+
+    def get_chunk(self, chunk: str) -> bytes:
+        """Read and decompress a chunk"""
+        with open(self._chunk_path(chunk), 'rb') as f:
+            data = f.read()
+        if data.startswith(ZSTD_MAGIC):
+            if zstandard is None:
+                raise RuntimeError('zstandard package is required to read this backup')
+            return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        return gzip.decompress(data)
+
+    # Snapshots
+
+    def list_snapshots(self) -> List[Dict]:
+        """All snapshot manifests, oldest first"""
+        if not os.path.isdir(self.snapshot_dir):
+            return []
+        snapshots = []
+        for name in sorted(os.listdir(self.snapshot_dir)):
+            if name.endswith('.json'):
+                with open(os.path.join(self.snapshot_dir, name)) as f:
+                    snapshots.append(json.load(f))
+        return snapshots
+
+    def load_snapshot(self, snapshot_id: str) -> Dict:
+        with open(os.path.join(self.snapshot_dir, f'{snapshot_id}.json')) as f:
+            return json.load(f)
+
+    def iter_table_rows(self, snapshot: Dict, table_name: str):
+        """Yield a table's rows (as dicts) from a snapshot"""
+        for bucket in snapshot['tables'][table_name]['buckets']:
+            if bucket['chunk']:
+                for line in self.get_chunk(bucket['chunk']).splitlines():
+                    yield json.loads(line)
+
+    def create_snapshot(self, full: bool = False) -> Dict:
+        """Back up every table, reusing unchanged chunks from the latest snapshot"""
+        from db_service import DatabaseService
+
+        snapshots = self.list_snapshots()
+        previous = None if full or not snapshots else snapshots[-1]
+        started = datetime.now()
+        snapshot = {
+            'id': started.strftime('%Y%m%d_%H%M%S'),
+            'created_at': started.strftime('%Y-%m-%d %H:%M:%S'),
+            'kind': 'incremental' if previous else 'full',
+            'parent': previous['id'] if previous else None,
+            'tables': {},
+            'files': {}
+        }
+
+        logged = {}
+        if previous:
+            since = datetime.strptime(previous['created_at'], '%Y-%m-%d %H:%M:%S') - HIGH_WATER_MARK_OVERLAP
+            logged = self._logged_changes(since)
+
+        stored_before = self.chunks_written
+        with DatabaseService() as service:
+            begin_snapshot(service)
+            for table in Base.metadata.sorted_tables:
+                if table.name in SKIPPED_TABLES:
+                    continue
+                previous_table = previous['tables'].get(table.name) if previous else None
+                snapshot['tables'][table.name] = self._backup_table(service, table, previous_table,
+                                                                    logged.get(table.name))
+            service.db.rollback()
+
+        for name in DATA_FILES:
+            path = os.path.join(self.data_dir, name)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    snapshot['files'][name] = self.put_chunk(f.read())
+
+        snapshot['new_chunks'] = self.chunks_written - stored_before
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        tmp_path = os.path.join(self.snapshot_dir, f"{snapshot['id']}.json.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, indent=1)
+        os.replace(tmp_path, os.path.join(self.snapshot_dir, f"{snapshot['id']}.json"))
+
+        logger.info(f"Backup snapshot {snapshot['id']} ({snapshot['kind']}): {snapshot['new_chunks']} new chunks")
+        return snapshot
+
+    def _logged_changes(self, since: datetime) -> Dict[str, Dict]:
+        """Upserted keys and bulk UPDATE entries in the change log since a time, per table"""
+        logged = {}
+        for entry in change_log.read(since=since):
+            changes = logged.setdefault(entry['table'], {'keys': set(), 'updates': []})
+            if entry['op'] == 'upsert':
+                changes['keys'].update(entry['key'].values())
+            elif entry['op'] in ('update_where', 'copy_from'):
+                changes['updates'].append(entry)
+        return logged
+
+    def _logged_conditions(self, table, logged: Dict) -> List:
+        """Conditions matching every row the change log shows was written
+
+        A bulk UPDATE is matched by the values it set (copy_from: rows that
+        have a source row), a superset of the rows it changed.
+        """
+        key_column = list(table.primary_key.columns)[0]
+        keys = sorted(logged['keys'])
+        conditions = [key_column.in_(keys[start:start + 500]) for start in range(0, len(keys), 500)]
+        for entry in logged['updates']:
+            if entry['op'] == 'update_where':
+                condition = and_(*(_has_value(table.c[name], value) for name, value in entry['values'].items()))
+            else:
+                condition = table.c[entry['on'][0]].isnot(None)
+                if entry['where']:
+                    column, operator, value = entry['where']
+                    condition = and_(condition, where_condition(table.c[column], operator,
+                                                                _logged_value(table.c[column], value)))
+            conditions.append(condition)
+        return conditions
+
+    def _backup_table(self, service, table, previous: Optional[Dict], logged: Optional[Dict] = None) -> Dict:
+        """Write changed buckets of one table and return its manifest entry"""
+        columns = [column.name for column in table.columns]
+        key_indexes = [columns.index(column.name) for column in table.primary_key.columns]
+        timestamp_columns = [table.c[name] for name in ('updated_at', 'created_at') if name in table.c]
+        changed_at = func.coalesce(*timestamp_columns) if len(timestamp_columns) > 1 else (
+            timestamp_columns[0] if timestamp_columns else None)
+
+        if previous:
+            num_buckets = previous['num_buckets']
+        else:
+            row_estimate = service.db.execute(select(func.count()).select_from(table)).scalar() or 0
+            num_buckets = max(MIN_BUCKETS, 1 << (row_estimate // ROWS_PER_BUCKET).bit_length())
+
+        # Per-bucket count and order-independent digest of the current keys
+        current = [[0, 0] for _ in range(num_buckets)]
+        for keys in service.stream_primary_keys(table):
+            for key_values in keys:
+                key_hash = _key_hash(_row_key(key_values))
+                bucket = current[key_hash % num_buckets]
+                bucket[0] += 1
+                bucket[1] = (bucket[1] + key_hash) % DIGEST_MODULUS
+
+        row_total = sum(count for count, _ in current)
+
+        # Rows changed since the previous high-water mark (everything on a full backup)
+        where = None
+        if previous and changed_at is not None:
+            # Rows without timestamps are legacy imports; any ORM update stamps updated_at,
+            # and inserts or deletes of unstamped rows are caught by the key digests
+            if previous.get('high_water_mark'):
+                where = changed_at >= datetime.fromisoformat(previous['high_water_mark']) - HIGH_WATER_MARK_OVERLAP
+            else:
+                where = changed_at.isnot(None)
+        if where is not None and logged:
+            where = or_(where, *self._logged_conditions(table, logged))
+        changed = {}
+        for rows in service.stream_table_batches(table, self.batch_size, where=where):
+            for row in rows:
+                key = _row_key([row[i] for i in key_indexes])
+                line = json.dumps(dict(zip(columns, row)), default=json_default, sort_keys=True)
+                changed.setdefault(_key_hash(key) % num_buckets, {})[key] = line
+
+        high_water_mark = None
+        if changed_at is not None:
+            latest = service.db.execute(func.max(changed_at).select()).scalar()
+            high_water_mark = latest.isoformat() if latest else None
+
+        previous_buckets = {b['bucket']: b for b in previous['buckets']} if previous else {}
+        buckets = []
+        needs_keys = {}
+        for number in range(num_buckets):
+            count, digest = current[number]
+            before = previous_buckets.get(number)
+            if before and not changed.get(number) and before['rows'] == count and before['digest'] == str(digest):
+                buckets.append(before)
+                continue
+
+            rows = {}
+            if before and before['chunk']:
+                for line in self.get_chunk(before['chunk']).decode('utf-8').splitlines():
+                    rows[_row_key([json.loads(line)[columns[i]] for i in key_indexes])] = line
+            rows.update(changed.get(number, {}))
+            if len(rows) != count or self._digest(rows) != digest:
+                # Deletions, or inserts that carry an old timestamp: reconcile against the real key set
+                needs_keys[number] = rows
+            buckets.append({'bucket': number, 'rows': count, 'digest': str(digest), 'rows_by_key': rows})
+
+        if needs_keys:
+            self._reconcile(service, table, columns, key_indexes, num_buckets, needs_keys)
+
+        for bucket in buckets:
+            rows = bucket.pop('rows_by_key', None)
+            if rows is None:
+                continue
+            bucket['chunk'] = self.put_chunk(
+                ''.join(rows[key] + '\n' for key in sorted(rows)).encode('utf-8')) if rows else None
+
+        return {
+            'num_buckets': num_buckets,
+            'rows': row_total,
+            'changed_rows': sum(len(rows) for rows in changed.values()),
+            'high_water_mark': high_water_mark,
+            'buckets': buckets
+        }
+
+    def _digest(self, rows: Dict) -> int:
+        return sum(_key_hash(key) for key in rows) % DIGEST_MODULUS
+
+    def _reconcile(self, service, table, columns, key_indexes, num_buckets, needs_keys: Dict[int, Dict]):
+        """Drop deleted rows and fetch missing rows for buckets whose key set does not match"""
+        actual = {number: set() for number in needs_keys}
+        for keys in service.stream_primary_keys(table):
+            for key_values in keys:
+                key = _row_key(key_values)
+                number = _key_hash(key) % num_buckets
+                if number in actual:
+                    actual[number].add(key)
+
+        missing = []
+        for number, rows in needs_keys.items():
+            for key in list(rows):
+                if key not in actual[number]:
+                    del rows[key]
+            missing.extend(key for key in actual[number] if key not in rows)
+
+        key_column = list(table.primary_key.columns)[0]
+        for start in range(0, len(missing), 500):
+            batch = missing[start:start + 500]
+            for rows in service.stream_table_batches(table, self.batch_size, where=key_column.in_(batch)):
+                for row in rows:
+                    key = _row_key([row[i] for i in key_indexes])
+                    needs_keys[_key_hash(key) % num_buckets][key] = json.dumps(
+                        dict(zip(columns, row)), default=json_default, sort_keys=True)
+
+    # Verification and retention
+
+    def verify(self, snapshot_id: str = None) -> List[str]:
+        """Check chunk presence, checksums and row counts; returns a list of problems"""
+        snapshots = [self.load_snapshot(snapshot_id)] if snapshot_id else self.list_snapshots()
+        problems = []
+        verified = {}
+        for snapshot in snapshots:
+            chunks = [(f"{table_name}/{b['bucket']}", b['chunk'], b['rows'])
+                      for table_name, entry in snapshot['tables'].items() for b in entry['buckets'] if b['chunk']]
+            chunks += [(name, chunk, None) for name, chunk in snapshot['files'].items()]
+            for label, chunk, expected_rows in chunks:
+                if chunk not in verified:
+                    try:
+                        content = self.get_chunk(chunk)
+                        verified[chunk] = content.count(b'\n') if hashlib.sha256(content).hexdigest() == chunk else 'checksum mismatch'
+                    except FileNotFoundError:
+                        verified[chunk] = 'missing chunk'
+                    except Exception as e:
+                        verified[chunk] = f'unreadable chunk: {e}'
+                result = verified[chunk]
+                if isinstance(result, str):
+                    problems.append(f"{snapshot['id']} {label}: {result} {chunk}")
+                elif expected_rows is not None and result != expected_rows:
+                    problems.append(f"{snapshot['id']} {label}: expected {expected_rows} rows, found {result}")
+        return problems
+
+    def prune(self, daily: int = 7, weekly: int = 4, monthly: int = 12) -> Dict:
+        """Apply grandfather-father-son retention, then delete unreferenced chunks"""
+        snapshots = self.list_snapshots()
+        keep = set()
+        for count, period in ((daily, '%Y-%m-%d'), (weekly, '%G-W%V'), (monthly, '%Y-%m')):
+            seen = []
+            for snapshot in reversed(snapshots):
+                created = datetime.strptime(snapshot['created_at'], '%Y-%m-%d %H:%M:%S').strftime(period)
+                if created not in seen:
+                    if len(seen) == count:
+                        break
+                    seen.append(created)
+                    keep.add(snapshot['id'])
+        if snapshots:
+            keep.add(snapshots[-1]['id'])  # The latest snapshot is the base of the next incremental
+
+        removed = [s['id'] for s in snapshots if s['id'] not in keep]
+        for snapshot_id in removed:
+            os.remove(os.path.join(self.snapshot_dir, f'{snapshot_id}.json'))
+
+        # Change log segments are only useful on top of a snapshot that still exists
+        removed_segments = 0
+        kept = [s for s in snapshots if s['id'] in keep]
+        if kept:
+            removed_segments = change_log.prune(datetime.strptime(kept[0]['created_at'], '%Y-%m-%d %H:%M:%S'))
+
+        return {'removed_snapshots': removed, 'removed_chunks': self.collect_garbage(),
+                'removed_segments': removed_segments}
+
+    def collect_garbage(self) -> int:
+        """Delete chunks not referenced by any snapshot"""
+        referenced = set()
+        for snapshot in self.list_snapshots():
+            referenced.update(b['chunk'] for entry in snapshot['tables'].values() for b in entry['buckets'] if b['chunk'])
+            referenced.update(snapshot['files'].values())
+
+        removed = 0
+        if os.path.isdir(self.chunk_dir):
+            for prefix in os.listdir(self.chunk_dir):
+                for name in os.listdir(os.path.join(self.chunk_dir, prefix)):
+                    if name not in referenced and not name.endswith('.tmp'):
+                        os.remove(os.path.join(self.chunk_dir, prefix, name))
+                        removed += 1
+        return removed
+
+
+# Global backup store instance
+backup_store = BackupStore()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Incremental backup store')
+    commands = parser.add_subparsers(dest='command', required=True)
+    backup_parser = commands.add_parser('backup', help='Create a snapshot')
+    backup_parser.add_argument('--full', action='store_true', help='Re-read every row instead of only changes')
+    commands.add_parser('list', help='List snapshots')
+    verify_parser = commands.add_parser('verify', help='Verify snapshots')
+    verify_parser.add_argument('snapshot_id', nargs='?')
+    prune_parser = commands.add_parser('prune', help='Apply retention policy')
+    prune_parser.add_argument('--daily', type=int, default=7)
+    prune_parser.add_argument('--weekly', type=int, default=4)
+    prune_parser.add_argument('--monthly', type=int, default=12)
+    args = parser.parse_args()
+
+    if args.command == 'backup':
+        snapshot = backup_store.create_snapshot(full=args.full)
+        print(f"Snapshot {snapshot['id']} ({snapshot['kind']}), {snapshot['new_chunks']} new chunks")
+        for table_name, entry in snapshot['tables'].items():
+            print(f"   • {table_name}: {entry['rows']} rows, {entry['changed_rows']} read")
+    elif args.command == 'list':
+        for snapshot in backup_store.list_snapshots():
+            rows = sum(entry['rows'] for entry in snapshot['tables'].values())
+            print(f"{snapshot['id']}  {snapshot['kind']:<11}  {rows} rows")
+    elif args.command == 'verify':
+        problems = backup_store.verify(args.snapshot_id)
+        for problem in problems:
+            print(f"❌ {problem}")
+        print("✅ All snapshots verified" if not problems else f"{len(problems)} problem(s) found")
+        sys.exit(1 if problems else 0)
+    elif args.command == 'prune':
+        result = backup_store.prune(args.daily, args.weekly, args.monthly)
+        print(f"Removed {len(result['removed_snapshots'])} snapshots and {result['removed_chunks']} chunks")
+
+
+if __name__ == '__main__':
+    main()
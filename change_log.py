@@ -0,0 +1,269 @@
+# change_log.py - Append-only log of committed database writes
+"""
+Append-only change log for point-in-time recovery
+
+Every committed transaction that writes a versioned table appends its row
+changes to a daily JSON lines segment:
+
+    backups/changelog/changes-YYYYMMDD.jsonl
+
+One line per change:
+
+    {"ts": "2026-10-19T14:03:11.52", "tx": "...", "table": "cylinders",
+     "op": "upsert", "key": {"id": "..."}, "row": {...}}
+
+Inserts and updates are logged as "upsert" with the full row so replay is
+idempotent; deletes carry only the primary key. A transaction takes the
+log's append lock just before COMMIT and appends after it, still holding
+the lock, so lines from concurrent workers are in commit order. Bulk statements cannot be
+seen row by row, so the write path records them explicitly:
+record_delete_where() for query.delete(), record_update_where() for
+query.update() with constant values, and record_copy_from() for the
+set-based UPDATE that copies columns from a related table (customer
+details onto rented cylinders). All replay the same statement, which
+gives the same rows when the log is applied in order. restore.py replays
+the segments on top of a snapshot up to a chosen timestamp.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import uuid
+from datetime import datetime
+from typing import Dict, Iterator, Optional
+
+from sqlalchemy import event, exists, inspect, or_, select, update
+
+from backup_engine import json_default
+from db_models import SessionLocal, VERSIONED_TABLES
+
+logger = logging.getLogger(__name__)
+
+CHANGE_LOG_DIR = os.environ.get('CHANGE_LOG_DIR', os.path.join('backups', 'changelog'))
+
+# Comparison operators allowed in delete_where / update_where / copy_from entries
+WHERE_OPERATORS = ('<', '<=', '=')
+
+# Entries standing for a bulk statement rather than single rows
+BULK_OPERATIONS = ('delete_where', 'update_where', 'copy_from')
+
+
+def _pending(session):
+    """Changes flushed in the session's current transaction, not yet committed"""
+    return session.info.setdefault('change_log', [])
+
+
+def _primary_key(mapper, state) -> Dict:
+    # New objects only get their identity after the flush completes
+    identity = state.identity or mapper.primary_key_from_instance(state.obj())
+    return {column.name: value for column, value in zip(mapper.primary_key, identity)}
+
+
+def _loaded_row(mapper, state) -> Dict:
+    """Column values already loaded on the object (never triggers a lazy load)"""
+    loaded = state.dict
+    return {column.name: loaded[column.key] for column in mapper.local_table.columns if column.key in loaded}
+
+
+@event.listens_for(SessionLocal, 'after_flush')
+def _collect_flushed_rows(session, flush_context):
+    """Capture rows written by this flush while their history is still available"""
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, '__table__', None)
+        if table is None or table.name not in VERSIONED_TABLES:
+            continue
+        state = inspect(obj)
+        mapper = state.mapper
+        if obj in session.deleted:
+            _pending(session).append({'table': table.name, 'op': 'delete', 'key': _primary_key(mapper, state)})
+        elif obj in session.new or session.is_modified(obj, include_collections=False):
+            _pending(session).append({'table': table.name, 'op': 'upsert', 'key': _primary_key(mapper, state),
+                                      'row': _loaded_row(mapper, state)})
+
+
+@event.listens_for(SessionLocal, 'do_orm_execute')
+def _warn_unlogged_bulk_statements(orm_execute_state):
+    """Bulk update/delete statements bypass the per-row log unless recorded explicitly"""
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is None or mapper.local_table.name not in VERSIONED_TABLES:
+            return
+        table_name = mapper.local_table.name
+        if not any(e['table'] == table_name and e['op'] in BULK_OPERATIONS
+                   for e in _pending(orm_execute_state.session)):
+            logger.warning(f"Bulk write on {table_name} is not in the change log; "
+                           f"point-in-time restore will miss it")
+
+
+@event.listens_for(SessionLocal, 'before_commit')
+def _lock_commit_order(session):
+    """Hold the append lock across COMMIT so replay applies transactions in commit order
+
+    Registered after db_models' table version bump, so the transaction
+    already holds every row lock it needs and can't deadlock on the lock.
+    """
+    if _pending(session) and 'change_log_lock' not in session.info:
+        try:
+            session.info['change_log_lock'] = change_log.lock()
+        except OSError as e:
+            logger.error(f"Could not lock change log: {e}")
+
+
+@event.listens_for(SessionLocal, 'after_commit')
+def _append_committed(session):
+    """Write the committed transaction's changes to the log"""
+    entries = session.info.pop('change_log', None)
+    if entries:
+        try:
+            change_log.append(entries)
+        except OSError as e:
+            logger.error(f"Could not write change log: {e}")
+
+
+@event.listens_for(SessionLocal, 'after_rollback')
+def _discard_rolled_back(session):
+    session.info.pop('change_log', None)
+
+
+@event.listens_for(SessionLocal, 'after_transaction_end')
+def _release_commit_order(session, transaction):
+    if transaction.parent is None:
+        lock = session.info.pop('change_log_lock', None)
+        if lock is not None:
+            lock.close()  # closing the file releases the flock
+
+
+def record_delete_where(session, table_name: str, column: str, operator: str, value):
+    """Log a bulk delete (e.g. query.delete()) as a predicate; call before executing it"""
+    if operator not in WHERE_OPERATORS:
+        raise ValueError(f'Unsupported operator {operator!r}')
+    _pending(session).append({'table': table_name, 'op': 'delete_where',
+                              'where': [column, operator, value]})
+
+
+def record_update_where(session, table_name: str, column: str, operator: str, value, values: Dict):
+    """Log a bulk update (e.g. query.update()) setting constant values; call before executing it"""
+    if operator not in WHERE_OPERATORS:
+        raise ValueError(f'Unsupported operator {operator!r}')
+    _pending(session).append({'table': table_name, 'op': 'update_where',
+                              'where': [column, operator, value], 'values': dict(values)})
+
+
+def where_condition(column, operator: str, value):
+    """The SQL condition of a logged [column, operator, value] predicate"""
+    if operator not in WHERE_OPERATORS:
+        raise ValueError(f'Unsupported operator {operator!r}')
+    return {'<': column < value, '<=': column <= value, '=': column == value}[operator]
+
+
+def record_copy_from(session, table_name: str, source_name: str, on, columns, where=None,
+                     values: Optional[Dict] = None):
+    """Log a copy_from_statement() update; call before executing it"""
+    if where is not None and where[1] not in WHERE_OPERATORS:
+        raise ValueError(f'Unsupported operator {where[1]!r}')
+    _pending(session).append({'table': table_name, 'op': 'copy_from', 'source': source_name,
+                              'on': list(on), 'columns': list(columns),
+                              'where': list(where) if where is not None else None,
+                              'values': dict(values) if values else None})
+
+
+def copy_from_statement(target, source, on, columns, where=None, values: Optional[Dict] = None):
+    """UPDATE target SET columns to the matching source row's values
+
+    on is (target foreign key column, source key column). Only target rows
+    whose copy differs from the source are written; where optionally
+    narrows the update to [column, operator, value]. values sets further
+    columns to constants, e.g. updated_at, so a replay writes the logged
+    timestamp instead of firing the column's onupdate default. target and
+    source are tables or mapped classes (pass the mapped class so the
+    session's bulk write hooks see the statement).
+    """
+    target_table = getattr(target, '__table__', target)
+    source_table = getattr(source, '__table__', source)
+    foreign_key, key = on
+    match = source_table.c[key] == target_table.c[foreign_key]
+    differs = or_(*(source_table.c[name].is_distinct_from(target_table.c[name]) for name in columns))
+    statement = update(target).values({
+        name: select(source_table.c[name]).where(match).scalar_subquery() for name in columns
+    }).where(exists().where(match, differs))
+    if values:
+        statement = statement.values(values)
+    if where is not None:
+        column, operator, value = where
+        statement = statement.where(where_condition(target_table.c[column], operator, value))
+    return statement
+
+
+class ChangeLog:
+    """Append and read change log segments"""
+
+    def __init__(self, log_dir: str = CHANGE_LOG_DIR):
+        self.log_dir = log_dir
+
+    def lock(self):
+        """Take the exclusive append lock; it is held until the returned file is closed"""
+        os.makedirs(self.log_dir, exist_ok=True)
+        # A new open file per holder: flock doesn't exclude holders of the same open file
+        lock_file = open(os.path.join(self.log_dir, '.lock'), 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def segment_path(self, day: datetime) -> str:
+        return os.path.join(self.log_dir, f"changes-{day.strftime('%Y%m%d')}.jsonl")
+
+    def append(self, entries):
+        """Append one transaction's entries with a shared commit timestamp"""
+        now = datetime.now()
+        header = {'ts': now.isoformat(timespec='microseconds'), 'tx': uuid.uuid4().hex[:12]}
+        data = ''.join(json.dumps({**header, **entry}, default=json_default) + '\n' for entry in entries)
+
+        os.makedirs(self.log_dir, exist_ok=True)
+        with open(self.segment_path(now), 'a', encoding='utf-8') as f:
+            # Workers append concurrently; keep each transaction's lines together
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(data)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def segments(self):
+        if not os.path.isdir(self.log_dir):
+            return []
+        return sorted(name for name in os.listdir(self.log_dir)
+                      if name.startswith('changes-') and name.endswith('.jsonl'))
+
+    def read(self, since: Optional[datetime] = None, until: Optional[datetime] = None) -> Iterator[Dict]:
+        """Yield entries committed in [since, until], oldest first"""
+        since_day = since.strftime('%Y%m%d') if since else None
+        for name in self.segments():
+            day = name[len('changes-'):-len('.jsonl')]
+            if since_day and day < since_day:
+                continue
+            if until and day > until.strftime('%Y%m%d'):
+                break
+            with open(os.path.join(self.log_dir, name), encoding='utf-8') as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        break  # Torn write from a crash mid-append
+                    entry = json.loads(line)
+                    ts = datetime.fromisoformat(entry['ts'])
+                    if since and ts < since:
+                        continue
+                    if until and ts > until:
+                        continue
+                    yield entry
+
+    def prune(self, before: datetime) -> int:
+        """Delete segments that end before the given time (older than the oldest snapshot)"""
+        removed = 0
+        for name in self.segments():
+            if name[len('changes-'):-len('.jsonl')] < before.strftime('%Y%m%d'):
+                os.remove(os.path.join(self.log_dir, name))
+                removed += 1
+        return removed
+
+
+# Global change log instance
+change_log = ChangeLog()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Query-plan checks for the hot queries in db_service
+
+Runs each hot service call, captures the SQL it sends, EXPLAINs every
+statement and fails if any of them reads a table without an index. Some
+checks also require a specific index (e.g. the lower(custom_id) expression
+index for identifier lookups).
+
+By default a scratch SQLite database is filled with sample data. Pass --url
+to check a real database instead; on PostgreSQL the checks run with
+enable_seqscan=off so that small tables still show whether an index can
+serve the query. SQLite has no such switch and scans tiny tables on
+purpose, so a SQLite database passed with --url needs realistic row counts.
+Only read-only service calls are used. --partitioned converts the scratch
+database's rental history into monthly partitions (history_partitions.py)
+first; scans of a partition count as scans of rental_history.
+
+    python check_query_plans.py [--url URL] [--rows N] [--partitioned]
+
+Exits with status 1 if any check fails.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+parser = argparse.ArgumentParser(description='Check that hot db_service queries use indexes')
+parser.add_argument('--url', help='database to check (default: scratch SQLite database with sample data)')
+parser.add_argument('--rows', type=int, default=20000, help='sample cylinders for the scratch database')
+parser.add_argument('--partitioned', action='store_true', help='partition the scratch rental history by month')
+args = parser.parse_args()
+
+scratch_dir = None
+if args.url:
+    os.environ['DATABASE_URL'] = args.url
+else:
+    scratch_dir = tempfile.TemporaryDirectory()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(scratch_dir.name, 'plans.db')}"
+
+from sqlalchemy import event, insert
+
+from db_models import engine, Base, Customer, Cylinder, RentalHistory
+from db_service import CustomerService, CylinderService, RentalHistoryService, TableVersionService
+
+_SQLITE_TABLE_SCAN = re.compile(r'^SCAN (\w+)$')
+_SQLITE_SUBQUERY = re.compile(r'^(?:CO-ROUTINE|MATERIALIZE) (\w+)$')
+_HISTORY_PARTITION = re.compile(r'^rental_history_(?:p\d{6}|default)$')
+
+
+_PARTITION_INDEX_SUFFIX = re.compile(r'_(?:p\d{6}|default)$')
+
+# Aggregates over all history; on SQLite they read every partition of the view
+# (a UNION ALL view can't be answered from covering indexes), still one pass
+WHOLE_HISTORY_AGGREGATES = {'rental history page', 'rental history customer list'}
+
+
+def table_of(name):
+    """Table a scanned relation belongs to (partitions map to rental_history)"""
+    return 'rental_history' if _HISTORY_PARTITION.match(name) else name
+
+
+def index_of(name):
+    """Model index name of a partition's copy (idx_..._p202610 -> idx_...)"""
+    return _PARTITION_INDEX_SUFFIX.sub('', name) if '_rental' in name else name
+
+
+def seed(rows):
+    """Fill the scratch database: customers, cylinders (a third rented) and two history rows per cylinder"""
+    Base.metadata.create_all(engine)
+    now = datetime.utcnow()
+    customers = [{'id': f'C{i}', 'customer_no': f'CN{i:05d}', 'customer_name': f'Customer {i}'}
+                 for i in range(max(rows // 20, 1))]
+    cylinders = []
+    history = []
+    for i in range(rows):
+        customer = customers[i % len(customers)]
+        rented = i % 3 == 0
+        cylinders.append({
+            'id': f'Y{i}', 'custom_id': f'CYL-{i:05d}', 'serial_number': f'SN{i:07d}',
+            'status': 'rented' if rented else 'available',
+            'rented_to': customer['id'] if rented else None,
+            'customer_no': customer['customer_no'] if rented else None,
+            'date_borrowed': now - timedelta(days=i % 500) if rented else None,
+        })
+        for n in range(2):
+            history.append({
+                'id': f'H{i}-{n}', 'customer_id': customer['id'], 'customer_no': customer['customer_no'],
+                'cylinder_id': f'Y{i}', 'status': 'completed',
+                'dispatch_date': now - timedelta(days=(i + n) % 170 + 10),
+                'return_date': now - timedelta(days=(i + n) % 170),
+            })
+    with engine.begin() as connection:
+        connection.execute(insert(Customer), customers)
+        connection.execute(insert(Cylinder), cylinders)
+        connection.execute(insert(RentalHistory), history)
+        connection.exec_driver_sql('ANALYZE')
+
+
+class StatementCapture:
+    """Collects the SELECT statements sent while the block runs"""
+
+    def __enter__(self):
+        self.statements = []
+        event.listen(engine, 'before_cursor_execute', self._capture)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(engine, 'before_cursor_execute', self._capture)
+
+    def _capture(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            self.statements.append((statement, parameters))
+
+
+def explain(statement, parameters):
+    """(plan lines, table scans, index names) for one statement"""
+    tables = set(Base.metadata.tables)
+    with engine.connect() as connection:
+        cursor = connection.connection.cursor()
+        try:
+            if engine.dialect.name == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+                lines = [row[3] for row in cursor.fetchall()]
+                # Scanning a view's co-routine reads rows already filtered by its subqueries
+                subqueries = {m.group(1) for m in map(_SQLITE_SUBQUERY.match, lines) if m}
+                scans = {table_of(m.group(1)) for m in map(_SQLITE_TABLE_SCAN.match, lines)
+                         if m and m.group(1) not in subqueries and table_of(m.group(1)) in tables}
+                indexes = {index_of(name) for name in re.findall(r'USING (?:COVERING )?INDEX (\w+)', ' '.join(lines))}
+                return lines, scans, indexes
+            if engine.dialect.name == 'postgresql':
+                cursor.execute('SET enable_seqscan = off')
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters)
+                plan = cursor.fetchone()[0]
+                plan = json.loads(plan) if isinstance(plan, str) else plan
+                lines, scans, indexes = [], set(), set()
+                stack = [(plan[0]['Plan'], 0)]
+                while stack:
+                    node, depth = stack.pop()
+                    lines.append('  ' * depth + f"{node['Node Type']} {node.get('Relation Name', '')} "
+                                                 f"{node.get('Index Name', '')}".rstrip())
+                    if node['Node Type'] == 'Seq Scan' and table_of(node.get('Relation Name', '')) in tables:
+                        scans.add(table_of(node['Relation Name']))
+                    if node.get('Index Name'):
+                        indexes.add(node['Index Name'])
+                    stack.extend((child, depth + 1) for child in reversed(node.get('Plans', [])))
+                return lines, scans, indexes
+            raise SystemExit(f'Plan checks support SQLite and PostgreSQL, not {engine.dialect.name}')
+        finally:
+            cursor.close()
+
+
+def sample_ids():
+    with CylinderService() as service:
+        rented = service.get_all(filter_status='rented', per_page=1)[0][0]
+        return {
+            'customer_id': rented.rented_to,
+            'customer_no': rented.customer_no,
+            'cylinder_id': rented.id,
+            'custom_id': rented.custom_id,
+            'serial_number': rented.serial_number,
+        }
+
+
+def hot_queries(ids):
+    """(name, service class, call, indexes of which at least one must be used)"""
+    return [
+        ('rented cylinders, oldest first', CylinderService,
+         lambda service: service.get_all(filter_status='Rented'), None),
+        ('rented over 12 months', CylinderService,
+         lambda service: service.get_all(rental_duration_filter='over_12'), None),
+        ('active rentals export', CylinderService,
+         lambda service: list(service.stream_active_rentals()), None),
+        ('cylinders of a customer', CylinderService,
+         lambda service: service.get_by_customer(ids['customer_id']), None),
+        ('cylinder by custom ID (any case)', CylinderService,
+         lambda service: service.find_by_identifier(ids['custom_id'].lower()), {'idx_cylinder_custom_id_lower'}),
+        ('cylinder by serial number (any case)', CylinderService,
+         lambda service: service.find_by_identifier(ids['serial_number'].lower()), {'idx_cylinder_serial_lower'}),
+        ('cylinders by ID (batch)', CylinderService,
+         lambda service: service.get_many([ids['cylinder_id'], 'missing-id']), None),
+        ('status counts', CylinderService,
+         lambda service: service.get_status_counts(), None),
+        ('customer by number', CustomerService,
+         lambda service: service.get_by_customer_no(ids['customer_no']), None),
+        ('customer history', RentalHistoryService,
+         lambda service: service.get_customer_history(ids['customer_id']), None),
+        ('cylinder history', RentalHistoryService,
+         lambda service: service.get_for_cylinder(ids['cylinder_id']), {'idx_rental_cylinder_id_return'}),
+        ('rental history page', RentalHistoryService,
+         lambda service: service.get_all(page=2, per_page=100), None),
+        ('rental history of a customer', RentalHistoryService,
+         lambda service: service.get_all(customer_no=ids['customer_no'], per_page=50), None),
+        ('rental history by return date', RentalHistoryService,
+         lambda service: service.get_all(date_from=datetime.utcnow() - timedelta(days=7), per_page=50), None),
+        ('rental history customer list', RentalHistoryService,
+         lambda service: service.get_customer_options(), None),
+        ('table versions', TableVersionService,
+         lambda service: service.get_versions(['customers', 'cylinders']), None),
+    ]
+
+
+def main():
+    if scratch_dir is not None:
+        seed(args.rows)
+        if args.partitioned:
+            from history_partitions import history_partitions
+            result = history_partitions.partition()
+            print(f"Partitioned {result['rows']} history rows into {result['partitions']} months\n")
+
+    checks = hot_queries(sample_ids())
+    failures = 0
+    for name, service_class, call, required in checks:
+        with service_class() as service, StatementCapture() as capture:
+            call(service)
+        used, problems, details = set(), [], []
+        for statement, parameters in capture.statements:
+            lines, scans, indexes = explain(statement, parameters)
+            if args.partitioned and engine.dialect.name == 'sqlite' and name in WHOLE_HISTORY_AGGREGATES:
+                scans.discard('rental_history')
+            used |= indexes
+            details.extend(lines)
+            problems.extend(f'full scan of {table}' for table in sorted(scans))
+        if required and not used & required:
+            problems.append(f"expected index {' or '.join(sorted(required))}")
+        if not capture.statements:
+            problems.append('no SELECT captured')
+
+        if problems:
+            failures += 1
+            print(f"FAIL  {name}: {'; '.join(problems)}")
+            for line in details:
+                print(f"        {line}")
+        else:
+            print(f"ok    {name} ({', '.join(sorted(used)) or 'primary key'})")
+
+    print(f"\n{len(checks) - failures} passed, {failures} failed")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
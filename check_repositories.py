@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Conformance and timing checks for the repository backends (repository.py)
+
+Runs one scenario against every backend: the protocol methods are present,
+reads see writes, rent/return and the bulk operations change exactly the
+records they should (skipping missing IDs and cylinders in the wrong
+state). Then it times single-record loops against the bulk operations on
+the same backend, so a backend that loses its batching shows up here.
+
+    json        models.py in a scratch data/ directory
+    sqlalchemy  models_postgres.py on a scratch SQLite file (or --sqlalchemy-url)
+    mysql       models_mysql.py on a scratch SQLite file (or --mysql-url);
+                needs flask_sqlalchemy, skipped without it
+
+    python check_repositories.py [--backends json,sqlalchemy,mysql] [--rows N]
+
+Only point the URL options at disposable databases: the checks add and
+delete records. Exits with status 1 if any check fails.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from contextlib import nullcontext
+
+parser = argparse.ArgumentParser(description='Run repository conformance and timing checks')
+parser.add_argument('--backends', default='json,sqlalchemy,mysql')
+parser.add_argument('--rows', type=int, default=300, help='cylinders per timing run')
+parser.add_argument('--sqlalchemy-url', help='database for the SQLAlchemy backend (default: scratch SQLite)')
+parser.add_argument('--mysql-url', help='database for the MySQL backend (default: scratch SQLite)')
+args = parser.parse_args()
+
+# Every backend keeps its files (data/, logs/) relative to the working directory
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+scratch_dir = tempfile.TemporaryDirectory()
+os.chdir(scratch_dir.name)
+os.environ.setdefault('SCHEDULER_ENABLED', '0')
+
+from repository import CustomerRepository, CylinderRepository
+
+
+def json_backend():
+    import models
+    return models.Customer(), models.Cylinder(), nullcontext()
+
+
+def sqlalchemy_backend():
+    os.environ['DATABASE_URL'] = args.sqlalchemy_url or f"sqlite:///{os.path.join(scratch_dir.name, 'sqlalchemy.db')}"
+    import db_models
+    db_models.create_tables()
+    import models_postgres
+    return models_postgres.Customer(), models_postgres.Cylinder(), nullcontext()
+
+
+def mysql_backend():
+    # app_mysql_fixed reads DATABASE_URL and creates its tables on import
+    os.environ['DATABASE_URL'] = args.mysql_url or f"sqlite:///{os.path.join(scratch_dir.name, 'mysql.db')}"
+    import models_mysql
+    from app_mysql_fixed import app
+    return models_mysql.Customer(), models_mysql.Cylinder(), app.app_context()
+
+
+BACKENDS = {
+    'json': json_backend,
+    'sqlalchemy': sqlalchemy_backend,
+    'mysql': mysql_backend,
+}
+
+
+class Checks:
+    """Collects pass/fail results for one backend"""
+
+    def __init__(self):
+        self.failures = []
+        self.passed = 0
+
+    def expect(self, condition, message):
+        if condition:
+            self.passed += 1
+        else:
+            self.failures.append(message)
+
+
+def ids(records):
+    return {record['id'] for record in records}
+
+
+def check_conformance(customers, cylinders) -> Checks:
+    checks = Checks()
+    checks.expect(isinstance(customers, CustomerRepository), 'customer backend is missing protocol methods')
+    checks.expect(isinstance(cylinders, CylinderRepository), 'cylinder backend is missing protocol methods')
+    if checks.failures:
+        return checks
+
+    # Customers
+    before = customers.count()
+    customer = customers.add({'customer_no': 'CHK-0001', 'customer_name': 'Conformance Check Ltd',
+                              'customer_phone': '100', 'customer_city': 'Hyderabad'})
+    customer_id = customer.get('id')
+    checks.expect(customer_id, 'add() returns the record with its id')
+    checks.expect((customers.get_by_id(customer_id) or {}).get('customer_name') == 'Conformance Check Ltd',
+                  'get_by_id() sees the added customer')
+    checks.expect(customers.get_by_id('missing-id') is None, 'get_by_id() of a missing customer is None')
+    checks.expect(ids(customers.get_many([customer_id, 'missing-id', customer_id])) == {customer_id},
+                  'get_many() skips missing IDs and duplicates')
+    checks.expect(customer_id in ids(customers.search('conformance check')), 'search() is case-insensitive')
+    checks.expect(customers.count() == before + 1, 'count() includes the added customer')
+    checks.expect(customer_id in ids(customers.iter_all(batch_size=2)), 'iter_all() yields every customer')
+    updated = customers.update(customer_id, {**customer, 'customer_phone': '200'})
+    checks.expect(updated and updated.get('customer_phone') == '200', 'update() returns the changed customer')
+    checks.expect((customers.get_by_id(customer_id) or {}).get('customer_phone') == '200', 'update() is stored')
+    checks.expect(customers.update('missing-id', {'customer_phone': '1'}) is None,
+                  'update() of a missing customer is None')
+
+    # Cylinders
+    added = [cylinders.add({'custom_id': f'CHK-{n}', 'serial_number': f'SNCHK{n}', 'type': 'Medical Oxygen',
+                            'size': '40L', 'status': 'available', 'location': 'Warehouse'}) for n in range(3)]
+    first, second, third = (c['id'] for c in added)
+    checks.expect((cylinders.find_by_any_identifier('chk-1') or {}).get('id') == second,
+                  'find_by_any_identifier() matches custom IDs case-insensitively')
+    checks.expect((cylinders.find_by_any_identifier(' snchk2 ') or {}).get('id') == third,
+                  'find_by_any_identifier() matches serial numbers')
+    checks.expect((cylinders.find_by_any_identifier(first) or {}).get('id') == first,
+                  'find_by_any_identifier() matches system IDs')
+    checks.expect({first, second, third} <= ids(cylinders.search('chk-')), 'search() finds cylinders by custom ID')
+    checks.expect(ids(cylinders.get_many([third, 'missing-id', first])) == {first, third},
+                  'get_many() skips missing cylinder IDs')
+
+    checks.expect(cylinders.rent_cylinder(first, customer_id) is True, 'rent_cylinder() rents an available cylinder')
+    rented = cylinders.get_by_id(first) or {}
+    checks.expect((rented.get('status') or '').lower() == 'rented' and rented.get('rented_to') == customer_id,
+                  'rent_cylinder() is stored')
+    checks.expect(cylinders.rent_cylinder(first, customer_id) is False, 'rent_cylinder() refuses a rented cylinder')
+    checks.expect(cylinders.rent_cylinder(second, 'missing-id') is False,
+                  'rent_cylinder() refuses an unknown customer')
+    checks.expect(first in ids(cylinders.get_by_customer(customer_id)), "get_by_customer() lists the customer's cylinders")
+    checks.expect(set(cylinders.bulk_rent([first, second, third, 'missing-id'], customer_id)) == {second, third},
+                  'bulk_rent() rents only the available cylinders')
+    checks.expect(cylinders.bulk_rent([first], 'missing-id') == [], 'bulk_rent() refuses an unknown customer')
+
+    checks.expect(cylinders.return_cylinder(first) is True, 'return_cylinder() returns a rented cylinder')
+    returned = cylinders.get_by_id(first) or {}
+    checks.expect((returned.get('status') or '').lower() == 'available' and not returned.get('rented_to'),
+                  'return_cylinder() is stored')
+    checks.expect(set(cylinders.bulk_return([first, second, third, 'missing-id'])) == {second, third},
+                  'bulk_return() returns only the rented cylinders')
+    checks.expect(all((c.get('status') or '').lower() == 'available' for c in cylinders.get_many([second, third])),
+                  'bulk_return() is stored')
+
+    checks.expect(cylinders.bulk_update({first: {'location': 'Dock 4'}, 'missing-id': {'location': 'x'}}) == 1,
+                  'bulk_update() counts the cylinders it changed')
+    checks.expect((cylinders.get_by_id(first) or {}).get('location') == 'Dock 4', 'bulk_update() is stored')
+    updated = cylinders.update(first, {**cylinders.get_by_id(first), 'location': 'Dock 5'})
+    checks.expect(updated and updated.get('location') == 'Dock 5', 'update() returns the changed cylinder')
+
+    for cylinder_id in (first, second, third):
+        checks.expect(cylinders.delete(cylinder_id) is True, 'delete() removes a cylinder')
+    checks.expect(cylinders.get_by_id(first) is None, 'deleted cylinders are gone')
+    checks.expect(cylinders.delete(first) is False, 'delete() of a missing cylinder is False')
+    checks.expect(customers.delete(customer_id) is True, 'delete() removes a customer')
+    checks.expect(customers.delete(customer_id) is False, 'delete() of a missing customer is False')
+    return checks
+
+
+def timed(operation):
+    started = time.perf_counter()
+    operation()
+    return time.perf_counter() - started
+
+
+def time_bulk_operations(customers, cylinders, rows):
+    """(operation, loop seconds per item, bulk seconds per item) on two halves of fresh cylinders"""
+    customer_id = customers.add({'customer_no': 'CHK-TIMING', 'customer_name': 'Timing Check'})['id']
+    cylinder_ids = [cylinders.add({'custom_id': f'TIME-{n}', 'serial_number': f'SNTIME{n}',
+                                   'status': 'available'})['id'] for n in range(rows)]
+    looped, bulk = cylinder_ids[:rows // 2], cylinder_ids[rows // 2:]
+
+    results = [
+        ('get', timed(lambda: [cylinders.get_by_id(i) for i in looped]) / len(looped),
+         timed(lambda: cylinders.get_many(bulk)) / len(bulk)),
+        ('rent', timed(lambda: [cylinders.rent_cylinder(i, customer_id) for i in looped]) / len(looped),
+         timed(lambda: cylinders.bulk_rent(bulk, customer_id)) / len(bulk)),
+        ('return', timed(lambda: [cylinders.return_cylinder(i) for i in looped]) / len(looped),
+         timed(lambda: cylinders.bulk_return(bulk)) / len(bulk)),
+    ]
+
+    for cylinder_id in cylinder_ids:
+        cylinders.delete(cylinder_id)
+    customers.delete(customer_id)
+    return results
+
+
+def main():
+    failed = False
+    for name in args.backends.split(','):
+        name = name.strip()
+        try:
+            customers, cylinders, context = BACKENDS[name]()
+        except ImportError as e:
+            print(f"-- {name}: skipped ({e})")
+            continue
+
+        with context:
+            checks = check_conformance(customers, cylinders)
+            print(f"== {name}: {checks.passed} passed, {len(checks.failures)} failed")
+            for failure in checks.failures:
+                print(f"   FAIL  {failure}")
+            failed = failed or bool(checks.failures)
+            if checks.failures:
+                continue
+
+            print(f"   {'operation':<10}{'loop ms/item':>14}{'bulk ms/item':>14}{'speedup':>10}")
+            for operation, loop, bulk in time_bulk_operations(customers, cylinders, args.rows):
+                print(f"   {operation:<10}{loop * 1000:>14.3f}{bulk * 1000:>14.3f}{loop / bulk:>9.1f}x")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,335 @@
+# customer_reports.py - Per-customer statement reports
+"""
+Per-customer reports (CSV and PDF)
+
+Rendering is plain functions returning bytes so the same code serves the
+single-customer download and the month-end batch. The batch job splits
+customers into partitions, loads each partition's cylinders and history
+with one grouped query per table, renders the partition in a process pool
+worker and streams the finished files into one ZIP download.
+"""
+
+import csv
+import io
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import groupby
+from typing import Dict, Iterator, List, Tuple
+
+from pdf_reports import init_worker
+
+# Customers rendered per pool task
+PARTITION_SIZE = 25
+
+
+def customer_display_name(customer: Dict) -> str:
+    return customer.get('customer_name') or customer.get('name', 'Unknown Customer')
+
+
+def safe_customer_name(customer: Dict) -> str:
+    """Customer name usable in a filename"""
+    return customer_display_name(customer).replace(' ', '_').replace('/', '_')
+
+
+def _history_to_dict(record) -> Dict:
+    """Fields of a rental history record used in the reports"""
+    return {
+        'cylinder_id': record.cylinder_custom_id or record.cylinder_serial or '',
+        'cylinder_type': record.cylinder_type or '',
+        'cylinder_size': record.cylinder_size or '',
+        'dispatch_date': (record.dispatch_date or record.date_borrowed).strftime('%Y-%m-%d') if (record.dispatch_date or record.date_borrowed) else '',
+        'return_date': (record.return_date or record.date_returned).strftime('%Y-%m-%d') if (record.return_date or record.date_returned) else '',
+        'rental_days': record.rental_days or 0
+    }
+
+
+def load_report_data(customer_ids: List[str]) -> List[Tuple[Dict, List[Dict], List[Dict]]]:
+    """Load (customer, cylinders, history) for a group of customers with one query per table"""
+    from db_models import Customer as CustomerRecord
+    from db_service import CustomerService, CylinderService, RentalHistoryService
+    from models_postgres import Customer, Cylinder
+
+    customer_model = Customer()
+    cylinder_model = Cylinder()
+
+    with CustomerService() as service:
+        records = service.db.query(CustomerRecord).filter(CustomerRecord.id.in_(customer_ids)).all()
+        customers = {record.id: customer_model._to_dict(record) for record in records}
+
+    with CylinderService() as service:
+        cylinders_by_customer = {
+            customer_id: [cylinder_model._to_dict(c) for c in group]
+            for customer_id, group in groupby(service.get_by_customers(customer_ids), key=lambda c: c.rented_to)
+        }
+
+    id_by_customer_no = {c['customer_no']: c['id'] for c in customers.values() if c.get('customer_no')}
+    history_by_customer = {}
+    with RentalHistoryService() as service:
+        for record in service.get_for_customers(customer_ids, list(id_by_customer_no)):
+            customer_id = record.customer_id if record.customer_id in customers else id_by_customer_no.get(record.customer_no)
+            history_by_customer.setdefault(customer_id, []).append(_history_to_dict(record))
+
+    report_data = []
+    for customer_id in customer_ids:
+        if customer_id not in customers:
+            continue
+        cylinders = cylinders_by_customer.get(customer_id, [])
+        # Longest rentals first
+        cylinders.sort(key=lambda x: x.get('rental_days', 0), reverse=True)
+        report_data.append((customers[customer_id], cylinders, history_by_customer.get(customer_id, [])))
+    return report_data
+
+
+def _summary(customer_cylinders: List[Dict]) -> List[Tuple[str, int]]:
+    total_days = sum(c.get('rental_days', 0) for c in customer_cylinders)
+    return [
+        ('Total Cylinders:', len(customer_cylinders)),
+        ('Average Days Dispatched:', total_days // len(customer_cylinders)),
+        ('Longest Dispatch (Days):', max(c.get('rental_days', 0) for c in customer_cylinders)),
+        ('Long-term Dispatches (90+ days):', len([c for c in customer_cylinders if c.get('rental_days', 0) > 90]))
+    ]
+
+
+def render_customer_csv(customer: Dict, customer_cylinders: List[Dict], history: List[Dict]) -> bytes:
+    """Render a customer report as CSV"""
+    from models_postgres import Cylinder
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+
+    customer_name = customer_display_name(customer)
+
+    # Customer details header
+    writer.writerow([f'=== CUSTOMER REPORT: {customer_name} ==='])
+    writer.writerow(['Generated:', datetime.now().strftime('%Y-%m-%d %H:%M:%S')])
+    writer.writerow([])
+
+    # Customer information
+    writer.writerow(['=== CUSTOMER DETAILS ==='])
+    writer.writerow(['Customer No:', customer.get('customer_no', '')])
+    writer.writerow(['Name:', customer_name])
+    writer.writerow(['Phone:', customer.get('customer_phone') or customer.get('phone', '')])
+    writer.writerow(['Email:', customer.get('customer_email') or customer.get('email', '')])
+    writer.writerow(['Address:', customer.get('customer_address') or customer.get('address', '')])
+    writer.writerow(['City:', customer.get('customer_city', '')])
+    writer.writerow(['State:', customer.get('customer_state', '')])
+    writer.writerow(['Total Dispatched Cylinders:', len(customer_cylinders)])
+    writer.writerow([])
+
+    # Dispatched cylinders sorted by rental days
+    writer.writerow(['=== DISPATCHED CYLINDERS (Sorted by Days Dispatched - Longest First) ==='])
+    writer.writerow(['ID', 'Serial Number', 'Type', 'Size', 'Status',
+                    'Date Dispatched', 'Days Dispatched', 'Location', 'Pressure'])
+
+    cylinder_model = Cylinder()
+    for cylinder in customer_cylinders:
+        display_id = cylinder_model.get_display_id(cylinder)
+        # Format dispatch date properly
+        dispatch_date = cylinder.get('date_borrowed', '') or cylinder.get('rental_date', '')
+        if dispatch_date and len(dispatch_date) >= 10:
+            dispatch_date = dispatch_date[:10]  # Extract YYYY-MM-DD part
+
+        writer.writerow([
+            display_id,
+            cylinder.get('serial_number', ''),
+            cylinder.get('type', ''),
+            cylinder.get('size', ''),
+            cylinder.get('status', ''),
+            dispatch_date,
+            cylinder.get('rental_days', 0),
+            cylinder.get('location', ''),
+            cylinder.get('pressure', '')
+        ])
+
+    # Past rentals from history
+    if history:
+        writer.writerow([])
+        writer.writerow(['=== RETURNED CYLINDERS ==='])
+        writer.writerow(['ID', 'Type', 'Size', 'Date Dispatched', 'Date Returned', 'Days Dispatched'])
+        for record in history:
+            writer.writerow([record['cylinder_id'], record['cylinder_type'], record['cylinder_size'],
+                             record['dispatch_date'], record['return_date'], record['rental_days']])
+
+    # Summary statistics
+    writer.writerow([])
+    writer.writerow(['=== SUMMARY STATISTICS ==='])
+    if customer_cylinders:
+        for label, value in _summary(customer_cylinders):
+            writer.writerow([label, value])
+    else:
+        writer.writerow(['No cylinders currently dispatched to this customer'])
+
+    return output.getvalue().encode('utf-8')
+
+
+def render_customer_pdf(customer: Dict, customer_cylinders: List[Dict], history: List[Dict]) -> bytes:
+    """Render a customer report as PDF"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate, LongTable, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib import colors
+    from reportlab.lib.units import inch
+    from models_postgres import Cylinder
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
+
+    # Build story
+    story = []
+    styles = getSampleStyleSheet()
+
+    details_style = TableStyle([
+        ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
+        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+        ('BACKGROUND', (1, 0), (1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ])
+    list_style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ])
+
+    # Title
+    customer_name = customer_display_name(customer)
+    title_style = ParagraphStyle('CustomTitle', parent=styles['Heading1'], fontSize=18, spaceAfter=30)
+    story.append(Paragraph(f"Customer Report: {customer_name}", title_style))
+    story.append(Paragraph(f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", styles['Normal']))
+    story.append(Spacer(1, 20))
+
+    # Customer Details
+    story.append(Paragraph("Customer Details", styles['Heading2']))
+    customer_data = [
+        ['Customer No:', customer.get('customer_no', '')],
+        ['Name:', customer_name],
+        ['Phone:', customer.get('customer_phone') or customer.get('phone', '')],
+        ['Email:', customer.get('customer_email') or customer.get('email', '')],
+        ['Address:', customer.get('customer_address') or customer.get('address', '')],
+        ['City:', customer.get('customer_city', '')],
+        ['State:', customer.get('customer_state', '')],
+        ['Total Dispatched Cylinders:', str(len(customer_cylinders))]
+    ]
+
+    customer_table = Table(customer_data, colWidths=[2*inch, 4*inch])
+    customer_table.setStyle(details_style)
+    story.append(customer_table)
+    story.append(Spacer(1, 20))
+
+    # Dispatched Cylinders
+    if customer_cylinders:
+        story.append(Paragraph("Dispatched Cylinders (Sorted by Days Dispatched)", styles['Heading2']))
+
+        cylinder_data = [['ID', 'Type', 'Size', 'Days Dispatched', 'Date Dispatched']]
+        cylinder_model = Cylinder()
+        for cylinder in customer_cylinders:
+            display_id = cylinder_model.get_display_id(cylinder)
+            cylinder_data.append([
+                str(display_id),
+                str(cylinder.get('type', '')),
+                str(cylinder.get('size', '')),
+                str(cylinder.get('rental_days', 0)),
+                str(cylinder.get('date_borrowed', ''))
+            ])
+
+        cylinder_table = LongTable(cylinder_data, colWidths=[1*inch, 1.5*inch, 1.2*inch, 1.5*inch, 1.8*inch], repeatRows=1)
+        cylinder_table.setStyle(list_style)
+        story.append(cylinder_table)
+        story.append(Spacer(1, 20))
+
+    if history:
+        story.append(Paragraph("Returned Cylinders", styles['Heading2']))
+        history_data = [['ID', 'Type', 'Size', 'Date Dispatched', 'Date Returned', 'Days']]
+        for record in history:
+            history_data.append([record['cylinder_id'], record['cylinder_type'], record['cylinder_size'],
+                                 record['dispatch_date'], record['return_date'], str(record['rental_days'])])
+        history_table = LongTable(history_data, repeatRows=1)
+        history_table.setStyle(list_style)
+        story.append(history_table)
+        story.append(Spacer(1, 20))
+
+    if customer_cylinders:
+        # Summary Statistics
+        story.append(Paragraph("Summary Statistics", styles['Heading2']))
+        summary_table = Table([[label, str(value)] for label, value in _summary(customer_cylinders)],
+                              colWidths=[3*inch, 2*inch])
+        summary_table.setStyle(details_style)
+        story.append(summary_table)
+    else:
+        story.append(Paragraph("No cylinders currently dispatched to this customer", styles['Normal']))
+
+    doc.build(story)
+    return buffer.getvalue()
+
+
+RENDERERS = {'csv': render_customer_csv, 'pdf': render_customer_pdf}
+
+
+def render_partition(customer_ids: List[str], export_format: str) -> List[Tuple[Dict, bytes]]:
+    """Render reports for one partition of customers (runs inside a pool worker)"""
+    render = RENDERERS[export_format]
+    return [(customer, render(customer, cylinders, history))
+            for customer, cylinders, history in load_report_data(customer_ids)]
+
+
+class _ChunkSink:
+    """Write-only file object collecting ZIP output between yields (not seekable)"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def generate_customer_reports_zip(export_format: str, max_workers: int = 2) -> Iterator[bytes]:
+    """Render every customer's report in a process pool and stream them as one ZIP"""
+    from db_models import Customer as CustomerRecord
+    from db_service import CustomerService
+
+    with CustomerService() as service:
+        customer_ids = [row[0] for row in service.db.query(CustomerRecord.id).order_by(CustomerRecord.customer_name)]
+    partitions = [customer_ids[i:i + PARTITION_SIZE] for i in range(0, len(customer_ids), PARTITION_SIZE)]
+
+    sink = _ChunkSink()
+    used_names = set()
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker) as executor, \
+            zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as bundle:
+        # Keep a bounded number of partitions in flight so finished reports don't pile up in memory
+        pending = [executor.submit(render_partition, p, export_format) for p in partitions[:max_workers * 2]]
+        next_partition = len(pending)
+        while pending:
+            results = pending.pop(0).result()
+            if next_partition < len(partitions):
+                pending.append(executor.submit(render_partition, partitions[next_partition], export_format))
+                next_partition += 1
+
+            for customer, data in results:
+                name = f"{customer.get('customer_no') or customer['id']}_{safe_customer_name(customer)}.{export_format}"
+                if name in used_names:
+                    name = f"{customer['id']}_{name}"
+                used_names.add(name)
+                bundle.writestr(name, data)
+                chunk = sink.drain()
+                if chunk:
+                    yield chunk
+    # Central directory is written when the ZIP closes
+    yield sink.drain()
@@ -156,13 +156,13 @@ class DataImporter:
                             # Normalize status values
                             value_lower = value.lower()
                             if value_lower in ['available', 'in stock', 'ready']:
-                                value = 'Available'
+                                value = 'available'
                             elif value_lower in ['rented', 'out', 'in use']:
-                                value = 'Rented'
+                                value = 'rented'
                             elif value_lower in ['maintenance', 'repair', 'servicing']:
-                                value = 'Maintenance'
+                                value = 'maintenance'
                             elif value_lower in ['out of service', 'retired', 'damaged']:
-                                value = 'Out of Service'
+                                value = 'out of service'
                         
                         cylinder_data[target_field] = value
                 
@@ -171,7 +171,7 @@ class DataImporter:
                     cylinder_data['location'] = 'Warehouse'
                 
                 if not cylinder_data.get('status'):
-                    cylinder_data['status'] = 'Available'
+                    cylinder_data['status'] = 'available'
                 
                 # Set default type if not provided
                 if not cylinder_data.get('type'):
@@ -346,7 +346,7 @@ class DataImporter:
                 if return_dt:
                     # Complete cycle - return to warehouse
                     cylinder_updates[cyl_id] = {
-                        'status': 'Available',
+                        'status': 'available',
                         'location': 'Warehouse',
                         'rented_to': None,
                         'rental_date': None,
@@ -359,7 +359,7 @@ class DataImporter:
                 else:
                     # Dispatch only
                     cylinder_updates[cyl_id] = {
-                        'status': 'Rented',
+                        'status': 'rented',
                         'location': customer.get('customer_address', 'Customer Location'),
                         'rented_to': cust_id,
                         'rental_date': dispatch,
@@ -1,11 +1,15 @@
 # db_models.py - PostgreSQL database models using SQLAlchemy
 import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Boolean, ForeignKey, Index
+from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, Index, event, update, func, text, inspect
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import Session, sessionmaker, relationship, validates
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
+from db_engine import create_app_engine
 
 # Load environment variables from .env file for local development
 def load_environment():
@@ -30,10 +34,87 @@ if not DATABASE_URL:
     DATABASE_URL = 'sqlite:///oxygen_tracker.db'
     print("Warning: Using SQLite fallback database for local development")
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_recycle=300)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Per-dialect pragmas, pool sizing and statement timeouts (see db_engine.py)
+engine = create_app_engine(DATABASE_URL)
+
+# Optional read replica for dashboards, reports and exports. Locally, point it
+# at a copy of the SQLite file (or a second Postgres) to try the routing out.
+READ_REPLICA_URL = os.environ.get('READ_REPLICA_URL')
+# After a write, reads stay on the primary this long so users see their own changes
+REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', '5'))
+replica_engine = create_app_engine(READ_REPLICA_URL) if READ_REPLICA_URL else None
+
+# Wall-clock time until which reads in this context stay on the primary
+_primary_until = ContextVar('primary_until', default=0.0)
+# Nesting depth of primary_only() blocks in this context
+_primary_depth = ContextVar('primary_depth', default=0)
+
+def primary_pinned_until() -> float:
+    """Time until which reads in this context stay on the primary"""
+    return _primary_until.get()
+
+def pin_to_primary(until: float = None):
+    """Keep reads in this context on the primary until the given time (default: sticky window from now)"""
+    _primary_until.set(until if until is not None else time.time() + REPLICA_STICKY_SECONDS)
+
+@contextmanager
+def replica_reads(session):
+    """Send this session's SELECTs to the read replica inside the block"""
+    session.info['replica_reads'] = session.info.get('replica_reads', 0) + 1
+    try:
+        yield session
+    finally:
+        session.info['replica_reads'] -= 1
+
+@contextmanager
+def primary_only():
+    """Keep every session's reads on the primary inside the block (read-modify-write)"""
+    token = _primary_depth.set(_primary_depth.get() + 1)
+    try:
+        yield
+    finally:
+        _primary_depth.reset(token)
+
+class RoutingSession(Session):
+    """Session that sends replica_reads() SELECTs to the read replica when that is safe"""
+    
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if (replica_engine is not None
+                and self.info.get('replica_reads', 0) > 0
+                and getattr(clause, 'is_select', False)
+                and not self._flushing
+                and not self.info.get('wrote')
+                and _primary_depth.get() == 0
+                and time.time() >= _primary_until.get()):
+            return replica_engine
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Partial and expression indexes are created on these dialects only
+EXPRESSION_INDEX_DIALECTS = ('postgresql', 'sqlite')
+
+def normalize_status(value):
+    """Statuses are stored lower-case ('rented', 'available', ...) so plain indexes serve them"""
+    return value.strip().lower() if isinstance(value, str) else value
+
+def normalize_email(value):
+    """Emails are stored trimmed and lower-case (blank as NULL) so uniqueness ignores case"""
+    return (value.strip().lower() or None) if isinstance(value, str) else value
+
+def existing_index_names(bind, table_name) -> set:
+    """Names of the indexes on a table (bind is an engine), including expression indexes"""
+    if bind.dialect.name == 'sqlite':
+        # SQLite reflection skips expression indexes, so read the catalog directly
+        with bind.connect() as connection:
+            rows = connection.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"),
+                {'table': table_name}
+            )
+            return {row[0] for row in rows}
+    return {index['name'] for index in inspect(bind).get_indexes(table_name)}
+
 class Customer(Base):
     """Customer model for PostgreSQL"""
     __tablename__ = 'customers'
@@ -53,7 +134,8 @@ class Customer(Base):
     
     # Relationships
     cylinders = relationship("Cylinder", back_populates="customer")
-    rental_history = relationship("RentalHistory", back_populates="customer")
+    # CustomerService.delete() nulls customer_id with one bulk UPDATE; the ORM can't update rows through SQLite's partition view
+    rental_history = relationship("RentalHistory", back_populates="customer", passive_deletes=True)
 
 class Cylinder(Base):
     """Cylinder model for PostgreSQL"""
@@ -86,11 +168,22 @@ class Cylinder(Base):
     # Relationships
     customer = relationship("Customer", back_populates="cylinders")
     
+    @validates('status')
+    def _normalize_status(self, key, value):
+        return normalize_status(value)
+    
     # Indexes for performance
     __table_args__ = (
         Index('idx_cylinder_status_rented_to', 'status', 'rented_to'),
         Index('idx_cylinder_customer_no', 'customer_no'),
         Index('idx_cylinder_dates', 'date_borrowed', 'date_returned'),
+        # Rented list and export, oldest rental first
+        Index('idx_cylinder_rented_since', 'date_borrowed',
+              postgresql_where=text("status = 'rented'"),
+              sqlite_where=text("status = 'rented'")).ddl_if(dialect=EXPRESSION_INDEX_DIALECTS),
+        # Case-insensitive identifier lookups (scanner input, imports)
+        Index('idx_cylinder_custom_id_lower', func.lower(custom_id)).ddl_if(dialect=EXPRESSION_INDEX_DIALECTS),
+        Index('idx_cylinder_serial_lower', func.lower(serial_number)).ddl_if(dialect=EXPRESSION_INDEX_DIALECTS),
     )
 
 class RentalHistory(Base):
@@ -131,13 +224,144 @@ class RentalHistory(Base):
     # Relationships
     customer = relationship("Customer", back_populates="rental_history")
     
+    @validates('status')
+    def _normalize_status(self, key, value):
+        return normalize_status(value)
+    
     # Indexes for performance
     __table_args__ = (
         Index('idx_rental_customer_dates', 'customer_no', 'dispatch_date', 'return_date'),
         Index('idx_rental_cylinder_dates', 'cylinder_no', 'dispatch_date'),
         Index('idx_rental_status_dates', 'status', 'return_date'),
+        Index('idx_rental_cylinder_id_return', 'cylinder_id', 'return_date'),
+    )
+
+@event.listens_for(RentalHistory, 'before_update')
+def _refuse_partition_view_update(mapper, connection, target):
+    """Fail clearly instead of with StaleDataError on SQLite's partitioned rental_history
+
+    The INSTEAD OF trigger behind the view reports no row count, so the
+    flush can't confirm the UPDATE. Use query.update() with a change log
+    record_update_where() entry instead.
+    """
+    if connection.dialect.name == 'sqlite' and connection.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = 'rental_history'"
+    )).first() is not None:
+        raise RuntimeError("rental_history is partitioned: change history rows with query.update(), "
+                           "not by modifying loaded objects")
+
+class User(Base):
+    """Application login account"""
+    __tablename__ = 'users'
+    
+    id = Column(String, primary_key=True, default=lambda: f"USER-{uuid.uuid4().hex[:8].upper()}")
+    username = Column(String, nullable=False, unique=True, index=True)
+    email = Column(String, unique=True, index=True)
+    password_hash = Column(String, nullable=False)
+    role = Column(String, nullable=False, default='viewer')
+    is_active = Column(Boolean, nullable=False, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    last_login = Column(DateTime)
+    
+    @validates('email')
+    def _normalize_email(self, key, value):
+        return normalize_email(value)
+    
+    __table_args__ = (
+        # Case-insensitive uniqueness also for writes that bypass the validator
+        Index('idx_users_email_lower', func.lower(email), unique=True).ddl_if(dialect=EXPRESSION_INDEX_DIALECTS),
     )
 
+class TableVersion(Base):
+    """Per-table write-version counter, bumped in the same transaction as every write"""
+    __tablename__ = 'table_versions'
+    
+    table_name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+# Tables whose writes are tracked by TableVersion
+VERSIONED_TABLES = ('customers', 'cylinders', 'rental_history', 'users')
+
+_version_table_ready = False
+
+def _ensure_version_table(connection):
+    """Create the table_versions table on first use (existing databases predate it)"""
+    global _version_table_ready
+    if not _version_table_ready:
+        TableVersion.__table__.create(bind=connection, checkfirst=True)
+        _version_table_ready = True
+
+def _written_tables(session):
+    """Collect versioned table names touched by this session's transaction"""
+    return session.info.setdefault('written_tables', set())
+
+@event.listens_for(SessionLocal, 'after_flush')
+def _track_flushed_tables(session, flush_context):
+    """Remember which tables were written by each flush"""
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, '__table__', None)
+        if table is not None and table.name in VERSIONED_TABLES:
+            _written_tables(session).add(table.name)
+
+@event.listens_for(SessionLocal, 'do_orm_execute')
+def _track_bulk_statements(orm_execute_state):
+    """Remember tables written by bulk query.update()/query.delete() calls"""
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.local_table.name in VERSIONED_TABLES:
+            _written_tables(orm_execute_state.session).add(mapper.local_table.name)
+
+@event.listens_for(SessionLocal, 'before_commit')
+def _bump_table_versions(session):
+    """Increment the version counter of every table written in this transaction"""
+    session.flush()
+    tables = session.info.pop('written_tables', set())
+    if not tables:
+        return
+    
+    connection = session.connection()
+    _ensure_version_table(connection)
+    now = datetime.utcnow()
+    for table_name in sorted(tables):
+        result = connection.execute(
+            update(TableVersion.__table__)
+            .where(TableVersion.__table__.c.table_name == table_name)
+            .values(version=TableVersion.__table__.c.version + 1, updated_at=now)
+        )
+        if result.rowcount == 0:
+            connection.execute(
+                TableVersion.__table__.insert().values(table_name=table_name, version=1, updated_at=now)
+            )
+
+@event.listens_for(SessionLocal, 'after_rollback')
+def _discard_table_versions(session):
+    """Forget pending table writes when the transaction is rolled back"""
+    session.info.pop('written_tables', None)
+
+@event.listens_for(SessionLocal, 'after_flush')
+def _mark_session_wrote(session, flush_context):
+    """A session with pending writes reads from the primary until it commits"""
+    session.info['wrote'] = True
+
+@event.listens_for(SessionLocal, 'do_orm_execute')
+def _mark_bulk_write(orm_execute_state):
+    """Bulk insert/update/delete statements count as writes too"""
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['wrote'] = True
+
+@event.listens_for(SessionLocal, 'after_commit')
+def _stick_to_primary(session):
+    """Read-your-writes: after a committed write, this context reads from the primary for a while"""
+    if session.info.pop('wrote', False):
+        pin_to_primary()
+
+@event.listens_for(SessionLocal, 'after_rollback')
+def _forget_write(session):
+    """Discard the write marker when the transaction is rolled back"""
+    session.info.pop('wrote', None)
+
 def create_tables():
     """Create all database tables"""
     Base.metadata.create_all(bind=engine)
@@ -1,11 +1,100 @@
 # db_service.py - Database service layer for PostgreSQL operations
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Tuple, Iterator
 from datetime import datetime, timedelta
-from sqlalchemy import func, and_, or_, desc, asc, case
+from functools import wraps
+from inspect import isgeneratorfunction
+from sqlalchemy import DateTime, func, and_, or_, desc, asc, case, select, inspect
 from sqlalchemy.orm import Session
-from db_models import get_db_session, Customer, Cylinder, RentalHistory
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+from db_models import existing_index_names, get_db_session, normalize_email, normalize_status, primary_only, replica_reads, Customer, Cylinder, RentalHistory, TableVersion, User
+from change_log import copy_from_statement, record_copy_from, record_delete_where, record_update_where
+import threading
 import uuid
 
+# Ids per IN (...) list for batch gets and bulk writes
+BATCH_GET_SIZE = 500
+
+# Customer columns copied onto a cylinder when it is rented (same names on both tables)
+CYLINDER_CUSTOMER_FIELDS = ('customer_name', 'customer_email', 'customer_phone', 'customer_no',
+                            'customer_city', 'customer_state')
+
+def _parse_date(value=None) -> datetime:
+    """Parse an ISO date from a form or API call; now if missing or invalid"""
+    if isinstance(value, datetime):
+        return value
+    if value:
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            pass
+    return datetime.utcnow()
+
+def _assign(record, data: Dict):
+    """Copy known column values from form/API data onto a record
+
+    Date strings are parsed, blank dates and blank foreign keys become NULL
+    and primary keys are never changed.
+    """
+    columns = record.__table__.columns
+    for key, value in data.items():
+        column = columns.get(key)
+        if column is None or column.primary_key:
+            continue
+        if isinstance(value, str) and not value.strip() and column.foreign_keys:
+            value = None
+        elif isinstance(value, str) and isinstance(column.type, DateTime):
+            value = _parse_date(value) if value.strip() else None
+        setattr(record, key, value)
+
+def _chunks(ids, size: int = BATCH_GET_SIZE):
+    """Unique ids in order, split into IN-list sized chunks"""
+    ids = list(dict.fromkeys(ids))
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+# Customer dropdown of the rental history page, keyed by the rental_history table version
+_history_customers = {'version': None, 'options': []}
+_history_customers_lock = threading.Lock()
+
+def _copy_customer_fields(session, customer_id: str = None) -> int:
+    """Refresh the customer details on rented cylinders with one UPDATE; returns cylinders changed
+
+    Limited to one customer's cylinders when customer_id is given, else the
+    whole fleet. Runs in the session's transaction and is change-logged.
+    """
+    where = ['rented_to', '=', customer_id] if customer_id else None
+    # Set updated_at explicitly so the logged value is what a replay writes
+    values = {'updated_at': datetime.utcnow()}
+    record_copy_from(session, 'cylinders', 'customers', ('rented_to', 'id'), CYLINDER_CUSTOMER_FIELDS, where, values)
+    result = session.execute(
+        copy_from_statement(Cylinder, Customer, ('rented_to', 'id'), CYLINDER_CUSTOMER_FIELDS, where, values),
+        execution_options={'synchronize_session': False}
+    )
+    return result.rowcount
+
+def replica_read(method):
+    """Run a read-only service method against the read replica (when one is configured)"""
+    if isgeneratorfunction(method):
+        @wraps(method)
+        def stream(self, *args, **kwargs):
+            with replica_reads(self.db):
+                yield from method(self, *args, **kwargs)
+        return stream
+    
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with replica_reads(self.db):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def primary_write(method):
+    """Read-modify-write service method: all of its reads go to the primary"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with primary_only():
+            return method(self, *args, **kwargs)
+    return wrapper
+
 class DatabaseService:
     """Service layer for database operations"""
     
@@ -22,6 +111,21 @@ class DatabaseService:
                 print(f"Database close error (ignored): {e}")
                 pass
     
+    def stream_table_batches(self, table, batch_size: int = 10000, where=None) -> Iterator[List[Tuple]]:
+        """Stream raw rows of a table in primary-key order, one batch per list"""
+        query = select(table).order_by(*table.primary_key.columns)
+        if where is not None:
+            query = query.where(where)
+        result = self.db.execute(query).yield_per(batch_size)
+        for partition in result.partitions():
+            yield [tuple(row) for row in partition]
+    
+    def stream_primary_keys(self, table, batch_size: int = 50000) -> Iterator[List[Tuple]]:
+        """Stream only the primary key values of a table, one batch per list"""
+        result = self.db.execute(select(*table.primary_key.columns)).yield_per(batch_size)
+        for partition in result.partitions():
+            yield [tuple(row) for row in partition]
+    
     def __enter__(self):
         return self
     
@@ -31,19 +135,13 @@ class DatabaseService:
 class CustomerService(DatabaseService):
     """Customer database operations"""
     
+    @replica_read
     def get_all(self, search_query: str = None, page: int = 1, per_page: int = 25) -> Tuple[List[Customer], int]:
         """Get all customers with optional search and pagination"""
         query = self.db.query(Customer)
         
         if search_query:
-            search_filter = or_(
-                Customer.customer_name.ilike(f'%{search_query}%'),
-                Customer.customer_no.ilike(f'%{search_query}%'),
-                Customer.customer_phone.ilike(f'%{search_query}%'),
-                Customer.customer_email.ilike(f'%{search_query}%'),
-                Customer.customer_city.ilike(f'%{search_query}%')
-            )
-            query = query.filter(search_filter)
+            query = query.filter(self._search_filter(search_query))
         
         total_count = query.count()
         
@@ -56,14 +154,59 @@ class CustomerService(DatabaseService):
         
         return customers, total_count
     
+    @staticmethod
+    def _search_filter(search_query: str):
+        return or_(
+            Customer.customer_name.ilike(f'%{search_query}%'),
+            Customer.customer_no.ilike(f'%{search_query}%'),
+            Customer.customer_phone.ilike(f'%{search_query}%'),
+            Customer.customer_email.ilike(f'%{search_query}%'),
+            Customer.customer_city.ilike(f'%{search_query}%')
+        )
+    
+    @replica_read
+    def search(self, search_query: str) -> List[Customer]:
+        """Get every customer matching a search, ordered by name"""
+        return self.db.query(Customer).filter(
+            self._search_filter(search_query)
+        ).order_by(Customer.customer_name).all()
+    
+    @replica_read
+    def count(self) -> int:
+        """Get total number of customers"""
+        return self.db.query(func.count(Customer.id)).scalar() or 0
+    
+    @replica_read
+    def stream_all(self, batch_size: int = 1000) -> Iterator[Customer]:
+        """Stream all customers ordered by name using a server-side cursor"""
+        query = self.db.query(Customer).order_by(Customer.customer_name).yield_per(batch_size)
+        for customer in query:
+            yield customer
+    
+    @replica_read
     def get_by_id(self, customer_id: str) -> Optional[Customer]:
         """Get customer by ID"""
         return self.db.query(Customer).filter(Customer.id == customer_id).first()
     
+    @replica_read
+    def get_many(self, customer_ids) -> List[Customer]:
+        """Get customers by ID, one IN query per batch (missing IDs are skipped)"""
+        customers = []
+        for chunk in _chunks(customer_ids):
+            customers.extend(self.db.query(Customer).filter(Customer.id.in_(chunk)).all())
+        return customers
+    
     def get_by_customer_no(self, customer_no: str) -> Optional[Customer]:
         """Get customer by customer number"""
         return self.db.query(Customer).filter(Customer.customer_no == customer_no).first()
-    
+
+    def get_customer_no_set(self) -> set:
+        """Get the set of all customer numbers (upper-cased) for bulk lookups"""
+        rows = self.db.query(func.upper(Customer.customer_no)).filter(
+            Customer.customer_no.isnot(None)
+        ).distinct()
+        return {row[0] for row in rows if row[0]}
+
     def create(self, customer_data: Dict) -> Customer:
         """Create new customer"""
         customer = Customer(
@@ -84,26 +227,37 @@ class CustomerService(DatabaseService):
         self.db.commit()
         return customer
     
+    @primary_write
     def update(self, customer_id: str, customer_data: Dict) -> bool:
         """Update customer"""
         customer = self.get_by_id(customer_id)
         if not customer:
             return False
         
-        for key, value in customer_data.items():
-            if hasattr(customer, key):
-                setattr(customer, key, value)
-        
+        _assign(customer, customer_data)
         customer.updated_at = datetime.utcnow()
+        
+        # Rented cylinders carry copies of these fields; refresh them in the same transaction
+        state = inspect(customer)
+        if any(state.attrs[field].history.has_changes() for field in CYLINDER_CUSTOMER_FIELDS):
+            self.db.flush()
+            _copy_customer_fields(self.db, customer.id)
         self.db.commit()
         return True
     
+    @primary_write
     def delete(self, customer_id: str) -> bool:
         """Delete customer"""
         customer = self.get_by_id(customer_id)
         if not customer:
             return False
         
+        # Keep the history rows, detached from the customer (SQLite has no
+        # FK enforcement, and the partition tables have no FK at all)
+        record_update_where(self.db, 'rental_history', 'customer_id', '=', customer_id, {'customer_id': None})
+        self.db.query(RentalHistory).filter(RentalHistory.customer_id == customer_id).update(
+            {'customer_id': None}, synchronize_session=False
+        )
         self.db.delete(customer)
         self.db.commit()
         return True
@@ -111,21 +265,17 @@ class CustomerService(DatabaseService):
 class CylinderService(DatabaseService):
     """Cylinder database operations"""
     
+    @replica_read
     def get_all(self, search_query: str = None, page: int = 1, per_page: int = 25, 
                 filter_type: str = None, filter_status: str = None, 
                 rental_duration_filter: str = None, customer_filter: str = None) -> Tuple[List[Cylinder], int]:
         """Get all cylinders with filters and pagination"""
         query = self.db.query(Cylinder)
+        filter_status = normalize_status(filter_status)
         
         # Apply filters
         if search_query:
-            search_filter = or_(
-                Cylinder.custom_id.ilike(f'%{search_query}%'),
-                Cylinder.serial_number.ilike(f'%{search_query}%'),
-                Cylinder.customer_name.ilike(f'%{search_query}%'),
-                Cylinder.customer_no.ilike(f'%{search_query}%')
-            )
-            query = query.filter(search_filter)
+            query = query.filter(self._search_filter(search_query))
         
         if filter_type:
             query = query.filter(Cylinder.type == filter_type)
@@ -195,10 +345,128 @@ class CylinderService(DatabaseService):
         
         return cylinders, total_count
     
+    @staticmethod
+    def _search_filter(search_query: str):
+        return or_(
+            Cylinder.custom_id.ilike(f'%{search_query}%'),
+            Cylinder.serial_number.ilike(f'%{search_query}%'),
+            Cylinder.customer_name.ilike(f'%{search_query}%'),
+            Cylinder.customer_no.ilike(f'%{search_query}%')
+        )
+    
+    @replica_read
+    def search(self, search_query: str) -> List[Cylinder]:
+        """Get every cylinder matching a search, ordered by custom ID"""
+        return self.db.query(Cylinder).filter(
+            self._search_filter(search_query)
+        ).order_by(Cylinder.custom_id.asc().nulls_last()).all()
+    
+    @replica_read
+    def count(self) -> int:
+        """Get total number of cylinders"""
+        return self.db.query(func.count(Cylinder.id)).scalar() or 0
+
+    @replica_read
+    def get_status_counts(self) -> Dict[str, int]:
+        """Get number of cylinders per status"""
+        rows = self.db.query(Cylinder.status, func.count(Cylinder.id)).group_by(Cylinder.status).all()
+        return {status or 'Unknown': count for status, count in rows}
+
+    @replica_read
+    def get_top_customer_rental_count(self) -> int:
+        """Get the largest number of cylinders rented to a single customer"""
+        counts = self.db.query(func.count(Cylinder.id).label('rentals')).filter(
+            Cylinder.rented_to.isnot(None)
+        ).group_by(Cylinder.rented_to).subquery()
+        return self.db.query(func.max(counts.c.rentals)).scalar() or 0
+
+    @replica_read
+    def count_rental_activities(self) -> int:
+        """Get number of cylinders with rental activity"""
+        return self.db.query(func.count(Cylinder.id)).filter(
+            or_(Cylinder.rented_to.isnot(None), Cylinder.date_borrowed.isnot(None))
+        ).scalar() or 0
+
+    @replica_read
+    def stream_all(self, batch_size: int = 1000) -> Iterator[Cylinder]:
+        """Stream all cylinders ordered by custom ID using a server-side cursor"""
+        query = self.db.query(Cylinder).order_by(Cylinder.custom_id).yield_per(batch_size)
+        for cylinder in query:
+            yield cylinder
+    
+    @replica_read
+    def stream_rental_activities(self, batch_size: int = 1000) -> Iterator[Tuple[Cylinder, Optional[Customer]]]:
+        """Stream cylinders with rental activity together with their current customer"""
+        query = self.db.query(Cylinder, Customer).outerjoin(
+            Customer, Cylinder.rented_to == Customer.id
+        ).filter(
+            or_(Cylinder.rented_to.isnot(None), Cylinder.date_borrowed.isnot(None))
+        ).order_by(Cylinder.custom_id).yield_per(batch_size)
+        for cylinder, customer in query:
+            yield cylinder, customer
+    
+    @replica_read
+    def stream_active_rentals(self, batch_size: int = 1000) -> Iterator[Tuple]:
+        """Stream export columns for rented cylinders, oldest rental first"""
+        query = self.db.query(
+            Cylinder.customer_no, Cylinder.customer_name, Cylinder.customer_phone, Customer.customer_address,
+            Cylinder.custom_id, Cylinder.serial_number, Cylinder.type, Cylinder.size, Cylinder.date_borrowed
+        ).outerjoin(
+            Customer, Cylinder.rented_to == Customer.id
+        ).filter(Cylinder.status == 'rented').order_by(Cylinder.date_borrowed.asc().nulls_last()).yield_per(batch_size)
+        for row in query:
+            yield tuple(row)
+    
+    @replica_read
     def get_by_id(self, cylinder_id: str) -> Optional[Cylinder]:
         """Get cylinder by ID"""
         return self.db.query(Cylinder).filter(Cylinder.id == cylinder_id).first()
     
+    @replica_read
+    def get_many(self, cylinder_ids) -> List[Cylinder]:
+        """Get cylinders by ID, one IN query per batch (missing IDs are skipped)"""
+        return self._load_many(cylinder_ids)
+    
+    def _load_many(self, cylinder_ids, *conditions) -> List[Cylinder]:
+        """Load cylinders by ID in IN-list batches; rows are locked when called from a write"""
+        cylinders = []
+        for chunk in _chunks(cylinder_ids):
+            query = self.db.query(Cylinder).filter(Cylinder.id.in_(chunk), *conditions)
+            if self.db.info.get('replica_reads', 0) == 0:
+                query = query.with_for_update()
+            cylinders.extend(query.all())
+        return cylinders
+    
+    @replica_read
+    def find_by_identifier(self, identifier: str) -> Optional[Cylinder]:
+        """Find cylinder by system ID, custom ID or serial number (case-insensitive)"""
+        identifier = identifier.strip()
+        cylinder = self.get_by_id(identifier)
+        if cylinder:
+            return cylinder
+        # Served by the lower(custom_id) / lower(serial_number) expression indexes
+        key = identifier.lower()
+        return self.db.query(Cylinder).filter(
+            or_(func.lower(Cylinder.custom_id) == key, func.lower(Cylinder.serial_number) == key)
+        ).order_by(func.lower(Cylinder.custom_id) != key).first()
+    
+    def get_identifier_set(self, include_serial: bool = True) -> set:
+        """Get the set of all cylinder custom IDs (and serial numbers), upper-cased"""
+        columns = [Cylinder.custom_id, Cylinder.serial_number] if include_serial else [Cylinder.custom_id]
+        identifiers = set()
+        for column in columns:
+            rows = self.db.query(func.upper(column)).filter(column.isnot(None)).distinct()
+            identifiers.update(row[0] for row in rows if row[0])
+        return identifiers
+
+    @replica_read
+    def get_by_customers(self, customer_ids: List[str]) -> List[Cylinder]:
+        """Get cylinders assigned to any of the given customers, ordered by customer"""
+        return self.db.query(Cylinder).filter(
+            Cylinder.rented_to.in_(customer_ids)
+        ).order_by(Cylinder.rented_to).all()
+
+    @replica_read
     def get_by_customer(self, customer_id: str) -> List[Cylinder]:
         """Get cylinders rented by customer"""
         return self.db.query(Cylinder).filter(
@@ -222,6 +490,7 @@ class CylinderService(DatabaseService):
         self.db.commit()
         return cylinder
     
+    @primary_write
     def update(self, cylinder_id: str, cylinder_data: Dict) -> bool:
         """Update cylinder"""
         cylinder = self.get_by_id(cylinder_id)
@@ -234,10 +503,7 @@ class CylinderService(DatabaseService):
             if rented_to == '' or rented_to is None or str(rented_to).strip() == '':
                 cylinder_data['rented_to'] = None
         
-        for key, value in cylinder_data.items():
-            if hasattr(cylinder, key):
-                setattr(cylinder, key, value)
-        
+        _assign(cylinder, cylinder_data)
         cylinder.updated_at = datetime.utcnow()
         
         try:
@@ -248,6 +514,18 @@ class CylinderService(DatabaseService):
             print(f"Error updating cylinder: {e}")
             return False
     
+    @primary_write
+    def bulk_update(self, updates: Dict[str, Dict]) -> int:
+        """Apply per-cylinder field changes in a single transaction; returns cylinders updated"""
+        cylinders = self._load_many(updates.keys())
+        now = datetime.utcnow()
+        for cylinder in cylinders:
+            _assign(cylinder, updates[cylinder.id])
+            cylinder.updated_at = now
+        self.db.commit()
+        return len(cylinders)
+    
+    @primary_write
     def rent_cylinder(self, cylinder_id: str, customer_id: str, rental_date: str = None) -> bool:
         """Rent cylinder to customer"""
         cylinder = self.get_by_id(cylinder_id)
@@ -262,9 +540,29 @@ class CylinderService(DatabaseService):
         if not customer:
             return False
         
-        # Update cylinder with rental info
+        self._apply_rental(cylinder, customer, _parse_date(rental_date))
+        self.db.commit()
+        return True
+    
+    @primary_write
+    def bulk_rent(self, cylinder_ids: List[str], customer_id: str, rental_date: str = None) -> List[str]:
+        """Rent every available cylinder of the list to one customer in a single transaction"""
+        customer = self.db.query(Customer).filter(Customer.id == customer_id).first()
+        if not customer:
+            return []
+        
+        borrowed_at = _parse_date(rental_date)
+        cylinders = self._load_many(cylinder_ids, Cylinder.status == 'available')
+        for cylinder in cylinders:
+            self._apply_rental(cylinder, customer, borrowed_at)
+        self.db.commit()
+        return [cylinder.id for cylinder in cylinders]
+    
+    @staticmethod
+    def _apply_rental(cylinder: Cylinder, customer: Customer, borrowed_at: datetime):
+        """Mark a cylinder rented and copy the customer details onto it"""
         cylinder.status = 'rented'
-        cylinder.rented_to = customer_id
+        cylinder.rented_to = customer.id
         cylinder.customer_name = customer.customer_name
         cylinder.customer_email = customer.customer_email
         cylinder.customer_phone = customer.customer_phone
@@ -272,22 +570,11 @@ class CylinderService(DatabaseService):
         cylinder.customer_city = customer.customer_city
         cylinder.customer_state = customer.customer_state
         cylinder.location = customer.customer_address or customer.customer_city
-        
-        if rental_date:
-            try:
-                cylinder.date_borrowed = datetime.fromisoformat(rental_date.replace('Z', '+00:00'))
-                cylinder.rental_date = cylinder.date_borrowed
-            except:
-                cylinder.date_borrowed = datetime.utcnow()
-                cylinder.rental_date = cylinder.date_borrowed
-        else:
-            cylinder.date_borrowed = datetime.utcnow()
-            cylinder.rental_date = cylinder.date_borrowed
-        
+        cylinder.date_borrowed = borrowed_at
+        cylinder.rental_date = borrowed_at
         cylinder.updated_at = datetime.utcnow()
-        self.db.commit()
-        return True
     
+    @primary_write
     def return_cylinder(self, cylinder_id: str, return_date: str = None) -> bool:
         """Return cylinder from rental"""
         cylinder = self.get_by_id(cylinder_id)
@@ -300,17 +587,28 @@ class CylinderService(DatabaseService):
             history_service.add_return_record(cylinder, return_date)
             history_service.close()
         
-        # Update cylinder status
+        self._apply_return(cylinder, _parse_date(return_date))
+        self.db.commit()
+        return True
+    
+    @primary_write
+    def bulk_return(self, cylinder_ids: List[str], return_date: str = None) -> List[str]:
+        """Return every rented cylinder of the list, history rows included, in a single transaction"""
+        returned_at = _parse_date(return_date)
+        cylinders = self._load_many(cylinder_ids, Cylinder.status == 'rented')
+        for cylinder in cylinders:
+            if cylinder.rented_to:
+                self.db.add(RentalHistoryService.build_return_record(cylinder, returned_at))
+            self._apply_return(cylinder, returned_at)
+        self.db.commit()
+        return [cylinder.id for cylinder in cylinders]
+    
+    @staticmethod
+    def _apply_return(cylinder: Cylinder, returned_at: datetime):
+        """Mark a cylinder back in the warehouse and clear its rental details"""
         cylinder.status = 'available'
         cylinder.location = 'Warehouse'
-        
-        if return_date:
-            try:
-                cylinder.date_returned = datetime.fromisoformat(return_date.replace('Z', '+00:00'))
-            except:
-                cylinder.date_returned = datetime.utcnow()
-        else:
-            cylinder.date_returned = datetime.utcnow()
+        cylinder.date_returned = returned_at
         
         # Clear rental info (use None for foreign key to avoid constraint violation)
         cylinder.rented_to = None
@@ -326,9 +624,15 @@ class CylinderService(DatabaseService):
         cylinder.rental_date = None
         
         cylinder.updated_at = datetime.utcnow()
+    
+    @primary_write
+    def reconcile_customer_fields(self) -> int:
+        """Repair customer details on rented cylinders that drifted from the customer; returns cylinders fixed"""
+        repaired = _copy_customer_fields(self.db)
         self.db.commit()
-        return True
+        return repaired
     
+    @primary_write
     def delete(self, cylinder_id: str) -> bool:
         """Delete cylinder"""
         cylinder = self.get_by_id(cylinder_id)
@@ -342,17 +646,84 @@ class CylinderService(DatabaseService):
 class RentalHistoryService(DatabaseService):
     """Rental history database operations"""
     
-    def get_all(self, page: int = 1, per_page: int = 1000) -> Tuple[List[RentalHistory], int]:
-        """Get all rental history with pagination"""
+    # Sort keys accepted by get_all (ties broken by id so pages don't overlap)
+    SORT_ORDERS = {
+        'return_desc': (desc(RentalHistory.return_date),),
+        'return_asc': (asc(RentalHistory.return_date),),
+        'dispatch_desc': (desc(RentalHistory.dispatch_date),),
+        'dispatch_asc': (asc(RentalHistory.dispatch_date),),
+        'customer': (asc(RentalHistory.customer_name), desc(RentalHistory.return_date)),
+        'rental_days_desc': (desc(RentalHistory.rental_days), desc(RentalHistory.return_date)),
+    }
+    
+    @replica_read
+    def get_all(self, page: int = 1, per_page: int = 1000, search_query: str = None, customer_no: str = None,
+                date_from: datetime = None, date_to: datetime = None,
+                sort: str = 'return_desc') -> Tuple[List[RentalHistory], int]:
+        """Get rental history with search, customer and return-date filters, sorting and pagination"""
         query = self.db.query(RentalHistory)
+        
+        if search_query:
+            query = query.filter(or_(
+                RentalHistory.customer_name.ilike(f'%{search_query}%'),
+                RentalHistory.cylinder_custom_id.ilike(f'%{search_query}%'),
+                RentalHistory.customer_no.ilike(f'%{search_query}%')
+            ))
+        if customer_no:
+            query = query.filter(RentalHistory.customer_no == customer_no)
+        if date_from:
+            query = query.filter(RentalHistory.return_date >= date_from)
+        if date_to:
+            query = query.filter(RentalHistory.return_date < date_to)
+        
         total_count = query.count()
         
-        # For web interface, get larger chunks but still paginate for performance
-        offset = (page - 1) * per_page
-        history = query.order_by(desc(RentalHistory.return_date)).offset(offset).limit(per_page).all()
+        offset = (max(page, 1) - 1) * per_page  # a negative OFFSET is an error on PostgreSQL
+        order = self.SORT_ORDERS.get(sort, self.SORT_ORDERS['return_desc'])
+        history = query.order_by(*order, RentalHistory.id).offset(offset).limit(per_page).all()
         
         return history, total_count
     
+    def get_customer_options(self) -> List[Tuple[str, str]]:
+        """(customer_no, customer_name) of every customer with history, sorted by name
+
+        Cached per process and rebuilt only after rental_history was written.
+        """
+        with TableVersionService() as service:
+            version = service.get_versions(['rental_history'])['rental_history']
+        with _history_customers_lock:
+            if _history_customers['version'] == version:
+                return _history_customers['options']
+        
+        options = self._load_customer_options()
+        with _history_customers_lock:
+            _history_customers.update(version=version, options=options)
+        return options
+    
+    @replica_read
+    def _load_customer_options(self) -> List[Tuple[str, str]]:
+        rows = self.db.query(
+            RentalHistory.customer_no, func.max(RentalHistory.customer_name)
+        ).filter(
+            RentalHistory.customer_no.isnot(None), RentalHistory.customer_no != ''
+        ).group_by(RentalHistory.customer_no).all()
+        return sorted(((no, name or '') for no, name in rows), key=lambda option: option[1])
+    
+    @replica_read
+    def stream_export_rows(self, batch_size: int = 1000) -> Iterator[Tuple]:
+        """Stream export columns for all history records, most recent return first"""
+        query = self.db.query(
+            RentalHistory.customer_no, RentalHistory.customer_name, RentalHistory.customer_phone,
+            RentalHistory.customer_address, RentalHistory.cylinder_custom_id, RentalHistory.cylinder_serial,
+            RentalHistory.cylinder_type, RentalHistory.cylinder_size,
+            func.coalesce(RentalHistory.dispatch_date, RentalHistory.date_borrowed),
+            func.coalesce(RentalHistory.return_date, RentalHistory.date_returned),
+            RentalHistory.rental_days
+        ).order_by(desc(RentalHistory.return_date)).yield_per(batch_size)
+        for row in query:
+            yield tuple(row)
+    
+    @replica_read
     def get_customer_history(self, customer_id: str) -> Dict[str, List]:
         """Get customer rental history (active and past)"""
         # Get active rentals
@@ -381,22 +752,39 @@ class RentalHistoryService(DatabaseService):
             'past': past_rentals
         }
     
+    @replica_read
+    def get_for_customers(self, customer_ids: List[str], customer_nos: List[str]) -> List[RentalHistory]:
+        """Get past rentals for a group of customers (matched by ID or customer number)"""
+        return self.db.query(RentalHistory).filter(
+            or_(
+                RentalHistory.customer_id.in_(customer_ids),
+                RentalHistory.customer_no.in_(customer_nos)
+            )
+        ).order_by(desc(RentalHistory.return_date)).all()
+    
+    @replica_read
+    def get_for_cylinder(self, cylinder_id: str, limit: int = 20) -> List[RentalHistory]:
+        """Most recent past rentals of one cylinder"""
+        return self.db.query(RentalHistory).filter(
+            RentalHistory.cylinder_id == cylinder_id
+        ).order_by(desc(RentalHistory.return_date)).limit(limit).all()
+    
     def add_return_record(self, cylinder: Cylinder, return_date: str = None):
         """Add return record to history"""
-        if not return_date:
-            return_date_dt = datetime.utcnow()
-        else:
-            try:
-                return_date_dt = datetime.fromisoformat(return_date.replace('Z', '+00:00'))
-            except:
-                return_date_dt = datetime.utcnow()
-        
+        history_record = self.build_return_record(cylinder, _parse_date(return_date))
+        self.db.add(history_record)
+        self.db.commit()
+        return history_record
+    
+    @staticmethod
+    def build_return_record(cylinder: Cylinder, return_date_dt: datetime) -> RentalHistory:
+        """History row for a cylinder being returned (not yet added to a session)"""
         # Calculate rental days
         rental_days = 0
         if cylinder.date_borrowed:
             rental_days = max(0, (return_date_dt - cylinder.date_borrowed).days)
         
-        history_record = RentalHistory(
+        return RentalHistory(
             id=str(uuid.uuid4()),
             customer_id=cylinder.rented_to,
             customer_no=cylinder.customer_no,
@@ -419,21 +807,130 @@ class RentalHistoryService(DatabaseService):
             status='completed',
             created_at=datetime.utcnow()
         )
-        
-        self.db.add(history_record)
-        self.db.commit()
-        return history_record
     
     def cleanup_old_records(self) -> int:
         """Remove records older than 6 months"""
         six_months_ago = datetime.utcnow() - timedelta(days=180)
         
+        # Partitioned history drops whole expired months instead of deleting rows
+        from history_partitions import history_partitions
+        if history_partitions.is_partitioned():
+            return history_partitions.drop_before(self.db, six_months_ago)
+        
         old_records = self.db.query(RentalHistory).filter(
             RentalHistory.return_date < six_months_ago
         )
         
         count = old_records.count()
+        record_delete_where(self.db, 'rental_history', 'return_date', '<', six_months_ago)
         old_records.delete()
         self.db.commit()
         
-        return count
\ No newline at end of file
+        return count
+
+class UserService(DatabaseService):
+    """User account database operations"""
+    
+    def ensure_table(self):
+        """Create the users table on first use (existing databases predate it)
+
+        Emails stored before they were normalized are lower-cased, then the
+        unique lower(email) index is added if it is missing.
+        """
+        bind = self.db.get_bind()
+        try:
+            User.__table__.create(bind=bind, checkfirst=True)
+        except (OperationalError, ProgrammingError):
+            pass  # another worker created it between the check and the CREATE
+        
+        raw_emails = [email for (email,) in self.db.query(User.email).filter(
+            User.email.isnot(None), User.email != func.lower(func.trim(User.email))
+        ).distinct()]
+        for raw in raw_emails:
+            record_update_where(self.db, 'users', 'email', '=', raw, {'email': normalize_email(raw)})
+            self.db.query(User).filter(User.email == raw).update(
+                {'email': normalize_email(raw)}, synchronize_session=False
+            )
+        try:
+            self.db.commit()
+        except IntegrityError:
+            self.db.rollback()
+            print("Warning: users share an email that differs only in case; fix them to enforce unique emails")
+            return
+        
+        existing = existing_index_names(bind, User.__tablename__)
+        for index in User.__table__.indexes:
+            if index.name not in existing:
+                try:
+                    index.create(bind)
+                except (IntegrityError, OperationalError, ProgrammingError):
+                    pass  # another worker created it first
+    
+    def get_all(self) -> List[User]:
+        """Get all users ordered by creation time"""
+        return self.db.query(User).order_by(User.created_at).all()
+    
+    def count(self) -> int:
+        """Get total number of users"""
+        return self.db.query(func.count(User.id)).scalar() or 0
+    
+    def get_by_id(self, user_id: str) -> Optional[User]:
+        """Get user by ID"""
+        return self.db.query(User).filter(User.id == user_id).first()
+    
+    def get_by_username(self, username: str) -> Optional[User]:
+        """Get user by username"""
+        return self.db.query(User).filter(User.username == username).first()
+    
+    def create(self, user_data: Dict) -> User:
+        """Create a new user (raises IntegrityError on a duplicate username or email)"""
+        user = User(**user_data)
+        self.db.add(user)
+        try:
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        self.db.refresh(user)
+        return user
+    
+    def update(self, user_id: str, user_data: Dict) -> bool:
+        """Update user fields"""
+        user = self.get_by_id(user_id)
+        if not user:
+            return False
+        for key, value in user_data.items():
+            setattr(user, key, value)
+        self.db.commit()
+        return True
+    
+    def delete(self, user_id: str) -> bool:
+        """Delete a user"""
+        user = self.get_by_id(user_id)
+        if not user:
+            return False
+        self.db.delete(user)
+        self.db.commit()
+        return True
+    
+    def count_admins(self) -> int:
+        """Get number of active admin accounts"""
+        return self.db.query(func.count(User.id)).filter(User.role == 'admin', User.is_active.is_(True)).scalar() or 0
+
+class TableVersionService(DatabaseService):
+    """Read per-table write-version counters (used as cache keys for derived data)"""
+    
+    @replica_read
+    def get_versions(self, table_names) -> Dict[str, int]:
+        """Get the current write version of each table (0 if never written)"""
+        versions = {name: 0 for name in table_names}
+        try:
+            rows = self.db.query(TableVersion).filter(TableVersion.table_name.in_(list(table_names))).all()
+        except Exception:
+            # Database predates the table_versions table and nothing has been written yet
+            self.db.rollback()
+            return versions
+        
+        for row in rows:
+            versions[row.table_name] = row.version
+        return versions
@@ -0,0 +1,200 @@
+# export_cache.py - Disk cache for generated export files
+"""
+Disk cache for generated export files (CSV, PDF, XLSX)
+
+Each entry is named after the export type plus a hash of its parameters,
+the current date (rental days change daily) and the write versions of the
+tables it reads. Any write to those tables produces a new entry name, so
+entries never need invalidating. The name doubles as the HTTP ETag.
+
+Entries are evicted least-recently-used first (by mtime, bumped on every
+hit) once the cache grows past its size budget. Files are served and read
+through open handles, so an entry evicted by another worker mid-request
+is still delivered in full.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import date
+from typing import BinaryIO, Dict, Iterable, Iterator, Optional
+
+from flask import Response, request, send_file
+
+logger = logging.getLogger(__name__)
+
+# File types managed by the cache; in-progress temp files and job markers are never evicted
+ARTIFACT_SUFFIXES = ('.csv', '.pdf', '.xlsx', '.zip', '.parquet')
+
+# Temp files older than this were left behind by a crashed worker
+STALE_TEMP_SECONDS = 60 * 60
+
+
+class ExportCache:
+    """Store and serve generated export files keyed by data version"""
+
+    def __init__(self, cache_dir: str = os.path.join('exports', 'cache'),
+                 max_bytes: int = int(os.environ.get('EXPORT_CACHE_MAX_MB', '512')) * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def entry_name(self, export_type: str, tables: Iterable[str], params: Optional[Dict] = None) -> str:
+        """Cache entry name (and ETag) for an export at the current data version"""
+        from db_service import TableVersionService
+
+        with TableVersionService() as service:
+            versions = service.get_versions(tables)
+        key = json.dumps({
+            'type': export_type,
+            'params': params or {},
+            'date': date.today().isoformat(),
+            'versions': versions
+        }, sort_keys=True, default=str)
+        return f"{export_type}-{hashlib.sha256(key.encode()).hexdigest()[:16]}"
+
+    def path_for(self, entry: str, suffix: str) -> str:
+        return os.path.join(self.cache_dir, entry + suffix)
+
+    def get(self, entry: str, suffix: str) -> Optional[str]:
+        """Path of a cached file, marking it as recently used; None on a miss"""
+        path = self.path_for(entry, suffix)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def _temp_path(self, entry: str, suffix: str) -> str:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return f"{self.path_for(entry, suffix)}.{uuid.uuid4().hex[:8]}.tmp"
+
+    def build(self, entry: str, suffix: str, write) -> str:
+        """Create a cache entry by calling write(path) on a temp file, then publish it
+
+        The returned path may already be gone again if another worker evicted
+        it; use open_entry() or serve() to read it.
+        """
+        path = self.get(entry, suffix)
+        if path:
+            return path
+
+        tmp_path = self._temp_path(entry, suffix)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, self.path_for(entry, suffix))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict(keep=(entry + suffix,))
+        return self.path_for(entry, suffix)
+
+    def open_entry(self, entry: str, suffix: str, write) -> BinaryIO:
+        """Open a cache entry for reading, building it on a miss
+
+        The handle stays readable after eviction. If the entry is evicted
+        between building and opening, a private copy is built instead.
+        """
+        try:
+            return open(self.build(entry, suffix, write), 'rb')
+        except FileNotFoundError:
+            pass
+
+        tmp_path = self._temp_path(entry, suffix)
+        try:
+            write(tmp_path)
+            return open(tmp_path, 'rb')
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def tee(self, entry: str, suffix: str, chunks: Iterable) -> Iterator:
+        """Pass streamed chunks (text or bytes) through while saving them as a cache entry"""
+        tmp_path = self._temp_path(entry, suffix)
+        completed = False
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+                    yield chunk
+            completed = True
+        finally:
+            # A client that disconnects mid-download leaves a partial file; discard it
+            if completed:
+                os.replace(tmp_path, self.path_for(entry, suffix))
+                self.evict()
+            elif os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def evict(self, keep: Iterable[str] = ()):
+        """Remove least recently used entries until the cache fits its size budget (file names in keep are spared)"""
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+
+        entries = []
+        now = time.time()
+        for name in names:
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+                if name.endswith('.tmp') and now - stat.st_mtime > STALE_TEMP_SECONDS:
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+            if name.endswith(ARTIFACT_SUFFIXES) and name not in keep:
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+                total -= size
+                logger.info(f"Evicted cached export {name}")
+            except OSError:
+                pass
+
+    def not_modified(self, entry: str) -> Optional[Response]:
+        """304 response if the client already has this entry, else None"""
+        if request.if_none_match.contains(entry):
+            response = Response(status=304)
+            response.set_etag(entry)
+            return response
+        return None
+
+    def send(self, entry: str, suffix: str, mimetype: str, download_name: str) -> Optional[Response]:
+        """Serve a cached file with ETag validation; None on a cache miss"""
+        path = self.get(entry, suffix)
+        if not path:
+            return None
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        return self._send(f, entry, mimetype, download_name)
+
+    def serve(self, entry: str, suffix: str, write, mimetype: str, download_name: str) -> Response:
+        """Serve a cache entry, building it first on a miss"""
+        return self._send(self.open_entry(entry, suffix, write), entry, mimetype, download_name)
+
+    def _send(self, f: BinaryIO, entry: str, mimetype: str, download_name: str) -> Response:
+        stat = os.fstat(f.fileno())
+        response = send_file(f, mimetype=mimetype, as_attachment=True, download_name=download_name,
+                             etag=entry, conditional=True, last_modified=stat.st_mtime)
+        if response.status_code == 304:
+            f.close()
+        elif response.status_code == 200:
+            response.content_length = stat.st_size
+        # Revalidate every time: the data may change at any moment
+        response.cache_control.no_cache = True
+        return response
+
+
+# Global cache instance
+export_cache = ExportCache()
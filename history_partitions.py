@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+# history_partitions.py - Monthly partitions for rental history
+"""
+Rental history partitioned by month of return_date
+
+    PostgreSQL  rental_history is a natively range-partitioned table with one
+                partition per month (rental_history_p202610) and a DEFAULT
+                partition for NULL or out-of-range dates
+    SQLite      the same monthly tables (plus rental_history_default) sit
+                behind a rental_history view; INSTEAD OF triggers route
+                inserts, updates and deletes to the right table
+
+The ORM model is unchanged, everything still reads and writes
+rental_history. Queries with a return_date range only do work in the
+matching months: PostgreSQL prunes the other partitions, SQLite pushes the
+range into every arm of the view (one index probe per month).
+
+Retention drops (or archives) whole months instead of deleting rows, so
+removing old history no longer bloats the table or holds locks for long.
+The drop is change-logged as a delete_where, so point-in-time restore
+replays it. Upcoming months are created ahead of time by the scheduler.
+
+On SQLite, change history rows with bulk statements (query.update(),
+query.delete()) logged with record_update_where() / record_delete_where():
+SQLite reports no row counts through INSTEAD OF triggers, so ORM flushes
+of modified rows can't be confirmed and are refused (db_models).
+
+Convert an existing database once (safe to run again, it then only adds
+upcoming months):
+
+    python history_partitions.py
+"""
+
+import os
+import re
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import Column, Index, MetaData, Table, inspect, text
+
+from change_log import record_delete_where
+from db_models import engine, RentalHistory
+
+PARENT_TABLE = 'rental_history'
+PARTITION_PREFIX = 'rental_history_p'
+DEFAULT_PARTITION = 'rental_history_default'
+ARCHIVE_PREFIX = 'rental_history_archive_p'
+UNPARTITIONED_TABLE = 'rental_history_unpartitioned'
+
+# Months created ahead of the current one, so inserts never land in the default partition
+PARTITION_MONTHS_AHEAD = int(os.environ.get('HISTORY_PARTITION_MONTHS_AHEAD', '3'))
+
+# Keep expired months as standalone archive tables instead of dropping them
+ARCHIVE_EXPIRED_PARTITIONS = os.environ.get('HISTORY_ARCHIVE_PARTITIONS', '0') == '1'
+
+_PARTITION_NAME = re.compile(rf'^{PARTITION_PREFIX}(\d{{6}})$')
+
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def next_month(month: datetime) -> datetime:
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def add_months(month: datetime, count: int) -> datetime:
+    for _ in range(count):
+        month = next_month(month)
+    return month
+
+
+def partition_name(month: datetime) -> str:
+    return f"{PARTITION_PREFIX}{month.strftime('%Y%m')}"
+
+
+def _months(first: datetime, last: datetime) -> List[datetime]:
+    """Month starts from first to last, inclusive"""
+    months = []
+    month = month_start(first)
+    while month <= last:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def _bound(month: datetime) -> str:
+    # Date-only bounds compare correctly against every stored datetime text format
+    return month.strftime('%Y-%m-%d')
+
+
+class HistoryPartitions:
+    """Create, list and expire the monthly rental history partitions"""
+
+    def __init__(self, bind=engine):
+        self.engine = bind
+        self.columns = [column.name for column in RentalHistory.__table__.columns]
+
+    @property
+    def dialect(self) -> str:
+        return self.engine.dialect.name
+
+    def is_partitioned(self, connection=None) -> bool:
+        """Whether rental_history has been converted"""
+        if connection is None:
+            with self.engine.connect() as connection:
+                return self.is_partitioned(connection)
+        if self.dialect == 'sqlite':
+            return connection.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = :name"
+            ), {'name': PARENT_TABLE}).first() is not None
+        if self.dialect == 'postgresql':
+            return connection.execute(text(
+                "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+                "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"
+            ), {'name': PARENT_TABLE}).first() is not None
+        return False
+
+    def partitions(self, connection) -> List[datetime]:
+        """Months that have a partition, oldest first"""
+        if self.dialect == 'sqlite':
+            names = connection.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE :prefix"
+            ), {'prefix': f'{PARTITION_PREFIX}%'}).scalars()
+        else:
+            names = connection.execute(text(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = CAST(:parent AS regclass)"
+            ), {'parent': PARENT_TABLE}).scalars()
+        matches = (_PARTITION_NAME.match(name) for name in names)
+        return sorted(datetime.strptime(m.group(1), '%Y%m') for m in matches if m)
+
+    # Conversion ---------------------------------------------------------------
+
+    def partition(self) -> Dict:
+        """Convert rental_history into monthly partitions, moving the existing rows"""
+        if self.dialect not in ('sqlite', 'postgresql'):
+            raise RuntimeError(f'Rental history partitioning supports SQLite and PostgreSQL, not {self.dialect}')
+
+        with self.engine.connect() as connection:
+            self._begin(connection)
+            if self.is_partitioned(connection):
+                connection.rollback()
+                return {'converted': False, 'created': self.ensure_partitions()}
+
+            first, last = self._return_date_range(connection)
+            today = month_start(datetime.utcnow())
+            months = _months(min(first or today, today),
+                             max(last or today, add_months(today, PARTITION_MONTHS_AHEAD)))
+
+            connection.exec_driver_sql(f'ALTER TABLE {PARENT_TABLE} RENAME TO {UNPARTITIONED_TABLE}')
+            if self.dialect == 'postgresql':
+                self._partition_postgresql(connection, months)
+            else:
+                self._partition_sqlite(connection, months)
+            rows = connection.execute(text(f'SELECT count(*) FROM {PARENT_TABLE}')).scalar()
+            connection.exec_driver_sql(f'DROP TABLE {UNPARTITIONED_TABLE}')
+            if self.dialect == 'postgresql':
+                self._index_postgresql(connection)
+            connection.commit()
+        return {'converted': True, 'partitions': len(months), 'rows': rows}
+
+    def _return_date_range(self, connection):
+        if self.dialect == 'sqlite':
+            # Stored as text; the first seven characters are YYYY-MM
+            first, last = connection.execute(text(
+                f'SELECT substr(min(return_date), 1, 7), substr(max(return_date), 1, 7) FROM {PARENT_TABLE}'
+            )).one()
+            parse = lambda value: datetime.strptime(value, '%Y-%m') if value else None
+            return parse(first), parse(last)
+        return connection.execute(text(f'SELECT min(return_date), max(return_date) FROM {PARENT_TABLE}')).one()
+
+    def _partition_postgresql(self, connection, months):
+        # No primary key on the parent: it would have to include return_date, which may be NULL
+        connection.exec_driver_sql(
+            f'CREATE TABLE {PARENT_TABLE} (LIKE {UNPARTITIONED_TABLE} INCLUDING DEFAULTS) '
+            f'PARTITION BY RANGE (return_date)'
+        )
+        connection.exec_driver_sql(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT')
+        for month in months:
+            connection.exec_driver_sql(
+                f"CREATE TABLE {partition_name(month)} PARTITION OF {PARENT_TABLE} "
+                f"FOR VALUES FROM ('{_bound(month)}') TO ('{_bound(next_month(month))}')"
+            )
+        connection.exec_driver_sql(f'INSERT INTO {PARENT_TABLE} SELECT * FROM {UNPARTITIONED_TABLE}')
+
+    def _index_postgresql(self, connection):
+        """Indexes and foreign key on the parent; PostgreSQL creates them on every partition"""
+        parent = Table(PARENT_TABLE, MetaData(), *(Column(c.name, c.type) for c in RentalHistory.__table__.columns))
+        for index in RentalHistory.__table__.indexes:
+            Index(index.name, *(parent.c[column.name] for column in index.columns)).create(connection)
+        Index('ix_rental_history_id', parent.c.id).create(connection)
+        connection.exec_driver_sql(
+            f'ALTER TABLE {PARENT_TABLE} ADD FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE SET NULL'
+        )
+
+    def _partition_sqlite(self, connection, months):
+        existing = {column['name'] for column in inspect(connection).get_columns(UNPARTITIONED_TABLE)}
+        columns = ', '.join(f'"{name}"' for name in self.columns if name in existing)
+        for name in [partition_name(month) for month in months] + [DEFAULT_PARTITION]:
+            self._create_sqlite_table(connection, name)
+        for month in months:
+            connection.exec_driver_sql(
+                f"INSERT INTO {partition_name(month)} ({columns}) SELECT {columns} FROM {UNPARTITIONED_TABLE} "
+                f"WHERE return_date >= '{_bound(month)}' AND return_date < '{_bound(next_month(month))}'"
+            )
+        connection.exec_driver_sql(
+            f"INSERT INTO {DEFAULT_PARTITION} ({columns}) SELECT {columns} FROM {UNPARTITIONED_TABLE} "
+            f"WHERE {self._outside(months, 'return_date')}"
+        )
+        self._create_sqlite_view(connection, months)
+
+    def _create_sqlite_table(self, connection, name: str):
+        """A monthly table with the model's columns and indexes (suffixed with the month)"""
+        suffix = name[len(PARENT_TABLE) + 1:]
+        table = Table(name, MetaData(), *(Column(c.name, c.type, primary_key=c.primary_key)
+                                          for c in RentalHistory.__table__.columns))
+        for index in RentalHistory.__table__.indexes:
+            Index(f'{index.name}_{suffix}', *(table.c[column.name] for column in index.columns))
+        table.create(connection, checkfirst=True)
+
+    def _outside(self, months, column: str) -> str:
+        """SQL condition for dates with no monthly partition"""
+        if not months:
+            return '1'
+        return (f"{column} IS NULL OR {column} < '{_bound(months[0])}' "
+                f"OR {column} >= '{_bound(next_month(months[-1]))}'")
+
+    def _create_sqlite_view(self, connection, months):
+        """(Re)create the rental_history view and its routing triggers over the given months"""
+        connection.exec_driver_sql(f'DROP VIEW IF EXISTS {PARENT_TABLE}')  # drops its triggers too
+        tables = [partition_name(month) for month in months] + [DEFAULT_PARTITION]
+        columns = ', '.join(f'"{name}"' for name in self.columns)
+        connection.exec_driver_sql(f'CREATE VIEW {PARENT_TABLE} AS ' + ' UNION ALL '.join(
+            f'SELECT {columns} FROM {table}' for table in tables))
+
+        new_values = ', '.join(f'NEW."{name}"' for name in self.columns)
+        route = ''.join(
+            f"INSERT INTO {partition_name(month)} ({columns}) SELECT {new_values} "
+            f"WHERE NEW.return_date >= '{_bound(month)}' AND NEW.return_date < '{_bound(next_month(month))}';\n"
+            for month in months
+        ) + f"INSERT INTO {DEFAULT_PARTITION} ({columns}) SELECT {new_values} " \
+            f"WHERE {self._outside(months, 'NEW.return_date')};\n"
+        remove = ''.join(f'DELETE FROM {table} WHERE id = OLD.id;\n' for table in tables)
+
+        connection.exec_driver_sql(
+            f'CREATE TRIGGER {PARENT_TABLE}_insert INSTEAD OF INSERT ON {PARENT_TABLE} BEGIN\n{route}END')
+        # An update may move the row to another month: delete it everywhere, insert it where it belongs
+        connection.exec_driver_sql(
+            f'CREATE TRIGGER {PARENT_TABLE}_update INSTEAD OF UPDATE ON {PARENT_TABLE} BEGIN\n{remove}{route}END')
+        connection.exec_driver_sql(
+            f'CREATE TRIGGER {PARENT_TABLE}_delete INSTEAD OF DELETE ON {PARENT_TABLE} BEGIN\n{remove}END')
+
+    def _begin(self, connection):
+        """Make SQLite DDL transactional (the driver only opens transactions for DML)"""
+        if self.dialect == 'sqlite' and not connection.connection.dbapi_connection.in_transaction:
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+    # Maintenance ---------------------------------------------------------------
+
+    def ensure_partitions(self, months_ahead: int = PARTITION_MONTHS_AHEAD) -> List[str]:
+        """Create missing partitions from this month up to months_ahead; returns the new tables"""
+        today = month_start(datetime.utcnow())
+        last = add_months(today, months_ahead)
+        with self.engine.connect() as connection:
+            self._begin(connection)
+            if not self.is_partitioned(connection):
+                connection.rollback()
+                return []
+            existing = self.partitions(connection)
+            missing = [month for month in _months(today, last) if month not in existing]
+            for month in missing:
+                self._add_partition(connection, month)
+            if missing and self.dialect == 'sqlite':
+                self._create_sqlite_view(connection, sorted(existing + missing))
+            connection.commit()
+        return [partition_name(month) for month in missing]
+
+    def _add_partition(self, connection, month: datetime):
+        """New monthly table, taking over that month's rows from the default partition"""
+        name = partition_name(month)
+        in_month = f"return_date >= '{_bound(month)}' AND return_date < '{_bound(next_month(month))}'"
+        if self.dialect == 'sqlite':
+            self._create_sqlite_table(connection, name)
+            connection.exec_driver_sql(f'INSERT INTO {name} SELECT * FROM {DEFAULT_PARTITION} WHERE {in_month}')
+        else:
+            # Attaching checks the default partition holds no rows of the month, so move them first
+            connection.exec_driver_sql(f'CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS)')
+            connection.exec_driver_sql(f'INSERT INTO {name} SELECT * FROM {DEFAULT_PARTITION} WHERE {in_month}')
+        connection.exec_driver_sql(f'DELETE FROM {DEFAULT_PARTITION} WHERE {in_month}')
+        if self.dialect == 'postgresql':
+            connection.exec_driver_sql(
+                f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} "
+                f"FOR VALUES FROM ('{_bound(month)}') TO ('{_bound(next_month(month))}')"
+            )
+
+    def drop_before(self, session, cutoff: datetime) -> int:
+        """Drop (or archive) every month that ended before cutoff; returns rows removed
+
+        Retention works in whole months: the month containing cutoff is kept
+        until it has fully expired. Older rows left in the default partition
+        are deleted in the same transaction.
+        """
+        boundary = month_start(cutoff)
+        connection = session.connection()
+        self._begin(connection)
+        months = self.partitions(connection)
+        expired = [month for month in months if next_month(month) <= boundary]
+
+        removed = 0
+        if expired and self.dialect == 'sqlite':
+            connection.exec_driver_sql(f'DROP VIEW {PARENT_TABLE}')
+        for month in expired:
+            name = partition_name(month)
+            removed += connection.execute(text(f'SELECT count(*) FROM {name}')).scalar()
+            if ARCHIVE_EXPIRED_PARTITIONS:
+                if self.dialect == 'postgresql':
+                    connection.exec_driver_sql(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}')
+                connection.exec_driver_sql(f"ALTER TABLE {name} RENAME TO {ARCHIVE_PREFIX}{month.strftime('%Y%m')}")
+            else:
+                connection.exec_driver_sql(f'DROP TABLE {name}')
+        if expired and self.dialect == 'sqlite':
+            self._create_sqlite_view(connection, [month for month in months if month not in expired])
+
+        # Logged as one predicate so restore replays the drop, partitions included
+        record_delete_where(session, PARENT_TABLE, 'return_date', '<', boundary)
+        stragglers = session.query(RentalHistory).filter(RentalHistory.return_date < boundary)
+        removed += stragglers.count()
+        stragglers.delete(synchronize_session=False)
+        session.commit()
+        return removed
+
+    def drop_all(self):
+        """Drop the view or parent table and every partition (before restore --replace)"""
+        with self.engine.connect() as connection:
+            self._begin(connection)
+            if self.is_partitioned(connection):
+                if self.dialect == 'sqlite':
+                    connection.exec_driver_sql(f'DROP VIEW {PARENT_TABLE}')
+                    for month in self.partitions(connection):
+                        connection.exec_driver_sql(f'DROP TABLE {partition_name(month)}')
+                    connection.exec_driver_sql(f'DROP TABLE {DEFAULT_PARTITION}')
+                else:
+                    connection.exec_driver_sql(f'DROP TABLE {PARENT_TABLE}')
+            connection.commit()
+
+    def status(self) -> Dict:
+        """Partition months and row counts for display"""
+        with self.engine.connect() as connection:
+            if not self.is_partitioned(connection):
+                return {'partitioned': False, 'partitions': []}
+            tables = [partition_name(month) for month in self.partitions(connection)] + [DEFAULT_PARTITION]
+            return {'partitioned': True, 'partitions': [
+                (table, connection.execute(text(f'SELECT count(*) FROM {table}')).scalar()) for table in tables
+            ]}
+
+
+# Global partition manager for the app database
+history_partitions = HistoryPartitions()
+
+
+if __name__ == '__main__':
+    print("Varasai Oxygen - Rental History Partitioning")
+    print("=" * 50)
+    result = history_partitions.partition()
+    if result['converted']:
+        print(f"✓ Moved {result['rows']} rows into {result['partitions']} monthly partitions")
+    else:
+        print(f"✓ Already partitioned; created {len(result['created'])} upcoming partitions")
+    for table, rows in history_partitions.status()['partitions']:
+        print(f"  {table:<32}{rows:>10}")
+    print("=" * 50)
+    print("Partitioning complete!")
@@ -0,0 +1,202 @@
+# import_validator.py - Dry-run validation for MS Access imports
+"""
+Dry-run import validation
+
+Runs the full field mapping of an import over the whole source table in
+column-vectorized form (pandas), checks referential integrity against the
+database with set operations and reports a per-error-class summary with sample
+rows. Nothing is written to the database.
+
+The rules mirror what InstantImporter would skip during a real import, so the
+report predicts the "skipped N" count before any data is mutated.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, List
+import logging
+
+import pandas as pd
+
+from access_connector import AccessConnector
+from db_service import CustomerService, CylinderService
+
+# Human readable descriptions for every error class the validator can report
+ERROR_CLASSES = {
+    'missing_customer_no': 'Customer number is empty',
+    'missing_customer_name': 'Customer name is empty',
+    'missing_custom_id': 'Cylinder ID is empty',
+    'missing_cylinder_no': 'Cylinder number is empty',
+    'missing_return_date': 'Return date is empty (only completed rentals are imported)',
+    'duplicate_in_source': 'Key appears more than once in the source table',
+    'already_exists': 'Key already exists in the database',
+    'unknown_customer': 'Customer number not found in the database',
+    'unknown_cylinder': 'Cylinder number not found in the database',
+    'unparseable_dispatch_date': 'Dispatch date could not be parsed',
+    'unparseable_return_date': 'Return date could not be parsed',
+    'return_before_dispatch': 'Return date is earlier than dispatch date',
+    'older_than_retention': 'Return date is older than the 6 month history window',
+}
+
+# Required (non-empty) target fields per import type
+REQUIRED_FIELDS = {
+    'customer': ['customer_no', 'customer_name'],
+    'cylinder': ['custom_id'],
+    'transaction': ['customer_no', 'cylinder_no'],
+    'rental_history': ['customer_no', 'cylinder_no', 'return_date'],
+}
+
+# Field used for duplicate detection per import type
+KEY_FIELDS = {
+    'customer': 'customer_no',
+    'cylinder': 'custom_id',
+}
+
+
+class ImportValidator:
+    """Validate an import mapping against a full source table without writing"""
+
+    def __init__(self, sample_size: int = 5):
+        self.sample_size = sample_size
+        self.logger = logging.getLogger(__name__)
+
+    def validate(self, access_file: str, table_name: str, field_mapping: Dict[str, str],
+                 import_type: str) -> Dict:
+        """Load the Access table and validate it (dry run)"""
+        connector = AccessConnector()
+        if not connector.connect(access_file):
+            raise ValueError('Failed to connect to Access database')
+
+        try:
+            frame = connector.read_table_frame(table_name)
+        finally:
+            connector.close()
+
+        if frame is None:
+            raise ValueError(f'Could not read table {table_name}')
+
+        report = self.validate_frame(frame, field_mapping, import_type)
+        report['table_name'] = table_name
+        return report
+
+    def validate_frame(self, frame: pd.DataFrame, field_mapping: Dict[str, str],
+                       import_type: str) -> Dict:
+        """Validate an already loaded source DataFrame (dry run)"""
+        if import_type not in REQUIRED_FIELDS:
+            raise ValueError(f'Invalid import type: {import_type}')
+
+        mapping_errors = [
+            f'Mapped column "{source}" for {target} does not exist in the source table'
+            for target, source in field_mapping.items()
+            if source and source not in frame.columns
+        ]
+
+        # Apply the mapping column-wise: one normalized string column per target field
+        mapped = pd.DataFrame(index=frame.index)
+        for target, source in field_mapping.items():
+            if source and source in frame.columns:
+                mapped[target] = frame[source].astype('string').str.strip().replace('', pd.NA)
+        for target in REQUIRED_FIELDS[import_type]:
+            if target not in mapped:
+                mapped[target] = pd.Series(pd.NA, index=frame.index, dtype='string')
+
+        checks = {}
+        for target in REQUIRED_FIELDS[import_type]:
+            checks[f'missing_{target}'] = mapped[target].isna()
+
+        if import_type in KEY_FIELDS:
+            self._check_keys(import_type, mapped, checks)
+        else:
+            self._check_transactions(import_type, mapped, checks)
+
+        return self._build_report(frame, mapped, checks, mapping_errors, import_type)
+
+    def _check_keys(self, import_type: str, mapped: pd.DataFrame, checks: Dict):
+        """Duplicate checks for customer/cylinder master data"""
+        key_field = KEY_FIELDS[import_type]
+        keys = mapped[key_field].str.upper()
+        present = keys.notna()
+
+        if import_type == 'customer':
+            with CustomerService() as service:
+                existing = service.get_customer_no_set()
+        else:
+            with CylinderService() as service:
+                existing = service.get_identifier_set(include_serial=False)
+
+        in_db = present & keys.isin(existing)
+        checks['already_exists'] = in_db
+        # First occurrence wins during import, later ones are skipped
+        checks['duplicate_in_source'] = present & ~in_db & keys.duplicated(keep='first')
+
+    def _check_transactions(self, import_type: str, mapped: pd.DataFrame, checks: Dict):
+        """Referential integrity and date checks for transaction/history rows"""
+        customer_nos = mapped['customer_no'].str.upper()
+        cylinder_nos = mapped['cylinder_no'].str.upper()
+
+        with CustomerService() as service:
+            known_customers = service.get_customer_no_set()
+        with CylinderService() as service:
+            known_cylinders = service.get_identifier_set()
+
+        checks['unknown_customer'] = customer_nos.notna() & ~customer_nos.isin(known_customers)
+        checks['unknown_cylinder'] = cylinder_nos.notna() & ~cylinder_nos.isin(known_cylinders)
+
+        dispatch_raw, dispatch = self._parse_dates(mapped, 'dispatch_date')
+        return_raw, returned = self._parse_dates(mapped, 'return_date')
+        checks['unparseable_dispatch_date'] = dispatch_raw.notna() & dispatch.isna()
+        checks['unparseable_return_date'] = return_raw.notna() & returned.isna()
+        checks['return_before_dispatch'] = (returned < dispatch).fillna(False)
+
+        if import_type == 'rental_history':
+            six_months_ago = pd.Timestamp(datetime.now() - timedelta(days=180))
+            checks['older_than_retention'] = (returned < six_months_ago).fillna(False)
+
+    def _parse_dates(self, mapped: pd.DataFrame, field: str):
+        """Parse a mapped date column the way the importer does (YYYY-MM-DD prefix)"""
+        if field not in mapped:
+            empty = pd.Series(pd.NA, index=mapped.index, dtype='string')
+            return empty, pd.Series(pd.NaT, index=mapped.index)
+        raw = mapped[field]
+        parsed = pd.to_datetime(raw.str.slice(0, 10), format='%Y-%m-%d', errors='coerce')
+        return raw, parsed
+
+    def _build_report(self, frame: pd.DataFrame, mapped: pd.DataFrame, checks: Dict,
+                      mapping_errors: List[str], import_type: str) -> Dict:
+        """Summarize error masks into counts and sample rows"""
+        any_error = pd.Series(False, index=frame.index)
+        errors = []
+
+        for code, mask in checks.items():
+            mask = mask.fillna(False).astype(bool)
+            count = int(mask.sum())
+            if not count:
+                continue
+            any_error |= mask
+
+            sample = mapped[mask].head(self.sample_size)
+            sample = sample.astype(object).where(sample.notna(), None)
+            samples = []
+            for position, record in zip(sample.index, sample.to_dict('records')):
+                record['row'] = int(frame.index.get_loc(position)) + 1
+                samples.append(record)
+
+            errors.append({
+                'code': code,
+                'description': ERROR_CLASSES.get(code, code),
+                'count': count,
+                'samples': samples
+            })
+
+        errors.sort(key=lambda e: e['count'], reverse=True)
+        error_rows = int(any_error.sum())
+
+        return {
+            'import_type': import_type,
+            'total_rows': len(frame),
+            'valid_rows': len(frame) - error_rows,
+            'error_rows': error_rows,
+            'mapping_errors': mapping_errors,
+            'errors': errors,
+            'fields': list(mapped.columns),
+            'validated_at': datetime.now().isoformat()
+        }
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Database migration script to normalize status values and add the hot-filter indexes
+Lower-cases cylinder and rental history statuses ("Rented" -> "rented") so the
+status indexes serve every filter, then creates indexes that exist in db_models.py
+but not yet in the database (partial index on rented cylinders by date_borrowed,
+lower(custom_id) / lower(serial_number), rental_history(cylinder_id, return_date)).
+Safe to run more than once.
+"""
+
+from sqlalchemy import func, inspect, or_
+
+from change_log import record_update_where
+from db_models import engine, existing_index_names, Base, Cylinder, RentalHistory, SessionLocal, normalize_status
+
+def normalize_statuses(model) -> int:
+    """Lower-case and trim the status column of one model; returns rows changed"""
+    updated = 0
+    session = SessionLocal()
+    try:
+        raw_statuses = [status for (status,) in session.query(model.status).filter(
+            model.status.isnot(None),
+            or_(model.status != func.lower(model.status), model.status != func.trim(model.status))
+        ).distinct()]
+        # One set-based UPDATE per spelling ("Rented", " rented ") rather than row by row:
+        # SQLite's partitioned rental_history view can't take ORM row updates
+        for raw in raw_statuses:
+            rows = session.query(model).filter(model.status == raw)
+            updated += rows.count()  # the view reports no row count for the UPDATE itself
+            record_update_where(session, model.__tablename__, 'status', '=', raw,
+                                {'status': normalize_status(raw)})
+            rows.update({'status': normalize_status(raw)}, synchronize_session=False)
+        session.commit()
+    finally:
+        session.close()
+    return updated
+
+def create_missing_indexes() -> list:
+    """Create indexes declared on the models that the database doesn't have yet"""
+    created = []
+    existing_tables = set(inspect(engine).get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = existing_index_names(engine, table.name)
+        for index in table.indexes:
+            if index.name not in existing:
+                # Indexes limited to other dialects (ddl_if) are skipped by create()
+                index.create(engine)
+                created.append(index.name)
+    return created
+
+def migrate_status_indexes():
+    """Normalize statuses, then add the indexes"""
+    for model in (Cylinder, RentalHistory):
+        updated = normalize_statuses(model)
+        print(f"✓ {model.__tablename__}: normalized {updated} status values")
+
+    created = create_missing_indexes()
+    if created:
+        print(f"✓ Created indexes: {', '.join(created)}")
+    else:
+        print("✓ No migration needed - all indexes already exist")
+
+    with engine.begin() as connection:
+        if engine.dialect.name in ('sqlite', 'postgresql'):
+            connection.exec_driver_sql('ANALYZE')
+    print("✓ Planner statistics updated")
+
+if __name__ == '__main__':
+    print("Varasai Oxygen - Status Normalization and Index Migration")
+    print("=" * 50)
+    migrate_status_indexes()
+    print("=" * 50)
+    print("Migration complete!")
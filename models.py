@@ -1,42 +1,430 @@
+import fcntl
 import json
 import os
+import threading
 import uuid
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterator, Optional, Sequence
+
+# Compact once the journal holds this many entries and more entries than the base file
+COMPACT_MIN_ENTRIES = 1000
+
+class _JournalState:
+    """In-memory image of one JSON file plus its journal, shared by every JSONDatabase on that file"""
+    
+    def __init__(self, index_fields: Sequence[str]):
+        self.lock = threading.RLock()
+        self.records: Dict[str, Dict] = {}  # id -> record, in insertion order
+        self.index_fields = tuple(index_fields)
+        self.indexes: Dict[str, Dict[str, set]] = {}  # field -> normalized value -> ids
+        self.base_stat = None               # (inode, mtime_ns, size) of the base file when loaded
+        self.base_count = 0                 # records in the base file
+        self.journal_offset = 0             # bytes of the journal already applied
+        self.journal_entries = 0
+        self.lock_file = None               # fd for the cross-process flock
+        self.lock_pid = None                # process that opened lock_file
+        
+        # Group commit: writers queue entries and one of them flushes the whole batch
+        self.commit_cond = threading.Condition()
+        self.pending: List[Dict] = []
+        self.enqueued = 0
+        self.committed = 0
+        self.flushing = False
+        self.failed = None                  # (first_ticket, last_ticket, exception) of the last failed batch
 
 class JSONDatabase:
-    """Base class for JSON database operations"""
+    """JSON file storage with an append-only journal
+    
+    The base file keeps the original format (a JSON list of records). Every
+    single-record write appends one line to <file>.wal instead of rewriting
+    the file, so adds, updates and rentals cost O(1). Records live in an
+    in-memory id -> record index, rebuilt on startup from the base file plus
+    the journal. When the journal outgrows the base file it is compacted:
+    the records are written to a temp file that is atomically renamed over
+    the base file, then the journal is reset.
+    
+    Workers coordinate through an flock on <file>.lock: writers hold it
+    exclusively while they catch up with the journal and append to it, so
+    concurrent writes are serialized instead of overwriting each other.
+    Writes from threads of one worker are group-committed: whichever thread
+    gets there first appends and fsyncs everything queued so far in one go.
+    Read-check-write changes (renting an available cylinder) and inserts
+    that must not replace a record go through update_many() / insert_many(),
+    which check and write under the same exclusive lock.
     
-    def __init__(self, filename: str):
+    Fields passed as ``indexes`` get a secondary index (normalized value ->
+    ids) for find(). It is maintained as the journal is applied and saved
+    next to the base file (<file>.idx) on compaction, so startup does not
+    have to rebuild it.
+    """
+    
+    _states: Dict[str, _JournalState] = {}
+    _states_lock = threading.Lock()
+    
+    def __init__(self, filename: str, indexes: Sequence[str] = ()):
         self.filename = filename
         self.data_dir = "data"
         self.filepath = os.path.join(self.data_dir, filename)
+        self.journal_path = self.filepath + '.wal'
+        self.index_path = self.filepath + '.idx'
+        self.lock_path = self.filepath + '.lock'
         self._ensure_data_directory()
         self._ensure_file_exists()
+        with JSONDatabase._states_lock:
+            self._state = JSONDatabase._states.setdefault(os.path.abspath(self.filepath), _JournalState(indexes))
     
     def _ensure_data_directory(self):
         """Create data directory if it doesn't exist"""
-        if not os.path.exists(self.data_dir):
-            os.makedirs(self.data_dir)
+        os.makedirs(self.data_dir, exist_ok=True)
     
     def _ensure_file_exists(self):
         """Create file with empty list if it doesn't exist"""
         if not os.path.exists(self.filepath):
-            with open(self.filepath, 'w') as f:
-                json.dump([], f)
+            try:
+                # Exclusive create: never truncate a file another worker just made
+                with open(self.filepath, 'x') as f:
+                    json.dump([], f)
+            except FileExistsError:
+                pass
     
-    def load_data(self) -> List[Dict]:
-        """Load data from JSON file"""
+    @staticmethod
+    def _key(record: Dict, position: int) -> str:
+        # Legacy records without an id still need a stable slot in the index
+        return record.get('id') or f'#{position}'
+    
+    @staticmethod
+    def _normalize(value) -> str:
+        return str(value).strip().lower() if value is not None else ''
+    
+    @contextmanager
+    def _file_lock(self, mode):
+        """Hold the cross-process lock (call with the state lock held)"""
+        state = self._state
+        if state.lock_file is None or state.lock_pid != os.getpid():
+            # flock belongs to the open file, which a forked worker would share with its parent
+            state.lock_file = open(self.lock_path, 'a')
+            state.lock_pid = os.getpid()
+        fcntl.flock(state.lock_file, mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(state.lock_file, fcntl.LOCK_UN)
+    
+    def _stat(self):
+        try:
+            stat = os.stat(self.filepath)
+            base_stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            base_stat = None
+        try:
+            journal_size = os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            journal_size = 0
+        return base_stat, journal_size
+    
+    def _sync(self, locked: bool = False):
+        """Bring the in-memory index up to date with the files on disk"""
+        state = self._state
+        base_stat, journal_size = self._stat()
+        if base_stat == state.base_stat and journal_size == state.journal_offset:
+            return
+        if not locked:
+            with self._file_lock(fcntl.LOCK_SH):
+                self._sync(locked=True)
+            return
+        
+        if base_stat != state.base_stat or journal_size < state.journal_offset:
+            self._reload(base_stat)
+        elif journal_size > state.journal_offset:
+            self._replay_journal()
+    
+    def _reload(self, base_stat):
+        state = self._state
         try:
             with open(self.filepath, 'r') as f:
-                return json.load(f)
+                records = json.load(f)
         except (json.JSONDecodeError, FileNotFoundError):
-            return []
+            records = []
+        state.records = {self._key(r, i): r for i, r in enumerate(records)}
+        state.base_count = len(records)
+        state.base_stat = base_stat
+        state.journal_offset = 0
+        state.journal_entries = 0
+        if not self._load_indexes(base_stat):
+            self._build_indexes()
+        self._replay_journal()
+    
+    def _build_indexes(self):
+        state = self._state
+        state.indexes = {field: {} for field in state.index_fields}
+        for record_id, record in state.records.items():
+            self._index(record_id, record)
+    
+    def _load_indexes(self, base_stat) -> bool:
+        """Use the index file saved at the last compaction if it matches the base file"""
+        state = self._state
+        if not state.index_fields or base_stat is None:
+            return False
+        try:
+            with open(self.index_path, 'r') as f:
+                saved = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return False
+        if saved.get('base') != list(base_stat) or saved.get('fields') != list(state.index_fields):
+            return False
+        state.indexes = {field: {value: set(ids) for value, ids in values.items()}
+                         for field, values in saved['indexes'].items()}
+        return True
+    
+    def _save_indexes(self):
+        state = self._state
+        if not state.index_fields:
+            return
+        saved = {
+            'base': list(state.base_stat),
+            'fields': list(state.index_fields),
+            'indexes': {field: {value: sorted(ids) for value, ids in values.items()}
+                        for field, values in state.indexes.items()},
+        }
+        tmp_path = f'{self.index_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(saved, f)
+        os.replace(tmp_path, self.index_path)
+    
+    def _index(self, record_id: str, record: Dict):
+        for field, values in self._state.indexes.items():
+            value = self._normalize(record.get(field))
+            if value:
+                values.setdefault(value, set()).add(record_id)
+    
+    def _unindex(self, record_id: str, record: Dict):
+        for field, values in self._state.indexes.items():
+            value = self._normalize(record.get(field))
+            ids = values.get(value)
+            if ids is not None:
+                ids.discard(record_id)
+                if not ids:
+                    del values[value]
+    
+    def _replay_journal(self):
+        state = self._state
+        try:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(state.journal_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # Only apply complete lines; a torn final line is finished by its writer
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if line:
+                self._apply(json.loads(line))
+        state.journal_offset += end
+    
+    def _apply(self, entry: Dict):
+        state = self._state
+        old = state.records.get(entry['id'])
+        if old is not None:
+            self._unindex(entry['id'], old)
+        if entry['op'] == 'put':
+            state.records[entry['id']] = entry['record']
+            self._index(entry['id'], entry['record'])
+        elif entry['op'] == 'delete':
+            state.records.pop(entry['id'], None)
+        state.journal_entries += 1
+    
+    def _commit(self, entries: List[Dict]):
+        """Queue entries for the journal and return once they are durable
+        
+        Must be called without the state lock held.
+        """
+        state = self._state
+        with state.commit_cond:
+            state.pending.extend(entries)
+            state.enqueued += 1
+            ticket = state.enqueued
+            while state.committed < ticket:
+                if state.flushing:
+                    state.commit_cond.wait()
+                    continue
+                # Become the flusher for everything queued so far
+                state.flushing = True
+                first, last = state.committed + 1, state.enqueued
+                batch, state.pending = state.pending, []
+                state.commit_cond.release()
+                error = None
+                try:
+                    self._flush(batch)
+                except Exception as e:
+                    error = e
+                finally:
+                    state.commit_cond.acquire()
+                    state.flushing = False
+                    state.committed = last
+                    state.failed = (first, last, error) if error else None
+                    state.commit_cond.notify_all()
+            if state.failed and state.failed[0] <= ticket <= state.failed[1]:
+                raise state.failed[2]
+    
+    def _flush(self, batch: List[Dict]):
+        """Append a batch to the journal under the exclusive file lock"""
+        with self._exclusive():
+            self._append(batch)
+    
+    @contextmanager
+    def _exclusive(self):
+        """Hold the state lock and the exclusive file lock, caught up with the journal"""
+        with self._state.lock, self._file_lock(fcntl.LOCK_EX):
+            self._sync(locked=True)
+            yield
+    
+    def _append(self, entries: List[Dict]):
+        """Append entries to the journal and apply them (exclusive lock held)"""
+        state = self._state
+        data = ''.join(json.dumps(entry, default=str) + '\n' for entry in entries).encode('utf-8')
+        with open(self.journal_path, 'ab') as f:
+            if f.tell() > state.journal_offset:
+                # Torn line left by a worker that died mid-append
+                f.truncate(state.journal_offset)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            position = f.tell()
+        for line in data.splitlines():
+            self._apply(json.loads(line))
+        state.journal_offset = position
+        
+        if state.journal_entries >= max(COMPACT_MIN_ENTRIES, state.base_count):
+            self._write_base(list(state.records.values()))
+    
+    def compact(self):
+        """Fold the journal into the base file (atomic rename), then reset the journal"""
+        with self._state.lock, self._file_lock(fcntl.LOCK_EX):
+            self._sync(locked=True)
+            self._write_base(list(self._state.records.values()))
+    
+    def _write_base(self, records: List[Dict]):
+        """Replace the base file and reset the journal (exclusive file lock held)"""
+        state = self._state
+        tmp_path = f'{self.filepath}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(records, f, default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.filepath)
+        # Replaying the old journal over the new base is harmless, so a crash here loses nothing
+        with open(f'{self.journal_path}.tmp', 'w'):
+            pass
+        os.replace(f'{self.journal_path}.tmp', self.journal_path)
+        
+        stat = os.stat(self.filepath)
+        state.records = {self._key(r, i): r for i, r in enumerate(json.loads(json.dumps(records, default=str)))}
+        state.base_count = len(records)
+        state.base_stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        state.journal_offset = 0
+        state.journal_entries = 0
+        self._build_indexes()
+        self._save_indexes()
+    
+    def load_data(self) -> List[Dict]:
+        """Load all records (copies; changing them does not change the store)"""
+        with self._state.lock:
+            self._sync()
+            return [dict(r) for r in self._state.records.values()]
     
     def save_data(self, data: List[Dict]):
-        """Save data to JSON file"""
-        with open(self.filepath, 'w') as f:
-            json.dump(data, f, indent=2, default=str)
+        """Replace the whole data set"""
+        with self._state.lock, self._file_lock(fcntl.LOCK_EX):
+            self._write_base(data)
+    
+    def count(self) -> int:
+        """Number of records"""
+        with self._state.lock:
+            self._sync()
+            return len(self._state.records)
+    
+    def get(self, record_id: str) -> Optional[Dict]:
+        """Get one record by id (a copy)"""
+        with self._state.lock:
+            self._sync()
+            record = self._state.records.get(record_id)
+            return dict(record) if record is not None else None
+    
+    def find(self, field: str, value) -> List[Dict]:
+        """Get records whose indexed field equals value (case-insensitive, copies)"""
+        return self.find_any({field: value})
+    
+    def find_any(self, criteria: Dict[str, object]) -> List[Dict]:
+        """Get records matching any of the indexed field values (empty values are ignored)"""
+        state = self._state
+        for field in criteria:
+            if field not in state.index_fields:
+                raise ValueError(f'{self.filename} has no index on {field!r}')
+        with state.lock:
+            self._sync()
+            ids = set()
+            for field, value in criteria.items():
+                ids.update(state.indexes[field].get(self._normalize(value), ()))
+            return [dict(state.records[record_id]) for record_id in ids]
+    
+    def get_many(self, record_ids) -> List[Dict]:
+        """Get the records with the given ids in one sync (copies, missing ids skipped)"""
+        with self._state.lock:
+            self._sync()
+            records = self._state.records
+            return [dict(records[record_id]) for record_id in dict.fromkeys(record_ids) if record_id in records]
+    
+    def put(self, record: Dict):
+        """Insert or replace one record by its id"""
+        self.put_many([record])
+    
+    def put_many(self, records: List[Dict]):
+        """Insert or replace several records with a single journal write"""
+        if records:
+            self._commit([{'op': 'put', 'id': r['id'], 'record': r} for r in records])
+    
+    def insert_many(self, records: List[Dict]):
+        """Add new records with a single journal write; raises ValueError if an id is taken"""
+        if not records:
+            return
+        with self._exclusive():
+            ids = [r['id'] for r in records]
+            taken = [record_id for record_id in ids if record_id in self._state.records]
+            if taken or len(set(ids)) != len(ids):
+                raise ValueError(f'{self.filename}: record id already exists: {(taken or ids)[0]}')
+            self._append([{'op': 'put', 'id': r['id'], 'record': r} for r in records])
+    
+    def update(self, record_id: str, change) -> Optional[Dict]:
+        """Change one record atomically; see update_many()"""
+        updated = self.update_many([record_id], change)
+        return updated[0] if updated else None
+    
+    def update_many(self, record_ids, change) -> List[Dict]:
+        """Re-read records under the exclusive lock and write what change() makes of them
+        
+        change gets a copy of each current record and returns the new record,
+        or None to leave it as is (e.g. the cylinder is no longer available).
+        Missing ids are skipped. Returns the written records.
+        """
+        with self._exclusive():
+            records = self._state.records
+            updated = []
+            for record_id in dict.fromkeys(record_ids):
+                if record_id in records:
+                    record = change(dict(records[record_id]))
+                    if record is not None:
+                        updated.append(record)
+            if updated:
+                self._append([{'op': 'put', 'id': r['id'], 'record': r} for r in updated])
+            return updated
+    
+    def delete(self, record_id: str) -> bool:
+        """Delete one record by id"""
+        if self.get(record_id) is None:
+            return False
+        self._commit([{'op': 'delete', 'id': record_id}])
+        return True
 
 class Customer:
     """Customer model for managing customer data"""
@@ -54,54 +442,48 @@ class Customer:
     
     def get_by_id(self, customer_id: str) -> Optional[Dict]:
         """Get customer by ID"""
-        customers = self.db.load_data()
-        for customer in customers:
-            if customer.get('id') == customer_id:
-                return customer
-        return None
+        return self.db.get(customer_id)
+    
+    def get_many(self, customer_ids) -> List[Dict]:
+        """Get customers by ID (missing IDs are skipped)"""
+        return self.db.get_many(customer_ids)
+    
+    def count(self) -> int:
+        """Get total number of customers"""
+        return self.db.count()
+    
+    def iter_all(self, batch_size: int = 1000) -> Iterator[Dict]:
+        """Iterate over all customers"""
+        return iter(self.db.load_data())
     
     def add(self, customer_data: Dict) -> Dict:
         """Add new customer"""
-        customers = self.db.load_data()
-        
         # Generate unique ID
         customer_data['id'] = self.generate_id()
         customer_data['created_at'] = datetime.now().isoformat()
         customer_data['updated_at'] = datetime.now().isoformat()
         
-        customers.append(customer_data)
-        self.db.save_data(customers)
+        self.db.put(customer_data)
         
         return customer_data
     
     def update(self, customer_id: str, customer_data: Dict) -> Optional[Dict]:
         """Update existing customer"""
-        customers = self.db.load_data()
+        customer = self.db.get(customer_id)
+        if not customer:
+            return None
         
-        for i, customer in enumerate(customers):
-            if customer.get('id') == customer_id:
-                # Preserve original ID and created_at
-                customer_data['id'] = customer_id
-                customer_data['created_at'] = customer.get('created_at')
-                customer_data['updated_at'] = datetime.now().isoformat()
-                
-                customers[i] = customer_data
-                self.db.save_data(customers)
-                return customer_data
+        # Preserve original ID and created_at
+        customer_data['id'] = customer_id
+        customer_data['created_at'] = customer.get('created_at')
+        customer_data['updated_at'] = datetime.now().isoformat()
         
-        return None
+        self.db.put(customer_data)
+        return customer_data
     
     def delete(self, customer_id: str) -> bool:
         """Delete customer"""
-        customers = self.db.load_data()
-        
-        for i, customer in enumerate(customers):
-            if customer.get('id') == customer_id:
-                customers.pop(i)
-                self.db.save_data(customers)
-                return True
-        
-        return False
+        return self.db.delete(customer_id)
     
     def search(self, query: str) -> List[Dict]:
         """Search customers by customer_no, customer_name, customer_address, customer_city, customer_state, customer_phone, and other fields"""
@@ -201,7 +583,7 @@ class Cylinder:
     """Cylinder model for managing cylinder data"""
     
     def __init__(self):
-        self.db = JSONDatabase("cylinders.json")
+        self.db = JSONDatabase("cylinders.json", indexes=('status', 'rented_to'))
         # Cylinder type to prefix mapping
         self.type_prefixes = {
             'Medical Oxygen': 'OXY',
@@ -254,11 +636,19 @@ class Cylinder:
     
     def get_by_id(self, cylinder_id: str) -> Optional[Dict]:
         """Get cylinder by ID"""
-        cylinders = self.db.load_data()
-        for cylinder in cylinders:
-            if cylinder.get('id') == cylinder_id:
-                return cylinder
-        return None
+        return self.db.get(cylinder_id)
+    
+    def get_many(self, cylinder_ids) -> List[Dict]:
+        """Get cylinders by ID (missing IDs are skipped)"""
+        return self.db.get_many(cylinder_ids)
+    
+    def count(self) -> int:
+        """Get total number of cylinders"""
+        return self.db.count()
+    
+    def iter_all(self, batch_size: int = 1000) -> Iterator[Dict]:
+        """Iterate over all cylinders"""
+        return iter(self.db.load_data())
     
     def find_by_any_identifier(self, identifier: str) -> Optional[Dict]:
         """Find cylinder by any identifier: ID, custom_id, or serial_number"""
@@ -282,7 +672,6 @@ class Cylinder:
         """Add new cylinder"""
         from models import Customer
         from datetime import datetime
-        cylinders = self.db.load_data()
         
         # Generate unique ID
         cylinder_data['id'] = self.generate_id()
@@ -305,8 +694,7 @@ class Cylinder:
             cylinder_data['customer_name'] = ''
             cylinder_data['customer_email'] = ''
         
-        cylinders.append(cylinder_data)
-        self.db.save_data(cylinders)
+        self.db.put(cylinder_data)
         
         return cylinder_data
     
@@ -314,61 +702,50 @@ class Cylinder:
         """Update existing cylinder"""
         from models import Customer
         from datetime import datetime
-        cylinders = self.db.load_data()
+        cylinder = self.db.get(cylinder_id)
+        if not cylinder:
+            return None
         
-        for i, cylinder in enumerate(cylinders):
-            if cylinder.get('id') == cylinder_id:
-                # Preserve original ID and created_at
-                cylinder_data['id'] = cylinder_id
-                cylinder_data['created_at'] = cylinder.get('created_at')
-                cylinder_data['updated_at'] = datetime.now().isoformat()
-                
-                # Ensure custom_id field exists (even if empty)
-                if 'custom_id' not in cylinder_data:
-                    cylinder_data['custom_id'] = ''
-                
-                # If cylinder is being rented to a customer, store customer name
-                if cylinder_data.get('rented_to'):
-                    customer_model = Customer()
-                    customer = customer_model.get_by_id(cylinder_data['rented_to'])
-                    if customer:
-                        cylinder_data['customer_name'] = customer.get('customer_name') or customer.get('name', '')
-                        cylinder_data['customer_email'] = customer.get('customer_email') or customer.get('email', '')
-                else:
-                    # Clear customer info if not rented
-                    cylinder_data['customer_name'] = ''
-                    cylinder_data['customer_email'] = ''
-                
-                cylinders[i] = cylinder_data
-                self.db.save_data(cylinders)
-                return cylinder_data
+        # Preserve original ID and created_at
+        cylinder_data['id'] = cylinder_id
+        cylinder_data['created_at'] = cylinder.get('created_at')
+        cylinder_data['updated_at'] = datetime.now().isoformat()
         
-        return None
+        # Ensure custom_id field exists (even if empty)
+        if 'custom_id' not in cylinder_data:
+            cylinder_data['custom_id'] = ''
+        
+        # If cylinder is being rented to a customer, store customer name
+        if cylinder_data.get('rented_to'):
+            customer_model = Customer()
+            customer = customer_model.get_by_id(cylinder_data['rented_to'])
+            if customer:
+                cylinder_data['customer_name'] = customer.get('customer_name') or customer.get('name', '')
+                cylinder_data['customer_email'] = customer.get('customer_email') or customer.get('email', '')
+        else:
+            # Clear customer info if not rented
+            cylinder_data['customer_name'] = ''
+            cylinder_data['customer_email'] = ''
+        
+        self.db.put(cylinder_data)
+        return cylinder_data
     
     def bulk_update(self, updates_dict: Dict[str, Dict]) -> int:
         """Bulk update multiple cylinders for performance"""
-        cylinders = self.db.load_data()
-        updated_count = 0
-        
-        for cylinder in cylinders:
-            if cylinder['id'] in updates_dict:
-                cylinder.update(updates_dict[cylinder['id']])
-                updated_count += 1
+        updated = []
+        for cylinder_id, changes in updates_dict.items():
+            cylinder = self.db.get(cylinder_id)
+            if cylinder:
+                cylinder.update(changes)
+                updated.append(cylinder)
         
-        self.db.save_data(cylinders)
-        return updated_count
+        # One journal write for the whole batch
+        self.db.put_many(updated)
+        return len(updated)
     
     def delete(self, cylinder_id: str) -> bool:
         """Delete cylinder"""
-        cylinders = self.db.load_data()
-        
-        for i, cylinder in enumerate(cylinders):
-            if cylinder.get('id') == cylinder_id:
-                cylinders.pop(i)
-                self.db.save_data(cylinders)
-                return True
-        
-        return False
+        return self.db.delete(cylinder_id)
     
     def search(self, query: str) -> List[Dict]:
         """Search cylinders by serial number, type, status, location, and other fields"""
@@ -400,44 +777,54 @@ class Cylinder:
     
     def get_by_status(self, status: str) -> List[Dict]:
         """Get cylinders by status"""
-        cylinders = self.db.load_data()
-        return [c for c in cylinders if c.get('status', '').lower() == status.lower()]
+        return self.db.find('status', status)
     
     def get_by_customer(self, customer_id: str) -> List[Dict]:
         """Get all cylinders rented by a specific customer"""
-        cylinders = self.db.load_data()
-        return [c for c in cylinders if c.get('rented_to') == customer_id]
+        return self.db.find('rented_to', customer_id)
     
     def rent_cylinder(self, cylinder_id: str, customer_id: str, rental_date: str = None) -> bool:
         """Rent a cylinder to a customer with rental date"""
-        from datetime import datetime
         from models import Customer
         
-        cylinders = self.db.load_data()
-        for cylinder in cylinders:
-            if cylinder['id'] == cylinder_id:
-                if cylinder.get('status', '').lower() != 'available':
-                    return False
-                
-                # Get customer information
-                customer_model = Customer()
-                customer = customer_model.get_by_id(customer_id)
-                if not customer:
-                    return False
-                
-                cylinder['status'] = 'rented'
-                cylinder['rented_to'] = customer_id
-                # Handle both old and new customer field structures
-                cylinder['customer_name'] = customer.get('customer_name') or customer.get('name', '')
-                cylinder['customer_email'] = customer.get('customer_email') or customer.get('email', '')
-                cylinder['rental_date'] = rental_date or datetime.now().isoformat()
-                cylinder['date_borrowed'] = rental_date or datetime.now().isoformat()
-                # Clear any previous return date
-                cylinder['date_returned'] = ''
-                cylinder['updated_at'] = datetime.now().isoformat()
-                self.db.save_data(cylinders)
-                return True
-        return False
+        # Get customer information
+        customer_model = Customer()
+        customer = customer_model.get_by_id(customer_id)
+        if not customer:
+            return False
+        
+        return self.db.update(cylinder_id, self._rental(customer_id, customer, rental_date)) is not None
+    
+    def bulk_rent(self, cylinder_ids: List[str], customer_id: str, rental_date: str = None) -> List[str]:
+        """Rent every available cylinder of the list to one customer with one journal write"""
+        customer = Customer().get_by_id(customer_id)
+        if not customer:
+            return []
+        
+        cylinders = self.db.update_many(cylinder_ids, self._rental(customer_id, customer, rental_date))
+        return [cylinder['id'] for cylinder in cylinders]
+    
+    def _rental(self, customer_id: str, customer: Dict, rental_date: str = None):
+        """JSONDatabase.update() change renting an available cylinder (checked under the lock)"""
+        def rent(cylinder: Dict) -> Optional[Dict]:
+            if cylinder.get('status', '').lower() != 'available':
+                return None
+            self._apply_rental(cylinder, customer_id, customer, rental_date)
+            return cylinder
+        return rent
+    
+    def _apply_rental(self, cylinder: Dict, customer_id: str, customer: Dict, rental_date: str = None):
+        """Mark a cylinder rented to a customer"""
+        cylinder['status'] = 'rented'
+        cylinder['rented_to'] = customer_id
+        # Handle both old and new customer field structures
+        cylinder['customer_name'] = customer.get('customer_name') or customer.get('name', '')
+        cylinder['customer_email'] = customer.get('customer_email') or customer.get('email', '')
+        cylinder['rental_date'] = rental_date or datetime.now().isoformat()
+        cylinder['date_borrowed'] = rental_date or datetime.now().isoformat()
+        # Clear any previous return date
+        cylinder['date_returned'] = ''
+        cylinder['updated_at'] = datetime.now().isoformat()
     
     def rent_cylinder_with_location(self, cylinder_id: str, customer_id: str, rental_date: str = None, customer_data: Dict = None) -> bool:
         """
@@ -447,106 +834,129 @@ class Cylinder:
         from datetime import datetime
         from models import Customer
         
-        cylinders = self.db.load_data()
-        for cylinder in cylinders:
-            if cylinder['id'] == cylinder_id:
-                if cylinder.get('status', '').lower() not in ['available', '']:
-                    return False
-                
-                # Get customer information if not provided
-                if not customer_data:
-                    customer_model = Customer()
-                    customer_data = customer_model.get_by_id(customer_id)
-                    if not customer_data:
-                        return False
-                
-                # Update cylinder status and rental information
-                cylinder['status'] = 'rented'
-                cylinder['rented_to'] = customer_id
-                
-                # Handle both old and new customer field structures for name and contact
-                cylinder['customer_name'] = customer_data.get('customer_name') or customer_data.get('name', '')
-                cylinder['customer_email'] = customer_data.get('customer_email') or customer_data.get('email', '')
-                cylinder['customer_phone'] = customer_data.get('customer_phone') or customer_data.get('phone', '')
-                
-                # Update cylinder location to customer's address (comprehensive address)
-                customer_address = customer_data.get('customer_address') or customer_data.get('address', '')
-                customer_city = customer_data.get('customer_city', '')
-                customer_state = customer_data.get('customer_state', '')
-                
-                # Build full address for cylinder location
-                address_parts = []
-                if customer_address:
-                    address_parts.append(customer_address)
-                if customer_city:
-                    address_parts.append(customer_city)
-                if customer_state:
-                    address_parts.append(customer_state)
-                
-                cylinder['location'] = ', '.join(address_parts) if address_parts else 'Customer Location'
-                
-                # Set rental dates
-                cylinder['rental_date'] = rental_date or datetime.now().isoformat()
-                cylinder['date_borrowed'] = rental_date or datetime.now().isoformat()
-                
-                # Clear any previous return date
-                cylinder['date_returned'] = ''
-                cylinder['updated_at'] = datetime.now().isoformat()
-                
-                # Store additional customer reference data for tracking
-                cylinder['customer_no'] = customer_data.get('customer_no', '')
-                cylinder['customer_city'] = customer_city
-                cylinder['customer_state'] = customer_state
-                
-                self.db.save_data(cylinders)
-                return True
-        return False
+        # Get customer information if not provided
+        if not customer_data:
+            customer_model = Customer()
+            customer_data = customer_model.get_by_id(customer_id)
+            if not customer_data:
+                return False
+        
+        def rent(cylinder: Dict) -> Optional[Dict]:
+            # Checked under the journal lock so two workers can't both rent it
+            if cylinder.get('status', '').lower() not in ['available', '']:
+                return None
+            
+            # Update cylinder status and rental information
+            cylinder['status'] = 'rented'
+            cylinder['rented_to'] = customer_id
+            
+            # Handle both old and new customer field structures for name and contact
+            cylinder['customer_name'] = customer_data.get('customer_name') or customer_data.get('name', '')
+            cylinder['customer_email'] = customer_data.get('customer_email') or customer_data.get('email', '')
+            cylinder['customer_phone'] = customer_data.get('customer_phone') or customer_data.get('phone', '')
+            
+            # Update cylinder location to customer's address (comprehensive address)
+            customer_address = customer_data.get('customer_address') or customer_data.get('address', '')
+            customer_city = customer_data.get('customer_city', '')
+            customer_state = customer_data.get('customer_state', '')
+            
+            # Build full address for cylinder location
+            address_parts = []
+            if customer_address:
+                address_parts.append(customer_address)
+            if customer_city:
+                address_parts.append(customer_city)
+            if customer_state:
+                address_parts.append(customer_state)
+            
+            cylinder['location'] = ', '.join(address_parts) if address_parts else 'Customer Location'
+            
+            # Set rental dates
+            cylinder['rental_date'] = rental_date or datetime.now().isoformat()
+            cylinder['date_borrowed'] = rental_date or datetime.now().isoformat()
+            
+            # Clear any previous return date
+            cylinder['date_returned'] = ''
+            cylinder['updated_at'] = datetime.now().isoformat()
+            
+            # Store additional customer reference data for tracking
+            cylinder['customer_no'] = customer_data.get('customer_no', '')
+            cylinder['customer_city'] = customer_city
+            cylinder['customer_state'] = customer_state
+            return cylinder
+        
+        return self.db.update(cylinder_id, rent) is not None
     
     def return_cylinder(self, cylinder_id: str, return_date: str = None) -> bool:
         """Return a cylinder from rental with return date and save to history"""
-        from datetime import datetime
         from models_rental_history import RentalHistory
         from models import Customer
         
-        cylinders = self.db.load_data()
-        for cylinder in cylinders:
-            if cylinder['id'] == cylinder_id:
-                # Get customer data before clearing it
-                customer_id = cylinder.get('rented_to', '')
-                if customer_id:
-                    customer_model = Customer()
-                    customer_data = customer_model.get_by_id(customer_id)
-                    
-                    # Save return record to history BEFORE clearing cylinder data
-                    if customer_data:
-                        history = RentalHistory()
-                        try:
-                            history.add_return_record(cylinder, customer_data, return_date)
-                            print(f"DEBUG: Successfully added return record for cylinder {cylinder_id}")
-                        except Exception as e:
-                            print(f"DEBUG: Error adding return record: {e}")
-                
-                # Update cylinder status and return date
-                cylinder['status'] = 'available'
-                cylinder['date_returned'] = return_date or datetime.now().isoformat()
-                cylinder['updated_at'] = datetime.now().isoformat()
-                
-                # Reset location to warehouse when returned
-                cylinder['location'] = 'Warehouse'
-                
-                # Clear customer assignment but keep rental history for tracking
-                cylinder['rented_to'] = ''
-                cylinder['customer_name'] = ''
-                cylinder['customer_email'] = ''
-                cylinder['customer_phone'] = ''
-                cylinder['customer_no'] = ''
-                cylinder['customer_city'] = ''
-                cylinder['customer_state'] = ''
-                # Don't clear rental_date immediately - keep it for reference
-                # cylinder['rental_date'] = ''
-                self.db.save_data(cylinders)
-                return True
-        return False
+        # Clear the cylinder under the journal lock, keeping the state it had;
+        # a concurrent second return then finds no customer and records no history
+        before = []
+        def mark_returned(cylinder: Dict) -> Dict:
+            before.append(dict(cylinder))
+            self._apply_return(cylinder, return_date)
+            return cylinder
+        
+        if self.db.update(cylinder_id, mark_returned) is None:
+            return False
+        cylinder = before[0]
+        
+        customer_id = cylinder.get('rented_to', '')
+        if customer_id:
+            customer_model = Customer()
+            customer_data = customer_model.get_by_id(customer_id)
+            
+            # Save return record to history from the data before it was cleared
+            if customer_data:
+                history = RentalHistory()
+                try:
+                    history.add_return_record(cylinder, customer_data, return_date)
+                    print(f"DEBUG: Successfully added return record for cylinder {cylinder_id}")
+                except Exception as e:
+                    print(f"DEBUG: Error adding return record: {e}")
+        return True
+    
+    def bulk_return(self, cylinder_ids: List[str], return_date: str = None) -> List[str]:
+        """Return every rented cylinder of the list; one journal write for history, one for cylinders"""
+        from models_rental_history import RentalHistory
+        
+        cylinders = []  # as they were before the return
+        def mark_returned(cylinder: Dict) -> Optional[Dict]:
+            if cylinder.get('status', '').lower() != 'rented':
+                return None
+            cylinders.append(dict(cylinder))
+            self._apply_return(cylinder, return_date)
+            return cylinder
+        
+        self.db.update_many(cylinder_ids, mark_returned)
+        customers = {c['id']: c for c in Customer().get_many(c.get('rented_to') for c in cylinders if c.get('rented_to'))}
+        returns = [(c, customers[c['rented_to']]) for c in cylinders if c.get('rented_to') in customers]
+        RentalHistory().add_return_records(returns, return_date)
+        return [cylinder['id'] for cylinder in cylinders]
+    
+    def _apply_return(self, cylinder: Dict, return_date: str = None):
+        """Mark a cylinder back in the warehouse and clear its customer assignment"""
+        # Update cylinder status and return date
+        cylinder['status'] = 'available'
+        cylinder['date_returned'] = return_date or datetime.now().isoformat()
+        cylinder['updated_at'] = datetime.now().isoformat()
+        
+        # Reset location to warehouse when returned
+        cylinder['location'] = 'Warehouse'
+        
+        # Clear customer assignment but keep rental history for tracking
+        cylinder['rented_to'] = ''
+        cylinder['customer_name'] = ''
+        cylinder['customer_email'] = ''
+        cylinder['customer_phone'] = ''
+        cylinder['customer_no'] = ''
+        cylinder['customer_city'] = ''
+        cylinder['customer_state'] = ''
+        # Don't clear rental_date immediately - keep it for reference
+        # cylinder['rental_date'] = ''
     
     def get_rental_days(self, cylinder: Dict) -> int:
         """Calculate how many days a cylinder has been rented"""
@@ -0,0 +1,276 @@
+# models_mysql.py - MySQL-backed models for the PythonAnywhere deployment
+"""
+Customer and cylinder repositories (see repository.py) on the
+Flask-SQLAlchemy models of app_mysql_fixed.py. Methods use db.session,
+so they must run inside an app context (any request does).
+"""
+
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import DateTime, func, or_
+
+from app_mysql_fixed import db, Customer as CustomerRecord, Cylinder as CylinderRecord, \
+    RentalHistory as RentalHistoryRecord
+
+# Ids per IN (...) list for batch gets and bulk writes
+BATCH_GET_SIZE = 500
+
+# Customer columns copied onto a cylinder when it is rented
+CYLINDER_CUSTOMER_FIELDS = ('customer_name', 'customer_email', 'customer_phone', 'customer_no')
+
+
+def _chunks(ids, size: int = BATCH_GET_SIZE):
+    """Unique ids in order, split into IN-list sized chunks"""
+    ids = list(dict.fromkeys(ids))
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _parse_date(value=None) -> datetime:
+    """Parse an ISO date from a form or API call; now if missing or invalid"""
+    if isinstance(value, datetime):
+        return value
+    if value:
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            pass
+    return datetime.now(timezone.utc)
+
+
+def _assign(record, data: Dict):
+    """Copy known column values from form/API data onto a record (date strings parsed, primary key kept)"""
+    columns = record.__table__.columns
+    for key, value in data.items():
+        column = columns.get(key)
+        if column is None or column.primary_key:
+            continue
+        if isinstance(value, str) and isinstance(column.type, DateTime):
+            value = _parse_date(value) if value.strip() else None
+        setattr(record, key, value)
+
+
+class Customer:
+    """Customer repository on MySQL"""
+
+    def get_by_id(self, customer_id: str) -> Optional[Dict]:
+        """Get customer by ID"""
+        customer = db.session.get(CustomerRecord, customer_id)
+        return customer.to_dict() if customer else None
+
+    def get_many(self, customer_ids) -> List[Dict]:
+        """Get customers by ID, one IN query per batch"""
+        customers = []
+        for chunk in _chunks(customer_ids):
+            customers.extend(CustomerRecord.query.filter(CustomerRecord.id.in_(chunk)).all())
+        return [c.to_dict() for c in customers]
+
+    def search(self, query: str) -> List[Dict]:
+        """Search customers by name, number, phone, email or city"""
+        pattern = f'%{query}%'
+        customers = CustomerRecord.query.filter(or_(
+            CustomerRecord.customer_name.ilike(pattern),
+            CustomerRecord.customer_no.ilike(pattern),
+            CustomerRecord.customer_phone.ilike(pattern),
+            CustomerRecord.customer_email.ilike(pattern),
+            CustomerRecord.customer_city.ilike(pattern)
+        )).order_by(CustomerRecord.customer_name).all()
+        return [c.to_dict() for c in customers]
+
+    def count(self) -> int:
+        """Get total number of customers"""
+        return db.session.query(func.count(CustomerRecord.id)).scalar() or 0
+
+    def iter_all(self, batch_size: int = 1000) -> Iterator[Dict]:
+        """Stream all customers ordered by name"""
+        for customer in CustomerRecord.query.order_by(CustomerRecord.customer_name).yield_per(batch_size):
+            yield customer.to_dict()
+
+    def add(self, customer_data: Dict) -> Dict:
+        """Add new customer and return it"""
+        customer = CustomerRecord(id=f"CUST-{str(uuid.uuid4())[:8].upper()}")
+        _assign(customer, customer_data)
+        db.session.add(customer)
+        db.session.commit()
+        return customer.to_dict()
+
+    def update(self, customer_id: str, customer_data: Dict) -> Optional[Dict]:
+        """Update customer and return it (None if not found)"""
+        customer = db.session.get(CustomerRecord, customer_id)
+        if not customer:
+            return None
+        _assign(customer, customer_data)
+        # Refresh the copies on rented cylinders in the same transaction
+        CylinderRecord.query.filter(CylinderRecord.rented_to == customer_id).update(
+            {field: getattr(customer, field) for field in CYLINDER_CUSTOMER_FIELDS}, synchronize_session=False
+        )
+        db.session.commit()
+        return customer.to_dict()
+
+    def delete(self, customer_id: str) -> bool:
+        """Delete customer"""
+        customer = db.session.get(CustomerRecord, customer_id)
+        if not customer:
+            return False
+        db.session.delete(customer)
+        db.session.commit()
+        return True
+
+
+class Cylinder:
+    """Cylinder repository on MySQL"""
+
+    def get_by_id(self, cylinder_id: str) -> Optional[Dict]:
+        """Get cylinder by ID"""
+        cylinder = db.session.get(CylinderRecord, cylinder_id)
+        return cylinder.to_dict() if cylinder else None
+
+    def get_many(self, cylinder_ids) -> List[Dict]:
+        """Get cylinders by ID, one IN query per batch"""
+        return [c.to_dict() for c in self._load_many(cylinder_ids)]
+
+    def _load_many(self, cylinder_ids, *conditions, for_update: bool = False) -> List[CylinderRecord]:
+        cylinders = []
+        for chunk in _chunks(cylinder_ids):
+            query = CylinderRecord.query.filter(CylinderRecord.id.in_(chunk), *conditions)
+            if for_update:
+                query = query.with_for_update()
+            cylinders.extend(query.all())
+        return cylinders
+
+    def find_by_any_identifier(self, identifier: str) -> Optional[Dict]:
+        """Find cylinder by system ID, custom ID or serial number (case-insensitive)"""
+        identifier = identifier.strip()
+        cylinder = db.session.get(CylinderRecord, identifier)
+        if not cylinder:
+            key = identifier.lower()
+            cylinder = CylinderRecord.query.filter(or_(
+                func.lower(CylinderRecord.custom_id) == key,
+                func.lower(CylinderRecord.serial_number) == key
+            )).order_by(func.lower(CylinderRecord.custom_id) != key).first()
+        return cylinder.to_dict() if cylinder else None
+
+    def search(self, query: str) -> List[Dict]:
+        """Search cylinders by custom ID, serial number or customer"""
+        pattern = f'%{query}%'
+        cylinders = CylinderRecord.query.filter(or_(
+            CylinderRecord.custom_id.ilike(pattern),
+            CylinderRecord.serial_number.ilike(pattern),
+            CylinderRecord.customer_name.ilike(pattern),
+            CylinderRecord.customer_no.ilike(pattern)
+        )).order_by(CylinderRecord.custom_id).all()
+        return [c.to_dict() for c in cylinders]
+
+    def get_by_customer(self, customer_id: str) -> List[Dict]:
+        """Get cylinders rented by customer"""
+        cylinders = CylinderRecord.query.filter(
+            CylinderRecord.rented_to == customer_id, CylinderRecord.status == 'rented'
+        ).all()
+        return [c.to_dict() for c in cylinders]
+
+    def count(self) -> int:
+        """Get total number of cylinders"""
+        return db.session.query(func.count(CylinderRecord.id)).scalar() or 0
+
+    def iter_all(self, batch_size: int = 1000) -> Iterator[Dict]:
+        """Stream all cylinders ordered by custom ID"""
+        for cylinder in CylinderRecord.query.order_by(CylinderRecord.custom_id).yield_per(batch_size):
+            yield cylinder.to_dict()
+
+    def add(self, cylinder_data: Dict) -> Dict:
+        """Add new cylinder and return it"""
+        cylinder = CylinderRecord(id=f"CYL-{str(uuid.uuid4())[:8].upper()}")
+        _assign(cylinder, cylinder_data)
+        db.session.add(cylinder)
+        db.session.commit()
+        return cylinder.to_dict()
+
+    def update(self, cylinder_id: str, cylinder_data: Dict) -> Optional[Dict]:
+        """Update cylinder and return it (None if not found)"""
+        cylinder = db.session.get(CylinderRecord, cylinder_id)
+        if not cylinder:
+            return None
+        _assign(cylinder, cylinder_data)
+        db.session.commit()
+        return cylinder.to_dict()
+
+    def bulk_update(self, updates_dict: Dict[str, Dict]) -> int:
+        """Apply per-cylinder field changes in one transaction"""
+        cylinders = self._load_many(updates_dict.keys(), for_update=True)
+        for cylinder in cylinders:
+            _assign(cylinder, updates_dict[cylinder.id])
+        db.session.commit()
+        return len(cylinders)
+
+    def delete(self, cylinder_id: str) -> bool:
+        """Delete cylinder"""
+        cylinder = db.session.get(CylinderRecord, cylinder_id)
+        if not cylinder:
+            return False
+        db.session.delete(cylinder)
+        db.session.commit()
+        return True
+
+    def rent_cylinder(self, cylinder_id: str, customer_id: str, rental_date: str = None) -> bool:
+        """Rent cylinder to customer"""
+        return bool(self.bulk_rent([cylinder_id], customer_id, rental_date))
+
+    def return_cylinder(self, cylinder_id: str, return_date: str = None) -> bool:
+        """Return cylinder from rental"""
+        return bool(self.bulk_return([cylinder_id], return_date))
+
+    def bulk_rent(self, cylinder_ids: List[str], customer_id: str, rental_date: str = None) -> List[str]:
+        """Rent the available cylinders of the list to a customer in one transaction"""
+        customer = db.session.get(CustomerRecord, customer_id)
+        if not customer:
+            return []
+        borrowed_at = _parse_date(rental_date)
+        cylinders = self._load_many(cylinder_ids, CylinderRecord.status == 'available', for_update=True)
+        for cylinder in cylinders:
+            cylinder.status = 'rented'
+            cylinder.rented_to = customer.id
+            cylinder.customer_name = customer.customer_name
+            cylinder.customer_email = customer.customer_email
+            cylinder.customer_phone = customer.customer_phone
+            cylinder.customer_no = customer.customer_no
+            cylinder.location = customer.customer_address or customer.customer_city
+            cylinder.date_borrowed = borrowed_at
+            cylinder.date_returned = None
+        db.session.commit()
+        return [cylinder.id for cylinder in cylinders]
+
+    def bulk_return(self, cylinder_ids: List[str], return_date: str = None) -> List[str]:
+        """Return the rented cylinders of the list, history rows included, in one transaction"""
+        returned_at = _parse_date(return_date)
+        cylinders = self._load_many(cylinder_ids, CylinderRecord.status == 'rented', for_update=True)
+        for cylinder in cylinders:
+            borrowed_at = cylinder.date_borrowed
+            rental_days = 0
+            if borrowed_at:
+                if borrowed_at.tzinfo is None:
+                    borrowed_at = borrowed_at.replace(tzinfo=returned_at.tzinfo)
+                rental_days = max(0, (returned_at - borrowed_at).days)
+            db.session.add(RentalHistoryRecord(
+                id=str(uuid.uuid4()),
+                customer_no=cylinder.customer_no,
+                customer_name=cylinder.customer_name,
+                cylinder_custom_id=cylinder.custom_id,
+                cylinder_type=cylinder.type,
+                cylinder_size=cylinder.size,
+                dispatch_date=cylinder.date_borrowed,
+                return_date=returned_at,
+                rental_days=rental_days,
+            ))
+            cylinder.status = 'available'
+            cylinder.location = 'Warehouse'
+            cylinder.rented_to = None
+            cylinder.customer_name = ''
+            cylinder.customer_email = ''
+            cylinder.customer_phone = ''
+            cylinder.customer_no = ''
+            cylinder.date_borrowed = None
+            cylinder.date_returned = returned_at
+        db.session.commit()
+        return [cylinder.id for cylinder in cylinders]
@@ -1,5 +1,5 @@
 # models_postgres.py - PostgreSQL-backed models replacing JSON storage
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Tuple, Iterator
 from datetime import datetime, timedelta
 from db_service import CustomerService, CylinderService, RentalHistoryService
 from db_models import get_db_session
@@ -22,6 +22,27 @@ class Customer:
             customer = service.get_by_id(customer_id)
             return self._to_dict(customer) if customer else None
     
+    def get_many(self, customer_ids) -> List[Dict]:
+        """Get customers by ID (missing IDs are skipped)"""
+        with CustomerService() as service:
+            return [self._to_dict(c) for c in service.get_many(customer_ids)]
+    
+    def search(self, query: str) -> List[Dict]:
+        """Search customers by name, number, phone, email or city"""
+        with CustomerService() as service:
+            return [self._to_dict(c) for c in service.search(query)]
+    
+    def count(self) -> int:
+        """Get total number of customers"""
+        with CustomerService() as service:
+            return service.count()
+    
+    def iter_all(self, batch_size: int = 1000) -> Iterator[Dict]:
+        """Iterate over all customers as dictionaries without loading them all at once"""
+        with CustomerService() as service:
+            for customer in service.stream_all(batch_size):
+                yield self._to_dict(customer)
+    
     def add_customer(self, customer_data: Dict) -> str:
         """Add new customer and return ID"""
         with CustomerService() as service:
@@ -38,6 +59,22 @@ class Customer:
         with CustomerService() as service:
             return service.delete(customer_id)
     
+    def add(self, customer_data: Dict) -> Dict:
+        """Add new customer and return it"""
+        with CustomerService() as service:
+            return self._to_dict(service.create(customer_data))
+    
+    def update(self, customer_id: str, customer_data: Dict) -> Optional[Dict]:
+        """Update customer and return it (None if not found)"""
+        with CustomerService() as service:
+            if not service.update(customer_id, customer_data):
+                return None
+            return self._to_dict(service.get_by_id(customer_id))
+    
+    def delete(self, customer_id: str) -> bool:
+        """Delete customer"""
+        return self.delete_customer(customer_id)
+    
     def _to_dict(self, customer) -> Dict:
         """Convert SQLAlchemy object to dictionary"""
         if not customer:
@@ -88,12 +125,46 @@ class Cylinder:
             cylinder = service.get_by_id(cylinder_id)
             return self._to_dict(cylinder) if cylinder else None
     
+    def get_many(self, cylinder_ids) -> List[Dict]:
+        """Get cylinders by ID (missing IDs are skipped)"""
+        with CylinderService() as service:
+            return [self._to_dict(c) for c in service.get_many(cylinder_ids)]
+    
+    def search(self, query: str) -> List[Dict]:
+        """Search cylinders by custom ID, serial number or customer"""
+        with CylinderService() as service:
+            return [self._to_dict(c) for c in service.search(query)]
+    
+    def find_by_any_identifier(self, identifier: str) -> Optional[Dict]:
+        """Find cylinder by any identifier: ID, custom_id, or serial_number"""
+        with CylinderService() as service:
+            cylinder = service.find_by_identifier(identifier)
+            return self._to_dict(cylinder) if cylinder else None
+    
     def get_by_customer(self, customer_id: str) -> List[Dict]:
         """Get cylinders rented by customer"""
         with CylinderService() as service:
             cylinders = service.get_by_customer(customer_id)
             return [self._to_dict(c) for c in cylinders]
     
+    def count(self) -> int:
+        """Get total number of cylinders"""
+        with CylinderService() as service:
+            return service.count()
+    
+    def iter_all(self, batch_size: int = 1000) -> Iterator[Dict]:
+        """Iterate over all cylinders as dictionaries without loading them all at once"""
+        with CylinderService() as service:
+            for cylinder in service.stream_all(batch_size):
+                yield self._to_dict(cylinder)
+    
+    def iter_rental_activities(self, batch_size: int = 1000) -> Iterator[Tuple[Dict, Dict]]:
+        """Iterate over (cylinder, customer) dictionaries for cylinders with rental activity"""
+        customer_model = Customer()
+        with CylinderService() as service:
+            for cylinder, customer in service.stream_rental_activities(batch_size):
+                yield self._to_dict(cylinder), customer_model._to_dict(customer)
+    
     def add_cylinder(self, cylinder_data: Dict) -> str:
         """Add new cylinder and return ID"""
         with CylinderService() as service:
@@ -120,6 +191,37 @@ class Cylinder:
         with CylinderService() as service:
             return service.delete(cylinder_id)
     
+    def add(self, cylinder_data: Dict) -> Dict:
+        """Add new cylinder and return it"""
+        with CylinderService() as service:
+            return self._to_dict(service.create(cylinder_data))
+    
+    def update(self, cylinder_id: str, cylinder_data: Dict) -> Optional[Dict]:
+        """Update cylinder and return it (None if not found or the update failed)"""
+        with CylinderService() as service:
+            if not service.update(cylinder_id, cylinder_data):
+                return None
+            return self._to_dict(service.get_by_id(cylinder_id))
+    
+    def delete(self, cylinder_id: str) -> bool:
+        """Delete cylinder"""
+        return self.delete_cylinder(cylinder_id)
+    
+    def bulk_update(self, updates_dict: Dict[str, Dict]) -> int:
+        """Apply per-cylinder field changes in one transaction"""
+        with CylinderService() as service:
+            return service.bulk_update(updates_dict)
+    
+    def bulk_rent(self, cylinder_ids: List[str], customer_id: str, rental_date: str = None) -> List[str]:
+        """Rent the available cylinders of the list to a customer; returns the IDs rented"""
+        with CylinderService() as service:
+            return service.bulk_rent(cylinder_ids, customer_id, rental_date)
+    
+    def bulk_return(self, cylinder_ids: List[str], return_date: str = None) -> List[str]:
+        """Return the rented cylinders of the list; returns the IDs returned"""
+        with CylinderService() as service:
+            return service.bulk_return(cylinder_ids, return_date)
+    
     def get_display_id(self, cylinder) -> str:
         """Get display ID for cylinder (custom_id or serial_number)"""
         if isinstance(cylinder, dict):
@@ -1,47 +1,48 @@
 # Rental History Model for Customer History Tracking
 # This module handles customer rental history with active and past dispatch tracking
 
+import uuid
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
-import json
-import os
+from models import JSONDatabase
 
 class RentalHistory:
     """Model for tracking customer rental history including past returns"""
     
     def __init__(self):
-        self.db_file = os.path.join('data', 'rental_history.json')
-        self._ensure_db_exists()
-    
-    def _ensure_db_exists(self):
-        """Ensure rental history database file exists"""
-        os.makedirs('data', exist_ok=True)
-        if not os.path.exists(self.db_file):
-            self._save_data([])
+        self.db = JSONDatabase('rental_history.json',
+                                indexes=('customer_id', 'customer_no', 'customer_name', 'cylinder_id'))
+        self.db_file = self.db.filepath
     
     def _load_data(self) -> List[Dict]:
         """Load rental history data from JSON file"""
-        try:
-            with open(self.db_file, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return []
+        return self.db.load_data()
     
     def _save_data(self, data: List[Dict]):
         """Save rental history data to JSON file"""
-        with open(self.db_file, 'w') as f:
-            json.dump(data, f, indent=2)
+        self.db.save_data(data)
     
     def add_return_record(self, cylinder_data: Dict, customer_data: Dict, return_date: str = None):
         """Add a return record to history when a cylinder is returned"""
+        return_record = self._build_return_record(cylinder_data, customer_data, return_date)
+        self.db.insert_many([return_record])
+        return return_record
+    
+    def add_return_records(self, returns: List[tuple], return_date: str = None) -> List[Dict]:
+        """Add return records for many (cylinder, customer) pairs with one journal write"""
+        records = [self._build_return_record(cylinder_data, customer_data, return_date)
+                   for cylinder_data, customer_data in returns]
+        self.db.insert_many(records)
+        return records
+    
+    def _build_return_record(self, cylinder_data: Dict, customer_data: Dict, return_date: str) -> Dict:
+        """History record for a returned cylinder"""
         if not return_date:
             return_date = datetime.now().isoformat()
         
-        history_records = self._load_data()
-        
-        # Create return record
-        return_record = {
-            'id': f"return_{len(history_records) + 1}_{int(datetime.now().timestamp())}",
+        # Create return record (random id: workers writing at the same moment must not collide)
+        return {
+            'id': f"return_{uuid.uuid4().hex}",
             'customer_id': customer_data.get('id', ''),
             'customer_no': customer_data.get('customer_no', ''),
             'customer_name': customer_data.get('customer_name', '') or customer_data.get('name', ''),
@@ -61,10 +62,6 @@ class RentalHistory:
             'location': cylinder_data.get('location', ''),
             'created_at': datetime.now().isoformat()
         }
-        
-        history_records.append(return_record)
-        self._save_data(history_records)
-        return return_record
     
     def cleanup_old_records(self):
         """Remove rental history records older than 6 months automatically"""
@@ -120,9 +117,6 @@ class RentalHistory:
             cylinder['rental_months'] = cylinder_model.get_rental_months(cylinder)
             cylinder['display_id'] = cylinder_model.get_display_id(cylinder)
         
-        # Get past rentals from history
-        history_records = self._load_data()
-        
         # Get the customer by ID to get their customer number
         from models import Customer
         customer_model = Customer()
@@ -134,26 +128,18 @@ class RentalHistory:
         customer_no = customer.get('customer_no', '')
         customer_name = customer.get('customer_name', '') or customer.get('name', '')
         
-        # Look for past rentals by customer_no (for imported data) and customer_id (for manual data)
+        # Look for past rentals by customer_no (for imported data), customer_id (for manual data)
+        # or customer_name
         past_rentals = []
-        for record in history_records:
-            # Check if this record belongs to the customer
-            record_customer_id = record.get('customer_id', '')
-            record_customer_no = record.get('customer_no', '')
-            record_customer_name = record.get('customer_name', '')
-            
-            # Match by customer_id, customer_no, or customer_name
-            if (record_customer_id == customer_id or 
-                (customer_no and record_customer_no == customer_no) or
-                (customer_name and record_customer_name == customer_name)):
+        for record in self.db.find_any({'customer_id': customer_id, 'customer_no': customer_no,
+                                        'customer_name': customer_name}):
+            # Ensure we have proper date fields for template compatibility
+            if not record.get('date_borrowed') and record.get('dispatch_date'):
+                record['date_borrowed'] = record['dispatch_date']
+            if not record.get('date_returned') and record.get('return_date'):
+                record['date_returned'] = record['return_date']
                 
-                # Ensure we have proper date fields for template compatibility
-                if not record.get('date_borrowed') and record.get('dispatch_date'):
-                    record['date_borrowed'] = record['dispatch_date']
-                if not record.get('date_returned') and record.get('return_date'):
-                    record['date_returned'] = record['return_date']
-                    
-                past_rentals.append(record)
+            past_rentals.append(record)
         
         # Sort both lists by date (most recent first)
         active_cylinders.sort(key=lambda x: x.get('date_borrowed', ''), reverse=True)
@@ -167,7 +153,6 @@ class RentalHistory:
     def import_historical_data(self, historical_records: List[Dict], cutoff_months: int = 6):
         """Import historical rental data, excluding records older than cutoff"""
         cutoff_date = datetime.now() - timedelta(days=cutoff_months * 30)
-        current_records = self._load_data()
         
         # Filter out old records during import
         valid_records = []
@@ -190,11 +175,8 @@ class RentalHistory:
                 valid_records.append(record)
         
         # Merge with existing records (avoid duplicates)
-        existing_ids = {r.get('id', '') for r in current_records}
-        new_records = [r for r in valid_records if r.get('id', '') not in existing_ids]
-        
-        all_records = current_records + new_records
-        self._save_data(all_records)
+        new_records = [r for r in valid_records if r.get('id') and self.db.get(r['id']) is None]
+        self.db.put_many(new_records)
         
         return len(new_records), skipped_count
     
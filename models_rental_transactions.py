@@ -4,35 +4,27 @@ Rental Transactions Model
 Handles completed rental transactions for the past 6 months
 """
 
-import json
-import os
+import uuid
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
+from models import JSONDatabase
 
 class RentalTransactions:
     def __init__(self):
-        self.data_file = 'data/rental_transactions.json'
-        self.ensure_data_directory()
+        self.db = JSONDatabase('rental_transactions.json', indexes=('customer_no', 'status'))
+        self.data_file = self.db.filepath
     
-    def ensure_data_directory(self):
-        """Ensure data directory exists"""
-        os.makedirs('data', exist_ok=True)
-        if not os.path.exists(self.data_file):
-            with open(self.data_file, 'w') as f:
-                json.dump([], f)
+    def generate_id(self) -> str:
+        """Generate unique transaction ID (timestamp prefix keeps them in creation order)"""
+        return f"RT-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8].upper()}"
     
     def get_all(self) -> List[Dict]:
         """Get all rental transactions"""
-        try:
-            with open(self.data_file, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return []
+        return self.db.load_data()
     
     def get_by_customer(self, customer_no: str) -> List[Dict]:
         """Get rental transactions for a specific customer"""
-        all_transactions = self.get_all()
-        return [t for t in all_transactions if t.get('customer_no', '').upper() == customer_no.upper()]
+        return self.db.find('customer_no', customer_no)
     
     def get_recent_transactions(self, months: int = 6) -> List[Dict]:
         """Get transactions from the past X months"""
@@ -55,19 +47,14 @@ class RentalTransactions:
     def add_transaction(self, transaction: Dict) -> bool:
         """Add a single rental transaction"""
         try:
-            transactions = self.get_all()
-            
             # Generate ID if not provided
             if 'id' not in transaction:
-                transaction['id'] = f"RT-{datetime.now().strftime('%Y%m%d%H%M%S')}-{len(transactions):04d}"
+                transaction['id'] = self.generate_id()
             
             # Set created timestamp
             transaction['created_at'] = datetime.now().isoformat()
             
-            transactions.append(transaction)
-            
-            with open(self.data_file, 'w') as f:
-                json.dump(transactions, f, indent=2)
+            self.db.insert_many([transaction])
             
             return True
         except Exception as e:
@@ -77,18 +64,13 @@ class RentalTransactions:
     def bulk_add_transactions(self, transactions: List[Dict]) -> int:
         """Add multiple rental transactions"""
         try:
-            existing_transactions = self.get_all()
-            
             # Add IDs and timestamps
-            for i, transaction in enumerate(transactions):
+            for transaction in transactions:
                 if 'id' not in transaction:
-                    transaction['id'] = f"RT-{datetime.now().strftime('%Y%m%d%H%M%S')}-{len(existing_transactions) + i:04d}"
+                    transaction['id'] = self.generate_id()
                 transaction['created_at'] = datetime.now().isoformat()
             
-            all_transactions = existing_transactions + transactions
-            
-            with open(self.data_file, 'w') as f:
-                json.dump(all_transactions, f, indent=2)
+            self.db.insert_many(transactions)
             
             return len(transactions)
         except Exception as e:
@@ -97,8 +79,7 @@ class RentalTransactions:
     
     def clear_all(self):
         """Clear all rental transactions"""
-        with open(self.data_file, 'w') as f:
-            json.dump([], f)
+        self.db.save_data([])
     
     def get_customer_summary(self, customer_no: str) -> Dict:
         """Get rental summary for a customer"""
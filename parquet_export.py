@@ -0,0 +1,93 @@
+# parquet_export.py - Columnar analytics export
+"""
+Parquet export of customers, cylinders and rental history for analysts
+
+Each table is read with a server-side cursor and written one row group per
+batch, so memory stays bounded by the batch size. Datetime columns are
+stored as real timestamps and low-cardinality text columns (status, type,
+size, location) are dictionary encoded, which keeps files small and lets
+pandas/pyarrow load them as categoricals without parsing.
+
+pyarrow is optional; the routes check PARQUET_AVAILABLE first.
+"""
+
+import os
+import shutil
+import time
+import zipfile
+
+from sqlalchemy import Boolean, DateTime, Integer
+
+from db_models import Customer, Cylinder, RentalHistory
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# Exported table name -> model
+PARQUET_TABLES = {
+    'customers': Customer,
+    'cylinders': Cylinder,
+    'rental_history': RentalHistory,
+}
+
+# Columns with few distinct values, stored as dictionary (categorical) columns
+DICTIONARY_COLUMNS = {'status', 'type', 'size', 'location', 'cylinder_type', 'cylinder_size',
+                      'customer_city', 'customer_state'}
+
+
+def _arrow_type(column):
+    """Arrow type for a SQLAlchemy column"""
+    if isinstance(column.type, DateTime):
+        return pa.timestamp('us')
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if column.name in DICTIONARY_COLUMNS:
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.string()
+
+
+def table_schema(model):
+    """Arrow schema matching a model's table"""
+    return pa.schema([pa.field(column.name, _arrow_type(column)) for column in model.__table__.columns])
+
+
+def _record_batch(schema, rows):
+    """Convert a batch of row tuples into an Arrow record batch"""
+    arrays = []
+    for index, field in enumerate(schema):
+        values = [row[index] for row in rows]
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_table(table_name: str, output_path: str, batch_size: int = 50000) -> int:
+    """Write one table to a Parquet file, one row group per batch; returns the row count"""
+    from db_service import DatabaseService
+
+    model = PARQUET_TABLES[table_name]
+    schema = table_schema(model)
+    row_count = 0
+    with DatabaseService() as service, pq.ParquetWriter(output_path, schema, compression='zstd') as writer:
+        for rows in service.stream_table_batches(model.__table__, batch_size):
+            writer.write_batch(_record_batch(schema, rows))
+            row_count += len(rows)
+    return row_count
+
+
+def write_bundle(table_files, output_path: str):
+    """Zip already-written Parquet files, given as open binary files (stored uncompressed, Parquet is compressed already)"""
+    with zipfile.ZipFile(output_path, 'w', compression=zipfile.ZIP_STORED) as bundle:
+        for table_name, f in table_files.items():
+            info = zipfile.ZipInfo(f'{table_name}.parquet', date_time=time.localtime()[:6])
+            info.file_size = os.fstat(f.fileno()).st_size  # lets zipfile pick ZIP64 for large tables
+            with bundle.open(info, 'w') as member:
+                shutil.copyfileobj(f, member, 1024 * 1024)
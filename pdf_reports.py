@@ -0,0 +1,273 @@
+# pdf_reports.py - Background PDF report generation
+"""
+PDF report engine for the fleet-wide reports
+
+Large reports used to be built as one reportlab Table holding every row,
+inside the request thread. This engine instead:
+
+- streams rows from the database and splits them into LongTable chunks, so
+  layout cost stays linear and tables always split across pages
+- builds each document in a process pool, off the request thread
+- stores the finished file in the export cache, keyed by report type, the
+  current day (rental days change daily) and the write versions of the
+  source tables
+
+A job ID doubles as the cache key, so any gunicorn worker can answer status
+and download requests for a job started by another worker.
+"""
+
+import logging
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Optional
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, LongTable, TableStyle
+
+from export_cache import export_cache
+
+logger = logging.getLogger(__name__)
+
+# Rows per LongTable flowable; small tables keep reportlab's layout linear
+ROWS_PER_TABLE = 250
+
+# A job whose owning worker disappeared is reported as failed after this long
+PENDING_TIMEOUT = 30 * 60
+
+JOB_ID_PATTERN = re.compile(r'^[a-z_]+-[0-9a-f]{16}$')
+
+TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('FONTSIZE', (0, 1), (-1, -1), 8),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+])
+
+
+def _customer_rows(summary):
+    """Header and rows for the customer report"""
+    from models_postgres import Customer
+
+    customer_model = Customer()
+    summary.append(f"Total Customers: {customer_model.count()}")
+
+    yield ['Customer No', 'Name', 'Email', 'Phone', 'Address', 'City', 'State']
+    for customer in customer_model.iter_all():
+        yield [
+            customer.get('customer_no', '')[:15],
+            (customer.get('customer_name', '') or customer.get('name', ''))[:25],  # Truncate long names
+            (customer.get('customer_email', '') or customer.get('email', ''))[:30],
+            (customer.get('customer_phone', '') or customer.get('phone', ''))[:15],
+            (customer.get('customer_address', '') or customer.get('address', ''))[:25],
+            customer.get('customer_city', '')[:15],
+            customer.get('customer_state', '')[:10]
+        ]
+
+
+def _cylinder_rows(summary):
+    """Header and rows for the cylinder inventory report"""
+    from db_service import CylinderService
+    from models_postgres import Cylinder
+
+    cylinder_model = Cylinder()
+    with CylinderService() as service:
+        status_counts = service.get_status_counts()
+    summary.append(f"Total Cylinders: {sum(status_counts.values())}")
+    status_text = " | ".join([f"{status}: {count}" for status, count in status_counts.items()])
+    summary.append(f"Status Breakdown: {status_text}")
+
+    yield ['ID', 'Type', 'Size', 'Status', 'Location', 'Customer']
+    for cylinder in cylinder_model.iter_all():
+        yield [
+            cylinder_model.get_display_id(cylinder)[:15],
+            cylinder.get('type', '')[:15],
+            cylinder.get('size', '')[:12],
+            cylinder.get('status', '')[:10],
+            cylinder.get('location', '')[:15],
+            cylinder.get('customer_name', '')[:15]
+        ]
+
+
+def _rental_activity_rows(summary):
+    """Header and rows for the rental activities report"""
+    from db_service import CylinderService
+    from models_postgres import Cylinder
+
+    cylinder_model = Cylinder()
+    with CylinderService() as service:
+        summary.append(f"Total Rental Activities: {service.count_rental_activities()}")
+
+    yield ['Cylinder', 'Type', 'Customer', 'Date Borrowed', 'Status', 'Days']
+    for cylinder, customer in cylinder_model.iter_rental_activities():
+        yield [
+            cylinder_model.get_display_id(cylinder)[:15],
+            cylinder.get('type', '')[:12],
+            (customer.get('customer_name', '') or customer.get('name', ''))[:15],
+            cylinder.get('date_borrowed', '')[:10],
+            cylinder.get('status', '')[:10],
+            str(cylinder.get('rental_days', 0))
+        ]
+
+
+# Report type -> (title, source tables, row generator)
+REPORTS = {
+    'customers': ("Varasai Oxygen - Customer Report", ('customers',), _customer_rows),
+    'cylinders': ("Varasai Oxygen - Cylinder Inventory Report", ('cylinders',), _cylinder_rows),
+    'rental_activities': ("Varasai Oxygen - Rental Activities Report", ('cylinders', 'customers'), _rental_activity_rows),
+}
+
+
+def init_worker():
+    """Drop database connections inherited from the parent process"""
+    from db_models import engine, replica_engine
+    engine.dispose(close=False)
+    if replica_engine is not None:
+        replica_engine.dispose(close=False)
+
+
+def build_report(report_type: str, output_path: str) -> str:
+    """Render a report to output_path (runs inside a pool worker)"""
+    title, _, row_source = REPORTS[report_type]
+    styles = getSampleStyleSheet()
+    summary = []
+    rows = row_source(summary)
+    header = next(rows)
+
+    # Chunk rows into LongTables so each flowable stays small and splits cleanly
+    tables = []
+    chunk = [header]
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) > ROWS_PER_TABLE:
+            tables.append(chunk)
+            chunk = [header]
+    if len(chunk) > 1:
+        tables.append(chunk)
+
+    story = [Paragraph(title, styles['Title']), Spacer(1, 12)]
+    story.append(Paragraph(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", styles['Normal']))
+    for line in summary:
+        story.append(Paragraph(line, styles['Normal']))
+    story.append(Spacer(1, 12))
+
+    for data in tables:
+        table = LongTable(data, repeatRows=1)
+        table.setStyle(TABLE_STYLE)
+        story.append(table)
+
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    doc = SimpleDocTemplate(tmp_path, pagesize=letter,
+                           rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
+    doc.build(story)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+class PDFReportEngine:
+    """Submit, track and cache background PDF report jobs"""
+
+    def __init__(self, cache=export_cache, max_workers: int = 2):
+        self.cache = cache
+        self.cache_dir = cache.cache_dir
+        self.max_workers = max_workers
+        self._executor = None
+        self._futures = {}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Create the process pool lazily (only workers that build reports pay for it)"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=init_worker)
+        return self._executor
+
+    def job_id_for(self, report_type: str) -> str:
+        """Job ID for the current data version of a report"""
+        _, tables, _ = REPORTS[report_type]
+        return self.cache.entry_name(report_type, tables)
+
+    def _path(self, job_id: str, suffix: str = '.pdf') -> str:
+        if not JOB_ID_PATTERN.match(job_id):
+            raise ValueError(f'Invalid report job: {job_id}')
+        return os.path.join(self.cache_dir, job_id + suffix)
+
+    def submit(self, report_type: str) -> str:
+        """Start (or reuse) a report build and return its job ID"""
+        if report_type not in REPORTS:
+            raise ValueError(f'Unknown report type: {report_type}')
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        job_id = self.job_id_for(report_type)
+        if self.cache.get(job_id, '.pdf'):
+            return job_id
+
+        future = self._futures.get(job_id)
+        if future is not None and not future.done():
+            return job_id
+
+        # Clear markers from a previous failed attempt and record the new one
+        for suffix in ('.error', '.pending'):
+            if os.path.exists(self._path(job_id, suffix)):
+                os.remove(self._path(job_id, suffix))
+        with open(self._path(job_id, '.pending'), 'w') as f:
+            f.write(str(time.time()))
+
+        future = self._get_executor().submit(build_report, report_type, self._path(job_id))
+        future.add_done_callback(lambda done: self._finish(job_id, done))
+        self._futures[job_id] = future
+        logger.info(f"Started PDF report job {job_id}")
+        return job_id
+
+    def _finish(self, job_id: str, future):
+        """Record the job outcome on disk so every worker can see it"""
+        self._futures.pop(job_id, None)
+        pending_path = self._path(job_id, '.pending')
+        if os.path.exists(pending_path):
+            os.remove(pending_path)
+
+        error = future.exception()
+        if error is not None:
+            logger.error(f"PDF report job {job_id} failed: {error}")
+            with open(self._path(job_id, '.error'), 'w') as f:
+                f.write(str(error))
+        else:
+            self.cache.evict()
+
+    def status(self, job_id: str) -> Dict[str, Optional[str]]:
+        """Get job state: ready, pending, failed or unknown"""
+        path = self._path(job_id)
+        if os.path.exists(path):
+            return {'state': 'ready', 'error': None}
+
+        error_path = self._path(job_id, '.error')
+        if os.path.exists(error_path):
+            with open(error_path) as f:
+                return {'state': 'failed', 'error': f.read()}
+
+        if job_id in self._futures:
+            return {'state': 'pending', 'error': None}
+
+        pending_path = self._path(job_id, '.pending')
+        if os.path.exists(pending_path):
+            if time.time() - os.path.getmtime(pending_path) > PENDING_TIMEOUT:
+                return {'state': 'failed', 'error': 'Report build timed out'}
+            return {'state': 'pending', 'error': None}
+
+        return {'state': 'unknown', 'error': None}
+
+    def file_path(self, job_id: str) -> Optional[str]:
+        """Path of a finished report, or None if it is not ready"""
+        path = self._path(job_id)
+        return path if os.path.exists(path) else None
+
+
+# Global engine instance (one process pool per gunicorn worker, created on first use)
+pdf_engine = PDFReportEngine()
@@ -2,60 +2,492 @@
 """
 Performance monitoring utility for Oxygen Cylinder Tracker
 Tracks database query performance and identifies bottlenecks
+
+Every SQL statement is timed through SQLAlchemy cursor events. While a Flask
+request is being handled its statements are also counted per request: a
+warning is logged when a route runs more than QUERY_BUDGET queries, or runs
+the same statement shape (SQL with literals and parameters stripped)
+N_PLUS_ONE_THRESHOLD or more times, the usual sign of an N+1 loop.
+Per-endpoint totals are available from monitor.get_endpoint_stats().
+
+Memory stays bounded in long-running workers: recent and slow queries are
+kept in fixed-size ring buffers, and latencies go into log-bucket
+histograms (one per route and per statement shape) from which p50/p95/p99
+are read. Histograms merge by adding bucket counts, so each worker
+periodically writes its own to a small SQLite file and the admin page and
+metrics endpoint report percentiles across all gunicorn workers.
 """
 
+import os
+import re
+import json
+import math
 import time
 import logging
-from functools import wraps
+import sqlite3
+import threading
+from collections import Counter
+from functools import lru_cache, wraps
 from datetime import datetime
 
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from slow_query_log import slow_query_log, SLOW_QUERY_SECONDS
+
 # Set up performance logging
 logging.basicConfig(level=logging.INFO)
 performance_logger = logging.getLogger('performance')
 
+# Queries a single request may run before a warning is logged
+QUERY_BUDGET = int(os.environ.get('QUERY_BUDGET', '25'))
+
+# Repetitions of one statement shape within a request that count as a likely N+1
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', '5'))
+
+# Repeated shapes remembered per endpoint
+MAX_SHAPES_PER_ENDPOINT = 10
+
+# Ring buffer sizes for the recent and slow query lists
+RECENT_QUERIES = 1000
+RECENT_SLOW_QUERIES = 200
+
+# Statement shapes with their own histogram; the rest are counted under OTHER_SHAPE
+MAX_TRACKED_SHAPES = 500
+OTHER_SHAPE = '(other statements)'
+
+# Shared file the workers merge their histograms through
+METRICS_DB = os.environ.get('PERFORMANCE_METRICS_DB', os.path.join('data', 'performance_metrics.sqlite'))
+METRICS_FLUSH_INTERVAL = 10       # seconds between a worker's writes to METRICS_DB
+METRICS_RETENTION = 24 * 3600     # rows of workers not heard from for this long are dropped
+
+_PARAMETERS = re.compile(r"%\(\w+\)s|%s|\?")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def statement_shape(statement: str) -> str:
+    """SQL with parameters and literals replaced by ? so repeated queries compare equal"""
+    shape = _PARAMETERS.sub('?', statement)
+    shape = _LITERALS.sub('?', shape)
+    shape = _IN_LISTS.sub('(?)', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+class RingBuffer:
+    """Fixed-size buffer that overwrites its oldest item"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._items = [None] * capacity
+        self._next = 0
+        self._size = 0
+
+    def append(self, item):
+        self._items[self._next] = item
+        self._next = (self._next + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def items(self):
+        """Items oldest first"""
+        if self._size < self.capacity:
+            return self._items[:self._size]
+        return self._items[self._next:] + self._items[:self._next]
+
+    def clear(self):
+        self._items = [None] * self.capacity
+        self._next = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return iter(self.items())
+
+
+class LogHistogram:
+    """Latency histogram (seconds) with logarithmic buckets
+
+    Bucket i counts values up to MIN_VALUE * GROWTH ** i, so a percentile
+    read from it is at most 10% above the true value. Only non-empty
+    buckets are stored.
+    """
+
+    MIN_VALUE = 1e-5
+    GROWTH = 1.1
+    _LOG_GROWTH = math.log(GROWTH)
+
+    __slots__ = ('buckets', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        index = 0 if value <= self.MIN_VALUE else math.ceil(math.log(value / self.MIN_VALUE) / self._LOG_GROWTH)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (0 < q <= 1)"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= target:
+                return min(self.MIN_VALUE * self.GROWTH ** index, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(0.50),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+            'sum': self.total,
+        }
+
+    def to_json(self):
+        return json.dumps({'buckets': self.buckets, 'count': self.count, 'total': self.total, 'max': self.max})
+
+    @classmethod
+    def from_json(cls, data):
+        data = json.loads(data)
+        histogram = cls()
+        histogram.buckets = {int(index): count for index, count in data['buckets'].items()}
+        histogram.count = data['count']
+        histogram.total = data['total']
+        histogram.max = data['max']
+        return histogram
+
+
+class MetricsSink:
+    """SQLite file where each worker stores its histograms for the others to read"""
+
+    def __init__(self, path=METRICS_DB):
+        self.path = path
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS histograms (
+                            pid INTEGER NOT NULL,
+                            kind TEXT NOT NULL,
+                            name TEXT NOT NULL,
+                            data TEXT NOT NULL,
+                            updated_at REAL NOT NULL,
+                            PRIMARY KEY (pid, kind, name))''')
+        return conn
+
+    def write(self, pid, histograms):
+        """Replace this worker's rows for the given (kind, name) -> histogram items"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO histograms VALUES (?, ?, ?, ?, ?)',
+                                 [(pid, kind, name, histogram.to_json(), now)
+                                  for (kind, name), histogram in histograms])
+        finally:
+            conn.close()
+
+    def read(self):
+        """All workers' histograms merged per (kind, name)"""
+        merged = {}
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM histograms WHERE updated_at < ?', (time.time() - METRICS_RETENTION,))
+                rows = conn.execute('SELECT kind, name, data FROM histograms').fetchall()
+        finally:
+            conn.close()
+        for kind, name, data in rows:
+            merged.setdefault((kind, name), LogHistogram()).merge(LogHistogram.from_json(data))
+        return merged
+
+    def clear(self):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM histograms')
+        finally:
+            conn.close()
+
+
+class RequestStats:
+    """Queries run while handling one request"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint or 'unknown'
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.db_time = 0.0
+        self.shapes = Counter()
+
+    def record(self, shape, elapsed):
+        self.query_count += 1
+        self.db_time += elapsed
+        self.shapes[shape] += 1
+
+    def repeated_shapes(self):
+        """Statement shapes run often enough to look like an N+1 loop"""
+        return [(shape, count) for shape, count in self.shapes.most_common()
+                if count >= N_PLUS_ONE_THRESHOLD]
+
+
 class PerformanceMonitor:
     """Monitor database query performance"""
-    
-    def __init__(self):
-        self.query_times = []
-        self.slow_queries = []
-        
+
+    def __init__(self, sink=None):
+        self.query_times = RingBuffer(RECENT_QUERIES)
+        self.slow_queries = RingBuffer(RECENT_SLOW_QUERIES)
+        self.slow_query_count = 0
+        self.query_histogram = LogHistogram()
+        self.histograms = {}          # ('route' | 'query', name) -> LogHistogram
+        self.endpoint_stats = {}
+        self.sink = sink or MetricsSink()
+        self._dirty = set()
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._engines_instrumented = False
+
+    def _histogram(self, kind, name):
+        """Histogram for a route or statement shape (lock held)"""
+        key = (kind, name)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            if kind == 'query' and sum(1 for k in self.histograms if k[0] == 'query') >= MAX_TRACKED_SHAPES:
+                key = (kind, OTHER_SHAPE)
+                histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LogHistogram()
+        self._dirty.add(key)
+        return histogram
+
     def log_query_time(self, query_name, execution_time):
         """Log query execution time"""
-        self.query_times.append({
+        entry = {
             'query': query_name,
             'time': execution_time,
             'timestamp': datetime.now()
-        })
-        
-        # Log slow queries (over 1 second)
-        if execution_time > 1.0:
-            self.slow_queries.append({
-                'query': query_name,
-                'time': execution_time,
-                'timestamp': datetime.now()
-            })
-            performance_logger.warning(f"SLOW QUERY: {query_name} took {execution_time:.2f}s")
-        
+        }
+        with self._lock:
+            self.query_times.append(entry)
+            self.query_histogram.record(execution_time)
+            self._histogram('query', query_name).record(execution_time)
+
+            # Log slow queries (over SLOW_QUERY_SECONDS, 1 second by default)
+            if execution_time > SLOW_QUERY_SECONDS:
+                self.slow_queries.append(entry)
+                self.slow_query_count += 1
+        if execution_time > SLOW_QUERY_SECONDS:
+            performance_logger.warning(f"SLOW QUERY: {query_name[:200]} took {execution_time:.2f}s")
+
     def get_performance_stats(self):
-        """Get performance statistics"""
-        if not self.query_times:
-            return {
-                'avg_time': 0,
-                'total_queries': 0,
-                'slow_queries': 0
-            }
-        
-        total_time = sum(q['time'] for q in self.query_times)
-        avg_time = total_time / len(self.query_times)
-        
+        """Get performance statistics (this worker, since start)"""
+        with self._lock:
+            summary = self.query_histogram.summary()
+            slow_queries = self.slow_query_count
+
         return {
-            'avg_time': avg_time,
-            'total_queries': len(self.query_times),
-            'slow_queries': len(self.slow_queries),
-            'total_time': total_time
+            'avg_time': summary['mean'],
+            'p50': summary['p50'],
+            'p95': summary['p95'],
+            'p99': summary['p99'],
+            'total_queries': summary['count'],
+            'slow_queries': slow_queries,
+            'total_time': summary['sum']
         }
 
+    def instrument_engines(self):
+        """Time every statement on every SQLAlchemy engine"""
+        if self._engines_instrumented:
+            return
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        self._engines_instrumented = True
+
+    def init_app(self, app):
+        """Track per-request query counts and latencies for a Flask app"""
+        from flask import request
+
+        @app.before_request
+        def _start_request_stats():
+            self._local.request = RequestStats(request.endpoint)
+
+        @app.teardown_request
+        def _finish_request_stats(exc):
+            stats = getattr(self._local, 'request', None)
+            self._local.request = None
+            if stats is not None:
+                self.finish_request(stats)
+            self.maybe_flush()
+
+    def record_statement(self, statement, elapsed):
+        """Record one executed statement, attributing it to the current request if any"""
+        shape = statement_shape(statement)
+        self.log_query_time(shape, elapsed)
+        stats = getattr(self._local, 'request', None)
+        if stats is not None:
+            stats.record(shape, elapsed)
+        return shape
+
+    def finish_request(self, stats: RequestStats):
+        """Check a finished request against the budgets and add it to the endpoint totals"""
+        elapsed = time.perf_counter() - stats.started
+        repeated = stats.repeated_shapes()
+        over_budget = stats.query_count > QUERY_BUDGET
+
+        if over_budget:
+            performance_logger.warning(
+                f"QUERY BUDGET: {stats.endpoint} ran {stats.query_count} queries "
+                f"({stats.db_time * 1000:.0f} ms in the database), budget is {QUERY_BUDGET}")
+        for shape, count in repeated:
+            performance_logger.warning(f"POSSIBLE N+1: {stats.endpoint} ran {count}x: {shape[:200]}")
+
+        with self._lock:
+            self._histogram('route', stats.endpoint).record(elapsed)
+            totals = self.endpoint_stats.setdefault(stats.endpoint, {
+                'requests': 0, 'queries': 0, 'max_queries': 0, 'db_time': 0.0, 'max_db_time': 0.0,
+                'time': 0.0, 'over_budget': 0, 'repeated_shapes': {}
+            })
+            totals['requests'] += 1
+            totals['queries'] += stats.query_count
+            totals['max_queries'] = max(totals['max_queries'], stats.query_count)
+            totals['db_time'] += stats.db_time
+            totals['max_db_time'] = max(totals['max_db_time'], stats.db_time)
+            totals['time'] += elapsed
+            totals['over_budget'] += over_budget
+            shapes = totals['repeated_shapes']
+            for shape, count in repeated:
+                if shape in shapes or len(shapes) < MAX_SHAPES_PER_ENDPOINT:
+                    shapes[shape] = max(shapes.get(shape, 0), count)
+
+    def get_endpoint_stats(self):
+        """Per-endpoint query totals, heaviest database time first"""
+        with self._lock:
+            rows = []
+            for endpoint, totals in self.endpoint_stats.items():
+                requests = totals['requests']
+                rows.append({
+                    'endpoint': endpoint,
+                    'requests': requests,
+                    'avg_queries': totals['queries'] / requests,
+                    'max_queries': totals['max_queries'],
+                    'avg_db_ms': totals['db_time'] * 1000 / requests,
+                    'max_db_ms': totals['max_db_time'] * 1000,
+                    'avg_ms': totals['time'] * 1000 / requests,
+                    'over_budget': totals['over_budget'],
+                    'n_plus_one': sorted(totals['repeated_shapes'].items(), key=lambda item: -item[1]),
+                })
+        rows.sort(key=lambda row: -row['avg_db_ms'] * row['requests'])
+        return rows
+
+    def maybe_flush(self):
+        """Write changed histograms to the shared sink at most every METRICS_FLUSH_INTERVAL seconds"""
+        if time.monotonic() - self._last_flush >= METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Write this worker's changed histograms to the shared sink"""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            changed = [(key, LogHistogram.from_json(self.histograms[key].to_json())) for key in self._dirty]
+            self._dirty = set()
+        if not changed:
+            return
+        try:
+            self.sink.write(os.getpid(), changed)
+        except sqlite3.Error as e:
+            performance_logger.error(f"Could not write performance metrics: {e}")
+            with self._lock:
+                self._dirty.update(key for key, _ in changed)
+
+    def get_latency_summaries(self):
+        """p50/p95/p99 per route and per statement shape across all workers
+
+        Falls back to this worker's numbers if the shared sink is unavailable.
+        """
+        self.flush()
+        try:
+            histograms = self.sink.read()
+        except sqlite3.Error as e:
+            performance_logger.error(f"Could not read performance metrics: {e}")
+            with self._lock:
+                histograms = {key: LogHistogram.from_json(h.to_json()) for key, h in self.histograms.items()}
+
+        summaries = {'route': [], 'query': []}
+        for (kind, name), histogram in histograms.items():
+            summaries.setdefault(kind, []).append({'name': name, **histogram.summary()})
+        for rows in summaries.values():
+            rows.sort(key=lambda row: -row['sum'])
+        return summaries
+
+    def clear(self):
+        with self._lock:
+            self.query_times.clear()
+            self.slow_queries.clear()
+            self.slow_query_count = 0
+            self.query_histogram = LogHistogram()
+            self.histograms.clear()
+            self.endpoint_stats.clear()
+            self._dirty = set()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._perf_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_perf_started', None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        shape = monitor.record_statement(statement, elapsed)
+        if elapsed > SLOW_QUERY_SECONDS:
+            slow_query_log.record(conn, statement, parameters, executemany, elapsed, shape)
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+def render_metrics(summaries):
+    """Prometheus text exposition of the route and query latency summaries"""
+    metrics = (
+        ('route', 'oxygen_request_duration_seconds', 'endpoint', 'Flask request latency by endpoint'),
+        ('query', 'oxygen_db_query_duration_seconds', 'statement', 'SQL statement latency by statement shape'),
+    )
+    lines = []
+    for kind, metric, label, help_text in metrics:
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} summary')
+        for row in summaries.get(kind, []):
+            name = _escape_label(row['name'][:200])
+            for quantile, key in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')):
+                value = row[key]
+                lines.append(f'{metric}{{{label}="{name}",quantile="{quantile}"}} {value:.6f}')
+            lines.append(f'{metric}_sum{{{label}="{name}"}} {row["sum"]:.6f}')
+            lines.append(f'{metric}_count{{{label}="{name}"}} {row["count"]}')
+    return '\n'.join(lines) + '\n'
+
 # Global performance monitor instance
 monitor = PerformanceMonitor()
 
@@ -77,22 +509,22 @@ def track_performance(query_name):
 def optimize_query_hints():
     """Provide query optimization hints"""
     stats = monitor.get_performance_stats()
-    
+
     hints = []
-    
+
     if stats['avg_time'] > 0.5:
         hints.append("Consider adding database indexes for frequently queried fields")
-    
+
     if stats['slow_queries'] > 5:
         hints.append("Multiple slow queries detected - consider query optimization")
-    
-    if len(monitor.query_times) > 1000:
+
+    if stats['total_queries'] > 1000:
         hints.append("High query volume - consider implementing caching")
-    
+
     return hints
 
 def clear_performance_data():
     """Clear performance monitoring data"""
-    monitor.query_times.clear()
-    monitor.slow_queries.clear()
-    performance_logger.info("Performance monitoring data cleared")
\ No newline at end of file
+    monitor.clear()
+    monitor.sink.clear()
+    performance_logger.info("Performance monitoring data cleared")
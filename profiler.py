@@ -0,0 +1,182 @@
+# profiler.py - On-demand sampling profiler for single requests
+"""
+On-demand sampling profiler for single requests
+
+An admin adds the header "X-Profile: 1" (or the query flag "_profile=1") to
+a request. While that request runs, a background thread samples the
+request thread's Python stack every PROFILE_INTERVAL seconds through
+sys._current_frames(). Nothing is traced, so the overhead is a few percent
+even for slow pages, and requests without the flag are not affected.
+
+Each profile is saved under PROFILE_DIR as a collapsed-stack file (one
+"frame;frame;frame count" line per distinct stack, the input format of
+flamegraph.pl and speedscope) with a small JSON sidecar describing the
+request. Only the newest MAX_PROFILES are kept.
+"""
+
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', '0.002'))
+MAX_PROFILES = 50
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_QUERY_FLAG = '_profile'
+
+_SAFE_NAME = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def _frame_label(code) -> str:
+    # ';' separates frames in the collapsed format
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ':')
+
+
+class SamplingProfiler:
+    """Samples one thread's stack from a background thread"""
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(labels))] += 1
+            self.samples += 1
+
+
+class RequestProfiler:
+    """Profiles flagged requests and stores the results under PROFILE_DIR"""
+
+    def __init__(self, profile_dir: str = PROFILE_DIR):
+        self.profile_dir = profile_dir
+        self._local = threading.local()
+
+    def init_app(self, app, is_allowed: Callable[[], bool]):
+        """Profile requests carrying the flag when is_allowed() (e.g. the user is an admin)"""
+        from flask import request
+
+        @app.before_request
+        def _start_profile():
+            self._local.profiler = None
+            flagged = request.headers.get(PROFILE_HEADER) == '1' or request.args.get(PROFILE_QUERY_FLAG) == '1'
+            if flagged and is_allowed():
+                self._local.profiler = SamplingProfiler(threading.get_ident()).start()
+                self._local.started = time.perf_counter()
+
+        @app.after_request
+        def _finish_profile(response):
+            profiler = getattr(self._local, 'profiler', None)
+            if profiler is None:
+                return response
+            self._local.profiler = None
+            duration = time.perf_counter() - self._local.started
+            stacks = profiler.stop()
+            try:
+                name = self.save(stacks, {
+                    'endpoint': request.endpoint or 'unknown',
+                    'path': request.full_path.rstrip('?'),
+                    'method': request.method,
+                    'status': response.status_code,
+                    'duration': duration,
+                    'samples': profiler.samples,
+                    'interval': profiler.interval,
+                })
+                response.headers['X-Profile-Id'] = name
+            except OSError as e:
+                logger.error(f"Could not save profile: {e}")
+            return response
+
+        @app.teardown_request
+        def _discard_profile(exc):
+            # after_request is skipped when the view raised; don't leave the sampler running
+            profiler = getattr(self._local, 'profiler', None)
+            if profiler is not None:
+                self._local.profiler = None
+                profiler.stop()
+
+    def save(self, stacks: Counter, info: Dict) -> str:
+        """Write a collapsed-stack file plus its JSON sidecar; returns the profile name"""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        started = datetime.now()
+        name = f"{started.strftime('%Y%m%d-%H%M%S-%f')}-{_SAFE_NAME.sub('_', info['endpoint'])}"
+
+        # Self time per function: the leaf frame of each sample
+        leaves = Counter()
+        for stack, count in stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+
+        with open(os.path.join(self.profile_dir, name + '.collapsed'), 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        with open(os.path.join(self.profile_dir, name + '.json'), 'w') as f:
+            json.dump({**info, 'name': name, 'created_at': started.isoformat(),
+                       'top_functions': leaves.most_common(10)}, f, indent=2)
+
+        self._prune()
+        logger.info(f"Saved profile {name} ({info['samples']} samples, {info['duration'] * 1000:.0f} ms)")
+        return name
+
+    def _prune(self):
+        for info in self.list_profiles()[MAX_PROFILES:]:
+            for ext in ('.collapsed', '.json'):
+                try:
+                    os.remove(os.path.join(self.profile_dir, info['name'] + ext))
+                except FileNotFoundError:
+                    pass
+
+    def list_profiles(self) -> List[Dict]:
+        """Saved profiles, newest first"""
+        if not os.path.isdir(self.profile_dir):
+            return []
+        profiles = []
+        for filename in sorted(os.listdir(self.profile_dir), reverse=True):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.profile_dir, filename)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, json.JSONDecodeError):
+                continue
+        return profiles
+
+    def get_path(self, name: str) -> Optional[str]:
+        """Path of a profile's collapsed-stack file, or None if unknown"""
+        if _SAFE_NAME.sub('_', name) != name:
+            return None
+        path = os.path.join(self.profile_dir, name + '.collapsed')
+        return path if os.path.exists(path) else None
+
+
+# Global request profiler instance
+request_profiler = RequestProfiler()
@@ -0,0 +1,79 @@
+# repository.py - Storage-independent interface for customers and cylinders
+"""
+Repository protocols shared by the storage backends
+
+    models.py            JSON files (journaled JSONDatabase)
+    models_postgres.py   SQLAlchemy via db_service (PostgreSQL, SQLite)
+    models_mysql.py      Flask-SQLAlchemy models of app_mysql_fixed.py (MySQL)
+
+Records are plain dicts with the customer/cylinder field names used by the
+templates. Routes and jobs should only rely on the methods below; anything
+else on a backend is backend-specific.
+
+Bulk operations exist so callers never loop over single-record writes:
+get_many is one lookup per batch of IDs, bulk_rent / bulk_return /
+bulk_update apply a whole batch in one transaction (one journal write for
+JSON) and return what was actually changed, skipping IDs that don't exist
+or are in the wrong state. iter_all streams instead of loading everything.
+
+check_repositories.py runs the same conformance and timing checks against
+every backend.
+"""
+
+from typing import Dict, Iterable, Iterator, List, Optional, Protocol, runtime_checkable
+
+
+@runtime_checkable
+class CustomerRepository(Protocol):
+    """Customer storage"""
+
+    def get_by_id(self, customer_id: str) -> Optional[Dict]: ...
+
+    def get_many(self, customer_ids: Iterable[str]) -> List[Dict]: ...
+
+    def search(self, query: str) -> List[Dict]: ...
+
+    def count(self) -> int: ...
+
+    def iter_all(self, batch_size: int = 1000) -> Iterator[Dict]: ...
+
+    def add(self, customer_data: Dict) -> Dict: ...
+
+    def update(self, customer_id: str, customer_data: Dict) -> Optional[Dict]: ...
+
+    def delete(self, customer_id: str) -> bool: ...
+
+
+@runtime_checkable
+class CylinderRepository(Protocol):
+    """Cylinder storage, including rent/return"""
+
+    def get_by_id(self, cylinder_id: str) -> Optional[Dict]: ...
+
+    def get_many(self, cylinder_ids: Iterable[str]) -> List[Dict]: ...
+
+    def find_by_any_identifier(self, identifier: str) -> Optional[Dict]: ...
+
+    def search(self, query: str) -> List[Dict]: ...
+
+    def get_by_customer(self, customer_id: str) -> List[Dict]: ...
+
+    def count(self) -> int: ...
+
+    def iter_all(self, batch_size: int = 1000) -> Iterator[Dict]: ...
+
+    def add(self, cylinder_data: Dict) -> Dict: ...
+
+    def update(self, cylinder_id: str, cylinder_data: Dict) -> Optional[Dict]: ...
+
+    def bulk_update(self, updates_dict: Dict[str, Dict]) -> int: ...
+
+    def delete(self, cylinder_id: str) -> bool: ...
+
+    def rent_cylinder(self, cylinder_id: str, customer_id: str, rental_date: str = None) -> bool: ...
+
+    def return_cylinder(self, cylinder_id: str, return_date: str = None) -> bool: ...
+
+    def bulk_rent(self, cylinder_ids: List[str], customer_id: str, rental_date: str = None) -> List[str]: ...
+
+    def bulk_return(self, cylinder_ids: List[str], return_date: str = None) -> List[str]: ...
@@ -29,24 +29,22 @@ Date: July 2025
 Version: 2.0
 """
 
-from flask import render_template, request, redirect, url_for, flash, jsonify, session, Response
+from flask import render_template, request, redirect, url_for, flash, jsonify, session, Response, stream_with_context, send_file
 import csv
 import io
 import os
-import json
-import shutil
-import threading
-import time
 from datetime import datetime, timedelta
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib.units import inch
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib import colors
 from app import app
 from models_postgres import Customer, Cylinder
 from auth_models import UserManager
+from backup_engine import backup_engine
+from export_cache import export_cache
+from pdf_reports import pdf_engine
+from scheduler import scheduler, load_dashboard_rollup
+from db_models import replica_engine, pin_to_primary, primary_pinned_until
+from performance_monitor import monitor
+from profiler import request_profiler
+from slow_query_log import slow_query_log
 from functools import wraps
 import os
 import tempfile
@@ -61,6 +59,13 @@ except ImportError as e:
     import logging
     logging.warning(f"MS Access functionality not available: {e}")
 
+# Parquet export needs pyarrow, which is optional
+try:
+    from parquet_export import PARQUET_AVAILABLE, PARQUET_TABLES, write_table, write_bundle
+except ImportError:
+    PARQUET_AVAILABLE = False
+    PARQUET_TABLES = {}
+
 # Try to import Email functionality with graceful degradation
 # Email service is optional - system works without it
 try:
@@ -284,15 +289,16 @@ def register():
             return render_template('register.html')
         
         # Check if email already exists
-        users = user_manager.get_all_users()
-        if any(u.get('email') == email for u in users):
+        if user_manager.get_user_by_email(email):
             flash('Email already registered', 'error')
             return render_template('register.html')
         
         try:
-            new_user = user_manager.create_user(username, email, password, role)
+            user_manager.create_user(username, email, password, role)
             flash(f'User {username} created successfully with role: {role}', 'success')
             return redirect(url_for('users'))
+        except ValueError as e:
+            flash(str(e), 'error')
         except Exception as e:
             flash(f'Error creating user: {str(e)}', 'error')
     
@@ -330,24 +336,15 @@ def index():
     Returns:
         Dashboard template with comprehensive system statistics
     """
-    # Get actual total counts from PostgreSQL without pagination limits
-    customers_data, total_customers = customer_model.get_all(page=1, per_page=1)
-    cylinders, total_cylinders = cylinder_model.get_all(page=1, per_page=10000)  # Get all cylinders for status calculation
-    
-    # Calculate cylinder status distribution
-    available_cylinders = len([c for c in cylinders if c.get('status', '').lower() == 'available'])
-    rented_cylinders = len([c for c in cylinders if c.get('status', '').lower() == 'rented'])
-    maintenance_cylinders = len([c for c in cylinders if c.get('status', '').lower() == 'maintenance'])
+    # Counters come from the scheduler's rollup, recomputed in SQL if data changed since
+    rollup = load_dashboard_rollup()
+    total_customers = rollup['total_customers']
+    total_cylinders = rollup['total_cylinders']
+    available_cylinders = rollup['status_counts'].get('available', 0)
+    rented_cylinders = rollup['status_counts'].get('rented', 0)
+    maintenance_cylinders = rollup['status_counts'].get('maintenance', 0)
     utilization_rate = round((rented_cylinders / total_cylinders * 100) if total_cylinders > 0 else 0)
-    
-    # Find top customer (most rentals)
-    customer_rentals = {}
-    for cylinder in cylinders:
-        if cylinder.get('rented_to'):
-            customer_id = cylinder['rented_to']
-            customer_rentals[customer_id] = customer_rentals.get(customer_id, 0) + 1
-    
-    top_customer_count = max(customer_rentals.values()) if customer_rentals else 0
+    top_customer_count = rollup['top_customer_count']
     
     # Calculate average rental days (mock data)
     import random
@@ -861,64 +858,52 @@ def rental_history():
             flash(f'Removed {removed_count} records older than 6 months', 'info')
     
     # Get pagination parameters
-    page = request.args.get('page', 1, type=int)
+    page = max(request.args.get('page', 1, type=int), 1)
     per_page = request.args.get('per_page', 50, type=int)
     
     # Limit per_page to reasonable values
     per_page = min(max(per_page, 10), 200)
     
-    search_query = request.args.get('search', '')
-    customer_filter = request.args.get('customer', '')
-    
-    # Use RentalHistory service to get return records  
-    with RentalHistoryService() as service:
-        all_transactions, total_count = service.get_all(page=1, per_page=5000)  # Get larger batch
-        print(f"Debug: Retrieved {len(all_transactions)} transactions out of {total_count} total")
-    
-    # Convert SQLAlchemy objects to dicts for filtering
-    transaction_dicts = []
-    for t in all_transactions:
-        if hasattr(t, 'customer_name'):  # SQLAlchemy object
-            transaction_dicts.append({
-                'customer_name': t.customer_name or '',
-                'cylinder_custom_id': t.cylinder_custom_id or '',
-                'customer_no': t.customer_no or '',
-                'return_date': t.return_date.isoformat() if t.return_date else '',
-                'dispatch_date': t.dispatch_date.isoformat() if t.dispatch_date else '',
-                'rental_days': t.rental_days or 0,
-                'cylinder_type': t.cylinder_type or '',
-                'cylinder_size': t.cylinder_size or '',
-                'customer_phone': t.customer_phone or '',
-                'customer_address': t.customer_address or '',
-                'location': t.location or ''
-            })
-        else:  # Already a dict
-            transaction_dicts.append(t)
-    
-    all_transactions = transaction_dicts
-    
-    # Apply search filter
-    if search_query:
-        all_transactions = [t for t in all_transactions 
-                          if search_query.lower() in t.get('customer_name', '').lower() or
-                             search_query.lower() in t.get('cylinder_custom_id', '').lower() or
-                             search_query.lower() in t.get('customer_no', '').lower()]
+    search_query = request.args.get('search', '').strip()
+    customer_filter = request.args.get('customer', '').strip()
+    date_from = request.args.get('date_from', '')
+    date_to = request.args.get('date_to', '')
+    sort = request.args.get('sort', 'return_desc')
     
-    # Apply customer filter  
-    if customer_filter:
-        all_transactions = [t for t in all_transactions 
-                          if t.get('customer_no', '').upper() == customer_filter.upper()]
+    # Return-date range from the form's YYYY-MM-DD inputs, the end day inclusive
+    try:
+        return_from = datetime.strptime(date_from, '%Y-%m-%d') if date_from else None
+        return_until = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1) if date_to else None
+    except ValueError:
+        flash('Invalid date range, use YYYY-MM-DD', 'warning')
+        return_from = return_until = None
+        date_from = date_to = ''
     
-    # Sort by return date (most recent first)
-    all_transactions.sort(key=lambda x: x.get('return_date', '') or x.get('date_returned', ''), reverse=True)
+    # Filtering, sorting and paging run in SQL; only the requested page is loaded
+    with RentalHistoryService() as service:
+        page_records, total_transactions = service.get_all(
+            page=page, per_page=per_page, search_query=search_query or None,
+            customer_no=customer_filter or None, date_from=return_from, date_to=return_until, sort=sort
+        )
+        unique_customers = service.get_customer_options()
+    
+    transactions_paginated = [{
+        'customer_name': t.customer_name or '',
+        'cylinder_custom_id': t.cylinder_custom_id or '',
+        'customer_no': t.customer_no or '',
+        'return_date': (t.return_date or t.date_returned).isoformat() if (t.return_date or t.date_returned) else '',
+        'dispatch_date': (t.dispatch_date or t.date_borrowed).isoformat() if (t.dispatch_date or t.date_borrowed) else '',
+        'rental_days': t.rental_days or 0,
+        'cylinder_type': t.cylinder_type or '',
+        'cylinder_size': t.cylinder_size or '',
+        'customer_phone': t.customer_phone or '',
+        'customer_address': t.customer_address or '',
+        'location': t.location or ''
+    } for t in page_records]
     
-    # Calculate pagination
-    total_transactions = len(all_transactions)
+    # Calculate pagination info
     start = (page - 1) * per_page
     end = start + per_page
-    transactions_paginated = all_transactions[start:end]
-    
-    # Calculate pagination info
     total_pages = (total_transactions + per_page - 1) // per_page
     has_prev = page > 1
     has_next = page < total_pages
@@ -936,16 +921,19 @@ def rental_history():
         'end_index': min(end, total_transactions)
     }
     
-    # Get unique customers for filter dropdown
-    unique_customers = list(set((t.get('customer_no', ''), t.get('customer_name', '')) 
-                               for t in all_transactions if t.get('customer_no')))
-    unique_customers.sort(key=lambda x: x[1])  # Sort by customer name
+    # Query string carried by the pagination links
+    filter_args = {'search': search_query, 'customer': customer_filter, 'date_from': date_from,
+                   'date_to': date_to, 'sort': sort, 'per_page': per_page}
     
     return render_template('rental_history.html',
                          transactions=transactions_paginated,
                          pagination=pagination_info,
                          search_query=search_query,
                          customer_filter=customer_filter,
+                         date_from=date_from,
+                         date_to=date_to,
+                         sort=sort,
+                         filter_args=filter_args,
                          unique_customers=unique_customers,
                          total_transactions=total_transactions)
 
@@ -1039,7 +1027,18 @@ def cylinder_details(cylinder_id):
             cylinder['customer_name'] = customer.get('customer_name') or customer.get('name', 'Unknown Customer')
             cylinder['customer_phone'] = customer.get('customer_phone') or customer.get('phone', 'N/A')
     
-    return render_template('cylinder_details.html', cylinder=cylinder)
+    # Recent past rentals of this cylinder
+    from db_service import RentalHistoryService
+    with RentalHistoryService() as history_service:
+        past_rentals = [{
+            'customer_name': record.customer_name or '',
+            'customer_no': record.customer_no or '',
+            'dispatch_date': record.dispatch_date.strftime('%Y-%m-%d') if record.dispatch_date else '',
+            'return_date': record.return_date.strftime('%Y-%m-%d') if record.return_date else '',
+            'rental_days': record.rental_days or 0,
+        } for record in history_service.get_for_cylinder(cylinder['id'])]
+    
+    return render_template('cylinder_details.html', cylinder=cylinder, past_rentals=past_rentals)
 
 @app.route('/cylinders/add', methods=['GET', 'POST'])
 @admin_or_user_can_edit
@@ -1376,6 +1375,42 @@ def preview_table(table_name):
         flash(f'Error previewing table: {str(e)}', 'error')
         return redirect(url_for('import_data'))
 
+@app.route('/import/dry-run', methods=['POST'])
+def dry_run_import():
+    """Validate the full import against the database without writing anything"""
+    if 'access_file_path' not in session:
+        flash('No Access file connected. Please upload a file first.', 'error')
+        return redirect(url_for('import_data'))
+
+    table_name = request.form.get('table_name')
+    import_type = request.form.get('import_type')
+
+    # Build field mapping from form data
+    field_mapping = {}
+    for key, value in request.form.items():
+        if key.startswith('mapping_') and value:
+            target_field = key.replace('mapping_', '')
+            field_mapping[target_field] = value
+
+    if not field_mapping:
+        flash('Please map at least one field', 'error')
+        return redirect(url_for('preview_table', table_name=table_name, type=import_type))
+
+    try:
+        from import_validator import ImportValidator
+        report = ImportValidator().validate(session['access_file_path'], table_name, field_mapping, import_type)
+    except Exception as e:
+        flash(f'Error validating import: {str(e)}', 'error')
+        return redirect(url_for('preview_table', table_name=table_name, type=import_type))
+
+    return render_template('import_dry_run.html',
+                         report=report,
+                         table_name=table_name,
+                         import_type=import_type,
+                         field_mapping=field_mapping,
+                         skip_duplicates=request.form.get('skip_duplicates'),
+                         filename=session.get('access_file_name', 'Unknown'))
+
 @app.route('/import/execute', methods=['POST'])
 def execute_import():
     """Execute the data import"""
@@ -2064,228 +2099,270 @@ def reports():
         'active_rentals': active_rentals
     }
     
-    return render_template('reports.html', stats=stats, customers=customers_dict)
+    return render_template('reports.html', stats=stats, customers=customers_dict, parquet_available=PARQUET_AVAILABLE)
+
+def stream_csv(rows, chunk_rows=500):
+    """
+    Encode rows as CSV and yield text chunks as they are produced
+    
+    The first chunk is flushed after the first row so the download starts
+    immediately; afterwards chunks of `chunk_rows` rows are yielded to keep
+    per-chunk overhead low while memory use stays constant.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count == 1 or count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def csv_download(rows, filename_prefix, tables):
+    """
+    Build a CSV attachment response, served from the export cache when possible
+    
+    `tables` lists the tables the export reads; their write versions key the
+    cache entry, which is also sent as the ETag. On a miss the CSV is streamed
+    to the client and saved to the cache at the same time.
+    """
+    filename = f'{filename_prefix}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+    entry = export_cache.entry_name(f'{filename_prefix}_csv', tables)
+    
+    cached = export_cache.not_modified(entry) or export_cache.send(entry, '.csv', 'text/csv', filename)
+    if cached:
+        return cached
+    
+    response = Response(
+        stream_with_context(export_cache.tee(entry, '.csv', stream_csv(rows))),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+    response.set_etag(entry)
+    response.cache_control.no_cache = True
+    return response
+
+def _date_part(value):
+    """Extract the YYYY-MM-DD part of an ISO date string"""
+    if value and len(value) >= 10:
+        return value[:10]
+    return value
 
 @app.route('/export/customers.csv')
 @login_required
 def export_customers_csv():
-    """Export all customers to CSV"""
+    """Export all customers to CSV (streamed)"""
     customer_model = Customer()
-    customers = customer_model.get_all()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
     
-    # Write headers
-    writer.writerow(['ID', 'Customer No', 'Name', 'Email', 'Phone', 'Address', 'City', 'State', 'APGST', 'CST', 'Created At', 'Updated At', 'Notes'])
+    def generate_rows():
+        # Write headers
+        yield ['ID', 'Customer No', 'Name', 'Email', 'Phone', 'Address', 'City', 'State', 'APGST', 'CST', 'Created At', 'Updated At', 'Notes']
+        
+        # Write customer data
+        for customer in customer_model.iter_all():
+            yield [
+                customer.get('id', ''),
+                customer.get('customer_no', ''),
+                customer.get('customer_name', '') or customer.get('name', ''),
+                customer.get('customer_email', '') or customer.get('email', ''),
+                customer.get('customer_phone', '') or customer.get('phone', ''),
+                customer.get('customer_address', '') or customer.get('address', ''),
+                customer.get('customer_city', ''),
+                customer.get('customer_state', ''),
+                customer.get('customer_apgst', ''),
+                customer.get('customer_cst', ''),
+                customer.get('created_at', ''),
+                customer.get('updated_at', ''),
+                customer.get('notes', '')
+            ]
     
-    # Write customer data
-    for customer in customers:
-        writer.writerow([
-            customer.get('id', ''),
-            customer.get('customer_no', ''),
-            customer.get('customer_name', '') or customer.get('name', ''),
-            customer.get('customer_email', '') or customer.get('email', ''),
-            customer.get('customer_phone', '') or customer.get('phone', ''),
-            customer.get('customer_address', '') or customer.get('address', ''),
-            customer.get('customer_city', ''),
-            customer.get('customer_state', ''),
-            customer.get('customer_apgst', ''),
-            customer.get('customer_cst', ''),
-            customer.get('created_at', ''),
-            customer.get('updated_at', ''),
-            customer.get('notes', '')
-        ])
-    
-    output.seek(0)
-    return Response(
-        output.getvalue(),
-        mimetype='text/csv',
-        headers={'Content-Disposition': f'attachment; filename=customers_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'}
-    )
+    return csv_download(generate_rows(), 'customers', ('customers',))
 
 @app.route('/export/cylinders.csv')
 @login_required
 def export_cylinders_csv():
-    """Export all cylinders to CSV"""
+    """Export all cylinders to CSV (streamed)"""
     cylinder_model = Cylinder()
-    cylinders = cylinder_model.get_all()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
     
-    # Write headers
-    writer.writerow(['ID', 'Serial Number', 'Type', 'Size', 'Status', 'Location', 
-                    'Pressure', 'Last Inspection', 'Next Inspection', 'Customer Name',
-                    'Date Borrowed', 'Date Returned', 'Notes'])
+    def generate_rows():
+        # Write headers
+        yield ['ID', 'Serial Number', 'Type', 'Size', 'Status', 'Location', 
+               'Pressure', 'Last Inspection', 'Next Inspection', 'Customer Name',
+               'Date Borrowed', 'Date Returned', 'Notes']
+        
+        # Write cylinder data
+        for cylinder in cylinder_model.iter_all():
+            yield [
+                cylinder_model.get_display_id(cylinder),
+                cylinder.get('serial_number', ''),
+                cylinder.get('type', ''),
+                cylinder.get('size', ''),
+                cylinder.get('status', ''),
+                cylinder.get('location', ''),
+                cylinder.get('pressure', ''),
+                cylinder.get('last_inspection', ''),
+                cylinder.get('next_inspection', ''),
+                cylinder.get('customer_name', ''),
+                _date_part(cylinder.get('date_borrowed', '') or cylinder.get('rental_date', '')),
+                _date_part(cylinder.get('date_returned', '')),
+                cylinder.get('notes', '')
+            ]
     
-    # Write cylinder data
-    for cylinder in cylinders:
-        display_id = cylinder_model.get_display_id(cylinder)
-        
-        # Format dispatch and return dates properly
-        dispatch_date = cylinder.get('date_borrowed', '') or cylinder.get('rental_date', '')
-        if dispatch_date and len(dispatch_date) >= 10:
-            dispatch_date = dispatch_date[:10]  # Extract YYYY-MM-DD part
-        
-        return_date = cylinder.get('date_returned', '')
-        if return_date and len(return_date) >= 10:
-            return_date = return_date[:10]  # Extract YYYY-MM-DD part
-        
-        writer.writerow([
-            display_id,
-            cylinder.get('serial_number', ''),
-            cylinder.get('type', ''),
-            cylinder.get('size', ''),
-            cylinder.get('status', ''),
-            cylinder.get('location', ''),
-            cylinder.get('pressure', ''),
-            cylinder.get('last_inspection', ''),
-            cylinder.get('next_inspection', ''),
-            cylinder.get('customer_name', ''),
-            dispatch_date,
-            return_date,
-            cylinder.get('notes', '')
-        ])
-    
-    output.seek(0)
-    return Response(
-        output.getvalue(),
-        mimetype='text/csv',
-        headers={'Content-Disposition': f'attachment; filename=cylinders_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'}
-    )
+    return csv_download(generate_rows(), 'cylinders', ('cylinders',))
 
 @app.route('/export/rental-activities.csv')
 @login_required
 def export_rental_activities_csv():
-    """Export rental activities to CSV"""
+    """Export rental activities to CSV (streamed)"""
     cylinder_model = Cylinder()
-    customer_model = Customer()
-    cylinders = cylinder_model.get_all()
-    customers = customer_model.get_all()
-    
-    # Create customer lookup
-    customer_lookup = {c['id']: c for c in customers}
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
     
-    # Write headers
-    writer.writerow(['Cylinder ID', 'Serial Number', 'Type', 
-                    'Customer Name', 'Customer Email', 'Date Borrowed', 'Date Returned', 
-                    'Status', 'Rental Days'])
-    
-    # Write rental data
-    for cylinder in cylinders:
-        if cylinder.get('rented_to') or cylinder.get('date_borrowed'):
-            customer = customer_lookup.get(cylinder.get('rented_to', ''), {})
-            rental_days = cylinder_model.get_rental_days(cylinder)
-            display_id = cylinder_model.get_display_id(cylinder)
-            
-            # Format dispatch and return dates properly
-            dispatch_date = cylinder.get('date_borrowed', '') or cylinder.get('rental_date', '')
-            if dispatch_date and len(dispatch_date) >= 10:
-                dispatch_date = dispatch_date[:10]  # Extract YYYY-MM-DD part
-            
-            return_date = cylinder.get('date_returned', '')
-            if return_date and len(return_date) >= 10:
-                return_date = return_date[:10]  # Extract YYYY-MM-DD part
-            
-            writer.writerow([
-                display_id,
+    def generate_rows():
+        # Write headers
+        yield ['Cylinder ID', 'Serial Number', 'Type', 
+               'Customer Name', 'Customer Email', 'Date Borrowed', 'Date Returned', 
+               'Status', 'Rental Days']
+        
+        # Customer is joined in the same query instead of a full customer lookup table
+        for cylinder, customer in cylinder_model.iter_rental_activities():
+            yield [
+                cylinder_model.get_display_id(cylinder),
                 cylinder.get('serial_number', ''),
                 cylinder.get('type', ''),
                 customer.get('customer_name', '') or customer.get('name', ''),
                 customer.get('customer_email', '') or customer.get('email', ''),
-                dispatch_date,
-                return_date,
+                _date_part(cylinder.get('date_borrowed', '') or cylinder.get('rental_date', '')),
+                _date_part(cylinder.get('date_returned', '')),
                 cylinder.get('status', ''),
-                rental_days
-            ])
+                cylinder.get('rental_days', 0)
+            ]
     
-    output.seek(0)
-    return Response(
-        output.getvalue(),
-        mimetype='text/csv',
-        headers={'Content-Disposition': f'attachment; filename=rental_activities_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'}
-    )
+    return csv_download(generate_rows(), 'rental_activities', ('cylinders', 'customers'))
 
 @app.route('/export/complete-data.csv')
 @login_required
 def export_complete_data_csv():
-    """Export complete database to CSV"""
+    """Export complete database to CSV (streamed)"""
     customer_model = Customer()
     cylinder_model = Cylinder()
-    customers = customer_model.get_all()
-    cylinders = cylinder_model.get_all()
     
-    output = io.StringIO()
-    writer = csv.writer(output)
+    def generate_rows():
+        # Write a complete report with all data
+        yield ['=== COMPLETE DATABASE EXPORT ===']
+        yield ['Export Date:', datetime.now().strftime('%Y-%m-%d %H:%M:%S')]
+        yield ['Total Customers:', customer_model.count()]
+        yield ['Total Cylinders:', cylinder_model.count()]
+        yield []
+        
+        # Customers section
+        yield ['=== CUSTOMERS ===']
+        yield ['ID', 'Customer No', 'Name', 'Email', 'Phone', 'Address', 'City', 'State', 'APGST', 'CST', 'Created At', 'Notes']
+        for customer in customer_model.iter_all():
+            yield [
+                customer.get('id', ''),
+                customer.get('customer_no', ''),
+                customer.get('customer_name', '') or customer.get('name', ''),
+                customer.get('customer_email', '') or customer.get('email', ''),
+                customer.get('customer_phone', '') or customer.get('phone', ''),
+                customer.get('customer_address', '') or customer.get('address', ''),
+                customer.get('customer_city', ''),
+                customer.get('customer_state', ''),
+                customer.get('customer_apgst', ''),
+                customer.get('customer_cst', ''),
+                customer.get('created_at', ''),
+                customer.get('notes', '')
+            ]
+        
+        yield []
+        
+        # Cylinders section
+        yield ['=== CYLINDERS ===']
+        yield ['ID', 'Serial Number', 'Type', 'Size', 'Status', 'Location', 
+               'Pressure', 'Customer Name', 'Date Borrowed', 'Rental Days']
+        for cylinder in cylinder_model.iter_all():
+            yield [
+                cylinder_model.get_display_id(cylinder),
+                cylinder.get('serial_number', ''),
+                cylinder.get('type', ''),
+                cylinder.get('size', ''),
+                cylinder.get('status', ''),
+                cylinder.get('location', ''),
+                cylinder.get('pressure', ''),
+                cylinder.get('customer_name', ''),
+                _date_part(cylinder.get('date_borrowed', '') or cylinder.get('rental_date', '')),
+                cylinder.get('rental_days', 0)
+            ]
     
-    # Write a complete report with all data
-    writer.writerow(['=== COMPLETE DATABASE EXPORT ==='])
-    writer.writerow(['Export Date:', datetime.now().strftime('%Y-%m-%d %H:%M:%S')])
-    writer.writerow(['Total Customers:', len(customers)])
-    writer.writerow(['Total Cylinders:', len(cylinders)])
-    writer.writerow([])
+    return csv_download(generate_rows(), 'complete_database', ('customers', 'cylinders'))
+
+def _parquet_entry(table_name):
+    """Cache entry name and writer of a table's Parquet file"""
+    entry = export_cache.entry_name(f'{table_name}_parquet', (table_name,))
+    return entry, lambda path: write_table(table_name, path)
+
+@app.route('/export/parquet/<table_name>.parquet')
+@login_required
+def export_table_parquet(table_name):
+    """Export one table as a Parquet file for analytics"""
+    if not PARQUET_AVAILABLE:
+        flash('Parquet export requires the pyarrow package', 'error')
+        return redirect(url_for('reports'))
+    if table_name not in PARQUET_TABLES:
+        flash('Unknown table', 'error')
+        return redirect(url_for('reports'))
     
-    # Customers section
-    writer.writerow(['=== CUSTOMERS ==='])
-    writer.writerow(['ID', 'Customer No', 'Name', 'Email', 'Phone', 'Address', 'City', 'State', 'APGST', 'CST', 'Created At', 'Notes'])
-    for customer in customers:
-        writer.writerow([
-            customer.get('id', ''),
-            customer.get('customer_no', ''),
-            customer.get('customer_name', '') or customer.get('name', ''),
-            customer.get('customer_email', '') or customer.get('email', ''),
-            customer.get('customer_phone', '') or customer.get('phone', ''),
-            customer.get('customer_address', '') or customer.get('address', ''),
-            customer.get('customer_city', ''),
-            customer.get('customer_state', ''),
-            customer.get('customer_apgst', ''),
-            customer.get('customer_cst', ''),
-            customer.get('created_at', ''),
-            customer.get('notes', '')
-        ])
-    
-    writer.writerow([])
-    
-    # Cylinders section
-    writer.writerow(['=== CYLINDERS ==='])
-    writer.writerow(['ID', 'Serial Number', 'Type', 'Size', 'Status', 'Location', 
-                    'Pressure', 'Customer Name', 'Date Borrowed', 'Rental Days'])
-    for cylinder in cylinders:
-        rental_days = cylinder_model.get_rental_days(cylinder)
-        display_id = cylinder_model.get_display_id(cylinder)
-        # Format dispatch date properly
-        dispatch_date = cylinder.get('date_borrowed', '') or cylinder.get('rental_date', '')
-        if dispatch_date and len(dispatch_date) >= 10:
-            dispatch_date = dispatch_date[:10]  # Extract YYYY-MM-DD part
-        
-        writer.writerow([
-            display_id,
-            cylinder.get('serial_number', ''),
-            cylinder.get('type', ''),
-            cylinder.get('size', ''),
-            cylinder.get('status', ''),
-            cylinder.get('location', ''),
-            cylinder.get('pressure', ''),
-            cylinder.get('customer_name', ''),
-            dispatch_date,
-            rental_days
-        ])
-    
-    output.seek(0)
-    return Response(
-        output.getvalue(),
-        mimetype='text/csv',
-        headers={'Content-Disposition': f'attachment; filename=complete_database_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'}
-    )
+    try:
+        entry, write = _parquet_entry(table_name)
+        cached = export_cache.not_modified(entry)
+        if cached:
+            return cached
+        
+        filename = f"{table_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.parquet"
+        return export_cache.serve(entry, '.parquet', write, 'application/vnd.apache.parquet', filename)
+    except Exception as e:
+        flash(f'Error exporting {table_name}: {str(e)}', 'error')
+        return redirect(url_for('reports'))
+
+@app.route('/export/parquet/all.zip')
+@login_required
+def export_parquet_bundle():
+    """Export customers, cylinders and rental history as a ZIP of Parquet files"""
+    if not PARQUET_AVAILABLE:
+        flash('Parquet export requires the pyarrow package', 'error')
+        return redirect(url_for('reports'))
+    
+    try:
+        entry = export_cache.entry_name('parquet_bundle', tuple(PARQUET_TABLES))
+        cached = export_cache.not_modified(entry)
+        if cached:
+            return cached
+        
+        def write(path):
+            # Bundle is assembled from the per-table cache entries, building only what is missing.
+            # Every table file is opened before zipping, so building a later table can't evict an earlier one.
+            table_files = {}
+            try:
+                for name in PARQUET_TABLES:
+                    table_entry, write_parquet = _parquet_entry(name)
+                    table_files[name] = export_cache.open_entry(table_entry, '.parquet', write_parquet)
+                write_bundle(table_files, path)
+            finally:
+                for f in table_files.values():
+                    f.close()
+        
+        filename = f"oxygen_tracker_parquet_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+        return export_cache.serve(entry, '.zip', write, 'application/zip', filename)
+    except Exception as e:
+        flash(f'Error exporting Parquet bundle: {str(e)}', 'error')
+        return redirect(url_for('reports'))
 
 @app.route('/export/customer-report', methods=['POST'])
 @login_required
 def export_customer_report():
     """Export individual customer report with dispatched cylinders sorted by rental days"""
+    from customer_reports import load_report_data, safe_customer_name
+    
     customer_id = request.form.get('customer_id')
     export_format = request.form.get('export_format', 'csv')
     
@@ -2293,239 +2370,72 @@ def export_customer_report():
         flash('Please select a customer', 'error')
         return redirect(url_for('reports'))
     
-    customer_model = Customer()
-    cylinder_model = Cylinder()
-    
-    # Get customer details
-    customer = customer_model.get_by_id(customer_id)
-    if not customer:
+    # Customer, their cylinders (longest rentals first) and past rentals
+    report_data = load_report_data([customer_id])
+    if not report_data:
         flash('Customer not found', 'error')
         return redirect(url_for('reports'))
+    customer, customer_cylinders, history = report_data[0]
     
-    # Get all cylinders dispatched to this customer
-    all_cylinders = cylinder_model.get_all()
-    customer_cylinders = [c for c in all_cylinders if c.get('rented_to') == customer_id]
-    
-    # Add rental days and sort by descending rental days
-    for cylinder in customer_cylinders:
-        cylinder['rental_days'] = cylinder_model.get_rental_days(cylinder)
-    
-    # Sort by rental days descending (longest rentals first)
-    customer_cylinders.sort(key=lambda x: x.get('rental_days', 0), reverse=True)
-    
-    customer_name = customer.get('customer_name') or customer.get('name', 'Unknown Customer')
-    safe_filename = customer_name.replace(' ', '_').replace('/', '_')
+    safe_filename = safe_customer_name(customer)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     
     if export_format == 'pdf':
-        return export_customer_pdf(customer, customer_cylinders, safe_filename, timestamp)
+        return export_customer_pdf(customer, customer_cylinders, history, safe_filename, timestamp)
     else:  # Default to CSV
-        return export_customer_csv(customer, customer_cylinders, safe_filename, timestamp)
+        return export_customer_csv(customer, customer_cylinders, history, safe_filename, timestamp)
 
-def export_customer_csv(customer, customer_cylinders, safe_filename, timestamp):
+def export_customer_csv(customer, customer_cylinders, history, safe_filename, timestamp):
     """Export customer report as CSV"""
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    customer_name = customer.get('customer_name') or customer.get('name', 'Unknown Customer')
-    
-    # Customer details header
-    writer.writerow([f'=== CUSTOMER REPORT: {customer_name} ==='])
-    writer.writerow(['Generated:', datetime.now().strftime('%Y-%m-%d %H:%M:%S')])
-    writer.writerow([])
-    
-    # Customer information
-    writer.writerow(['=== CUSTOMER DETAILS ==='])
-    writer.writerow(['Customer No:', customer.get('customer_no', '')])
-    writer.writerow(['Name:', customer_name])
-    writer.writerow(['Phone:', customer.get('customer_phone') or customer.get('phone', '')])
-    writer.writerow(['Email:', customer.get('customer_email') or customer.get('email', '')])
-    writer.writerow(['Address:', customer.get('customer_address') or customer.get('address', '')])
-    writer.writerow(['City:', customer.get('customer_city', '')])
-    writer.writerow(['State:', customer.get('customer_state', '')])
-    writer.writerow(['Total Dispatched Cylinders:', len(customer_cylinders)])
-    writer.writerow([])
-    
-    # Dispatched cylinders sorted by rental days
-    writer.writerow(['=== DISPATCHED CYLINDERS (Sorted by Days Dispatched - Longest First) ==='])
-    writer.writerow(['ID', 'Serial Number', 'Type', 'Size', 'Status', 
-                    'Date Dispatched', 'Days Dispatched', 'Location', 'Pressure'])
-    
-    cylinder_model = Cylinder()
-    for cylinder in customer_cylinders:
-        display_id = cylinder_model.get_display_id(cylinder)
-        # Format dispatch date properly
-        dispatch_date = cylinder.get('date_borrowed', '') or cylinder.get('rental_date', '')
-        if dispatch_date and len(dispatch_date) >= 10:
-            dispatch_date = dispatch_date[:10]  # Extract YYYY-MM-DD part
-        
-        writer.writerow([
-            display_id,
-            cylinder.get('serial_number', ''),
-            cylinder.get('type', ''),
-            cylinder.get('size', ''),
-            cylinder.get('status', ''),
-            dispatch_date,
-            cylinder.get('rental_days', 0),
-            cylinder.get('location', ''),
-            cylinder.get('pressure', '')
-        ])
-    
-    # Summary statistics
-    writer.writerow([])
-    writer.writerow(['=== SUMMARY STATISTICS ==='])
-    if customer_cylinders:
-        total_days = sum(c.get('rental_days', 0) for c in customer_cylinders)
-        avg_days = total_days // len(customer_cylinders) if customer_cylinders else 0
-        longest_rental = max(c.get('rental_days', 0) for c in customer_cylinders)
-        long_term_count = len([c for c in customer_cylinders if c.get('rental_days', 0) > 90])
-        
-        writer.writerow(['Total Cylinders:', len(customer_cylinders)])
-        writer.writerow(['Average Days Dispatched:', avg_days])
-        writer.writerow(['Longest Dispatch (Days):', longest_rental])
-        writer.writerow(['Long-term Dispatches (90+ days):', long_term_count])
-    else:
-        writer.writerow(['No cylinders currently dispatched to this customer'])
+    from customer_reports import render_customer_csv
     
-    output.seek(0)
     return Response(
-        output.getvalue(),
+        render_customer_csv(customer, customer_cylinders, history),
         mimetype='text/csv',
         headers={'Content-Disposition': f'attachment; filename=customer_report_{safe_filename}_{timestamp}.csv'}
     )
 
-
-
-def export_customer_pdf(customer, customer_cylinders, safe_filename, timestamp):
+def export_customer_pdf(customer, customer_cylinders, history, safe_filename, timestamp):
     """Export customer report as PDF"""
-    try:
-        from reportlab.lib.pagesizes import letter, A4
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib import colors
-        from reportlab.lib.units import inch
-        import io
-        
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
-        
-        # Build story
-        story = []
-        styles = getSampleStyleSheet()
-        
-        # Title
-        customer_name = customer.get('customer_name') or customer.get('name', 'Unknown Customer')
-        title_style = ParagraphStyle('CustomTitle', parent=styles['Heading1'], fontSize=18, spaceAfter=30)
-        story.append(Paragraph(f"Customer Report: {customer_name}", title_style))
-        story.append(Paragraph(f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", styles['Normal']))
-        story.append(Spacer(1, 20))
-        
-        # Customer Details
-        story.append(Paragraph("Customer Details", styles['Heading2']))
-        customer_data = [
-            ['Customer No:', customer.get('customer_no', '')],
-            ['Name:', customer_name],
-            ['Phone:', customer.get('customer_phone') or customer.get('phone', '')],
-            ['Email:', customer.get('customer_email') or customer.get('email', '')],
-            ['Address:', customer.get('customer_address') or customer.get('address', '')],
-            ['City:', customer.get('customer_city', '')],
-            ['State:', customer.get('customer_state', '')],
-            ['Total Dispatched Cylinders:', str(len(customer_cylinders))]
-        ]
-        
-        customer_table = Table(customer_data, colWidths=[2*inch, 4*inch])
-        customer_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
-            ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-            ('BACKGROUND', (1, 0), (1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        story.append(customer_table)
-        story.append(Spacer(1, 20))
-        
-        # Dispatched Cylinders
-        if customer_cylinders:
-            story.append(Paragraph("Dispatched Cylinders (Sorted by Days Dispatched)", styles['Heading2']))
-            
-            cylinder_data = [['ID', 'Type', 'Size', 'Days Dispatched', 'Date Dispatched']]
-            cylinder_model = Cylinder()
-            for cylinder in customer_cylinders:
-                display_id = cylinder_model.get_display_id(cylinder)
-                cylinder_data.append([
-                    str(display_id),
-                    str(cylinder.get('type', '')),
-                    str(cylinder.get('size', '')),
-                    str(cylinder.get('rental_days', 0)),
-                    str(cylinder.get('date_borrowed', ''))
-                ])
-            
-            cylinder_table = Table(cylinder_data, colWidths=[1*inch, 1.5*inch, 1.2*inch, 1.5*inch, 1.8*inch])
-            cylinder_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            story.append(cylinder_table)
-            story.append(Spacer(1, 20))
-            
-            # Summary Statistics
-            story.append(Paragraph("Summary Statistics", styles['Heading2']))
-            total_days = sum(c.get('rental_days', 0) for c in customer_cylinders)
-            avg_days = total_days // len(customer_cylinders) if customer_cylinders else 0
-            longest_rental = max(c.get('rental_days', 0) for c in customer_cylinders)
-            long_term_count = len([c for c in customer_cylinders if c.get('rental_days', 0) > 90])
-            
-            summary_data = [
-                ['Total Cylinders:', str(len(customer_cylinders))],
-                ['Average Days Dispatched:', str(avg_days)],
-                ['Longest Dispatch (Days):', str(longest_rental)],
-                ['Long-term Dispatches (90+ days):', str(long_term_count)]
-            ]
-            
-            summary_table = Table(summary_data, colWidths=[3*inch, 2*inch])
-            summary_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
-                ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-                ('FONTSIZE', (0, 0), (-1, -1), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-                ('BACKGROUND', (1, 0), (1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            story.append(summary_table)
-        else:
-            story.append(Paragraph("No cylinders currently dispatched to this customer", styles['Normal']))
-        
-        # Build PDF
-        doc.build(story)
-        buffer.seek(0)
-        
-        return Response(
-            buffer.getvalue(),
-            mimetype='application/pdf',
-            headers={'Content-Disposition': f'attachment; filename=customer_report_{safe_filename}_{timestamp}.pdf'}
-        )
+    from customer_reports import render_customer_pdf
     
-    except ImportError:
-        flash('PDF generation not available. Please use CSV format.', 'error')
-        return redirect(url_for('reports'))
+    return Response(
+        render_customer_pdf(customer, customer_cylinders, history),
+        mimetype='application/pdf',
+        headers={'Content-Disposition': f'attachment; filename=customer_report_{safe_filename}_{timestamp}.pdf'}
+    )
+
+@app.route('/export/customer-reports.zip', methods=['POST'])
+@login_required
+def export_all_customer_reports():
+    """Export every customer's report (CSV or PDF) as one streamed ZIP"""
+    from customer_reports import generate_customer_reports_zip
+    
+    export_format = request.form.get('export_format', 'csv')
+    if export_format not in ('csv', 'pdf'):
+        export_format = 'csv'
+    
+    filename = f'customer_reports_{export_format}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.zip'
+    entry = export_cache.entry_name('customer_reports', ('customers', 'cylinders', 'rental_history'),
+                                    {'format': export_format})
+    cached = export_cache.send(entry, '.zip', 'application/zip', filename)
+    if cached:
+        return cached
+    
+    response = Response(
+        export_cache.tee(entry, '.zip', generate_customer_reports_zip(export_format)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+    response.set_etag(entry)
+    response.cache_control.no_cache = True
+    return response
 
 # Data Management Routes
 @app.route('/admin/reset-data')
 @login_required
 def reset_data_page():
     """Show data reset confirmation page"""
-    user_manager = UserManager()
     user = user_manager.get_user_by_id(session['user_id'])
     
     # Only admins can reset data
@@ -2551,7 +2461,6 @@ def reset_data_page():
 @login_required
 def reset_data_confirm():
     """Reset all customer and cylinder data with backup"""
-    user_manager = UserManager()
     user = user_manager.get_user_by_id(session['user_id'])
     
     # Only admins can reset data
@@ -2590,7 +2499,6 @@ def reset_data_confirm():
 @login_required
 def manual_backup():
     """Create manual backup of all data"""
-    user_manager = UserManager()
     user = user_manager.get_user_by_id(session['user_id'])
     
     # Only admins can create backups
@@ -2610,445 +2518,208 @@ def manual_backup():
     return redirect(url_for('index'))
 
 def create_manual_backup(backup_type='manual'):
-    """Create backup of all data files"""
+    """Create a consistent, compressed snapshot of the database"""
     try:
-        # Create backups directory if it doesn't exist
-        backup_dir = 'backups'
-        if not os.path.exists(backup_dir):
-            os.makedirs(backup_dir)
-        
-        # Create timestamped backup directory
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_subdir = os.path.join(backup_dir, f'{backup_type}_backup_{timestamp}')
-        os.makedirs(backup_subdir)
-        
-        # Backup data files
-        data_files = ['customers.json', 'cylinders.json', 'users.json']
-        for file in data_files:
-            src_path = os.path.join('data', file)
-            if os.path.exists(src_path):
-                dst_path = os.path.join(backup_subdir, file)
-                shutil.copy2(src_path, dst_path)
-        
-        # Create backup info file
-        info_file = os.path.join(backup_subdir, 'backup_info.json')
-        backup_info = {
-            'backup_type': backup_type,
-            'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'files_backed_up': data_files,
-            'system': 'Varasai Oxygen'
-        }
-        with open(info_file, 'w') as f:
-            json.dump(backup_info, f, indent=2)
-        
+        manifest = backup_engine.create_backup(backup_type)
+        print(f"Backup created: {manifest['path']} ({sum(manifest['tables'].values())} rows)")
         return True
     except Exception as e:
         print(f"Backup creation failed: {str(e)}")
         return False
 
-# Auto-backup system
-class AutoBackupManager:
-    """Manages automatic backup system"""
-    
-    def __init__(self):
-        self.backup_interval = 14 * 24 * 60 * 60  # 2 weeks in seconds
-        self.last_backup_file = 'data/last_backup.json'
-        self.running = False
-        self.thread = None
-    
-    def start_auto_backup(self):
-        """Start the automatic backup system"""
-        if not self.running:
-            self.running = True
-            self.thread = threading.Thread(target=self._backup_loop, daemon=True)
-            self.thread.start()
-    
-    def stop_auto_backup(self):
-        """Stop the automatic backup system"""
-        self.running = False
-    
-    def _backup_loop(self):
-        """Main backup loop running in background"""
-        while self.running:
-            try:
-                if self._should_create_backup():
-                    self._create_auto_backup()
-                # Check every hour
-                time.sleep(3600)
-            except Exception as e:
-                print(f"Auto-backup error: {str(e)}")
-                time.sleep(3600)  # Wait an hour before trying again
-    
-    def _should_create_backup(self):
-        """Check if backup should be created"""
-        try:
-            if not os.path.exists(self.last_backup_file):
-                return True
-            
-            with open(self.last_backup_file, 'r') as f:
-                last_backup_info = json.load(f)
-            
-            last_backup_time = datetime.strptime(
-                last_backup_info['last_backup'], 
-                '%Y-%m-%d %H:%M:%S'
-            )
-            
-            time_since_backup = datetime.now() - last_backup_time
-            return time_since_backup.total_seconds() >= self.backup_interval
-            
-        except Exception:
-            return True  # If can't read file, assume backup needed
-    
-    def _create_auto_backup(self):
-        """Create automatic backup"""
-        try:
-            backup_created = create_manual_backup('auto')
-            if backup_created:
-                # Update last backup time
-                backup_info = {
-                    'last_backup': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'backup_type': 'automatic',
-                    'next_backup': (datetime.now() + timedelta(days=14)).strftime('%Y-%m-%d %H:%M:%S')
-                }
-                
-                # Ensure data directory exists
-                if not os.path.exists('data'):
-                    os.makedirs('data')
-                
-                with open(self.last_backup_file, 'w') as f:
-                    json.dump(backup_info, f, indent=2)
-                
-                print(f"Auto-backup created successfully at {datetime.now()}")
-        except Exception as e:
-            print(f"Auto-backup failed: {str(e)}")
+# Background jobs (backups, history cleanup, rollups, cache warmers) run on
+# whichever worker wins the scheduler's leader election
+scheduler.start()
+
+def is_admin_session():
+    """True if the current session belongs to an admin"""
+    user = user_manager.get_user_by_id(session['user_id']) if 'user_id' in session else None
+    return bool(user) and user.get('role') == 'admin'
 
-# Initialize auto-backup system
-auto_backup_manager = AutoBackupManager()
+# Per-request query counts, query budget and N+1 warnings
+monitor.instrument_engines()
+monitor.init_app(app)
+
+# Admins can profile a single request with "X-Profile: 1" or "?_profile=1"
+request_profiler.init_app(app, is_admin_session)
+
+@app.before_request
+def restore_primary_pin():
+    """Read-your-writes across redirects: keep reads on the primary right after this user wrote"""
+    if replica_engine is not None:
+        pin_to_primary(session.get('_primary_until', 0.0))
+
+@app.after_request
+def remember_primary_pin(response):
+    """Carry the primary pin of a write request over to the user's next requests"""
+    if replica_engine is not None and primary_pinned_until() > session.get('_primary_until', 0.0):
+        session['_primary_until'] = primary_pinned_until()
+    return response
+
+@app.route('/admin/performance')
+@admin_required
+def admin_performance():
+    """Route and query latency percentiles across all workers"""
+    from performance_monitor import QUERY_BUDGET, N_PLUS_ONE_THRESHOLD
+    return render_template('admin/performance.html',
+                           latencies=monitor.get_latency_summaries(),
+                           endpoints=monitor.get_endpoint_stats(),
+                           stats=monitor.get_performance_stats(),
+                           slow_queries=slow_query_log.recent(20),
+                           query_budget=QUERY_BUDGET,
+                           n_plus_one_threshold=N_PLUS_ONE_THRESHOLD,
+                           pid=os.getpid())
+
+@app.route('/admin/performance/endpoints')
+@admin_required
+def performance_endpoints():
+    """Per-endpoint query counts and database time for this worker (JSON)"""
+    from performance_monitor import QUERY_BUDGET, N_PLUS_ONE_THRESHOLD
+    return jsonify({
+        'pid': os.getpid(),
+        'query_budget': QUERY_BUDGET,
+        'n_plus_one_threshold': N_PLUS_ONE_THRESHOLD,
+        'endpoints': monitor.get_endpoint_stats(),
+    })
+
+@app.route('/admin/performance/metrics')
+def performance_metrics():
+    """Latency summaries in Prometheus text format
+    
+    Open to admins, or to scrapers sending "Authorization: Bearer <METRICS_TOKEN>".
+    """
+    from performance_monitor import render_metrics
+    token = os.environ.get('METRICS_TOKEN')
+    authorized = token and request.headers.get('Authorization') == f'Bearer {token}'
+    if not authorized and not is_admin_session():
+        return Response('Forbidden\n', status=403, mimetype='text/plain')
+    return Response(render_metrics(monitor.get_latency_summaries()),
+                    mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/profiles')
+@admin_required
+def admin_profiles():
+    """Recent request profiles"""
+    from profiler import PROFILE_HEADER, PROFILE_QUERY_FLAG
+    return render_template('admin/profiles.html', profiles=request_profiler.list_profiles(),
+                           profile_header=PROFILE_HEADER, profile_query_flag=PROFILE_QUERY_FLAG)
 
-# Start auto-backup when app starts (using app context)
-def initialize_auto_backup():
-    """Initialize automatic backup system"""
-    auto_backup_manager.start_auto_backup()
+@app.route('/admin/profiles/<name>')
+@admin_required
+def download_profile(name):
+    """Download a profile as a collapsed-stack file (flamegraph.pl / speedscope input)"""
+    path = request_profiler.get_path(name)
+    if not path:
+        flash('Profile not found', 'error')
+        return redirect(url_for('admin_profiles'))
+    return send_file(os.path.abspath(path), mimetype='text/plain', as_attachment=True,
+                     download_name=f'{name}.collapsed')
+
+@app.route('/admin/performance/clear', methods=['POST'])
+@admin_required
+def clear_performance():
+    """Reset the collected performance data"""
+    from performance_monitor import clear_performance_data
+    clear_performance_data()
+    flash('Performance data cleared', 'success')
+    return redirect(url_for('admin_performance'))
+
+@app.route('/admin/scheduler')
+@admin_required
+def admin_scheduler():
+    """Background job status"""
+    if request.args.get('format') == 'json':
+        return jsonify(scheduler.status())
+    return render_template('admin/scheduler.html', status=scheduler.status())
 
-# Initialize auto-backup at import time
-with app.app_context():
-    initialize_auto_backup()
+@app.route('/admin/scheduler/<job_name>/run', methods=['POST'])
+@admin_required
+def run_scheduler_job(job_name):
+    """Queue an immediate run of a background job"""
+    try:
+        scheduler.request_run(job_name)
+        flash(f'{job_name} will run within a minute', 'success')
+    except ValueError as e:
+        flash(str(e), 'error')
+    return redirect(url_for('admin_scheduler'))
 
 # PDF Export Routes
+def start_pdf_export(report_type):
+    """Queue a background PDF report and send the user to its job page"""
+    try:
+        job_id = pdf_engine.submit(report_type)
+    except Exception as e:
+        flash(f'Error starting PDF export: {str(e)}', 'error')
+        return redirect(url_for('reports'))
+    return redirect(url_for('export_job_status', job_id=job_id))
+
 @app.route('/export/customers.pdf')
 @login_required
 def export_customers_pdf():
     """Export all customers to PDF"""
-    customer_model = Customer()
-    customers = customer_model.get_all()
-    
-    # Create PDF buffer
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter, 
-                           rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
-    
-    # Container for the PDF elements
-    story = []
-    styles = getSampleStyleSheet()
-    
-    # Title
-    title = Paragraph("Varasai Oxygen - Customer Report", styles['Title'])
-    story.append(title)
-    story.append(Spacer(1, 12))
-    
-    # Date and summary
-    date_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    date_para = Paragraph(f"Generated on: {date_str}", styles['Normal'])
-    story.append(date_para)
-    
-    summary_para = Paragraph(f"Total Customers: {len(customers)}", styles['Normal'])
-    story.append(summary_para)
-    story.append(Spacer(1, 12))
-    
-    # Customer table
-    if customers:
-        data = [['Customer No', 'Name', 'Email', 'Phone', 'Address', 'City', 'State']]
-        for customer in customers:
-            data.append([
-                customer.get('customer_no', '')[:15],
-                (customer.get('customer_name', '') or customer.get('name', ''))[:25],  # Truncate long names
-                (customer.get('customer_email', '') or customer.get('email', ''))[:30],
-                (customer.get('customer_phone', '') or customer.get('phone', ''))[:15],
-                (customer.get('customer_address', '') or customer.get('address', ''))[:25],
-                customer.get('customer_city', '')[:15],
-                customer.get('customer_state', '')[:10]
-            ])
-        
-        table = Table(data)
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('FONTSIZE', (0, 1), (-1, -1), 9),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        story.append(table)
-    
-    # Build PDF
-    doc.build(story)
-    buffer.seek(0)
-    
-    return Response(
-        buffer.getvalue(),
-        mimetype='application/pdf',
-        headers={'Content-Disposition': f'attachment; filename=customers_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'}
-    )
+    return start_pdf_export('customers')
 
 @app.route('/export/cylinders.pdf')
 @login_required
 def export_cylinders_pdf():
     """Export all cylinders to PDF"""
-    cylinder_model = Cylinder()
-    cylinders = cylinder_model.get_all()
-    
-    # Create PDF buffer
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter,
-                           rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
-    
-    # Container for the PDF elements
-    story = []
-    styles = getSampleStyleSheet()
-    
-    # Title
-    title = Paragraph("Varasai Oxygen - Cylinder Inventory Report", styles['Title'])
-    story.append(title)
-    story.append(Spacer(1, 12))
-    
-    # Date and summary
-    date_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    date_para = Paragraph(f"Generated on: {date_str}", styles['Normal'])
-    story.append(date_para)
-    
-    summary_para = Paragraph(f"Total Cylinders: {len(cylinders)}", styles['Normal'])
-    story.append(summary_para)
-    
-    # Status breakdown
-    status_counts = {}
-    for cylinder in cylinders:
-        status = cylinder.get('status', 'Unknown')
-        status_counts[status] = status_counts.get(status, 0) + 1
-    
-    status_text = " | ".join([f"{status}: {count}" for status, count in status_counts.items()])
-    status_para = Paragraph(f"Status Breakdown: {status_text}", styles['Normal'])
-    story.append(status_para)
-    story.append(Spacer(1, 12))
-    
-    # Cylinder table
-    if cylinders:
-        data = [['ID', 'Type', 'Size', 'Status', 'Location', 'Customer']]
-        for cylinder in cylinders:
-            # Use custom ID if available, otherwise fallback to generated serial
-            display_id = cylinder_model.get_display_id(cylinder)
-            
-            data.append([
-                display_id[:15],
-                cylinder.get('type', '')[:15],
-                cylinder.get('size', '')[:12],
-                cylinder.get('status', '')[:10],
-                cylinder.get('location', '')[:15],
-                cylinder.get('customer_name', '')[:15]
-            ])
-        
-        table = Table(data)
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('FONTSIZE', (0, 1), (-1, -1), 8),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        story.append(table)
-    
-    # Build PDF
-    doc.build(story)
-    buffer.seek(0)
-    
-    return Response(
-        buffer.getvalue(),
-        mimetype='application/pdf',
-        headers={'Content-Disposition': f'attachment; filename=cylinders_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'}
-    )
+    return start_pdf_export('cylinders')
 
 @app.route('/export/rental-activities.pdf')
 @login_required
 def export_rental_activities_pdf():
     """Export rental activities to PDF"""
-    cylinder_model = Cylinder()
-    customer_model = Customer()
-    cylinders = cylinder_model.get_all()
-    customers = customer_model.get_all()
-    
-    # Create customer lookup
-    customer_lookup = {c['id']: c for c in customers}
-    
-    # Filter cylinders with rental history
-    rental_cylinders = [c for c in cylinders if c.get('rented_to') or c.get('date_borrowed')]
-    
-    # Create PDF buffer
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter,
-                           rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
-    
-    # Container for the PDF elements
-    story = []
-    styles = getSampleStyleSheet()
-    
-    # Title
-    title = Paragraph("Varasai Oxygen - Rental Activities Report", styles['Title'])
-    story.append(title)
-    story.append(Spacer(1, 12))
-    
-    # Date and summary
-    date_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    date_para = Paragraph(f"Generated on: {date_str}", styles['Normal'])
-    story.append(date_para)
-    
-    summary_para = Paragraph(f"Total Rental Activities: {len(rental_cylinders)}", styles['Normal'])
-    story.append(summary_para)
-    story.append(Spacer(1, 12))
-    
-    # Rental activities table
-    if rental_cylinders:
-        data = [['Cylinder', 'Type', 'Customer', 'Date Borrowed', 'Status', 'Days']]
-        for i, cylinder in enumerate(rental_cylinders):
-            customer = customer_lookup.get(cylinder.get('rented_to', ''), {})
-            rental_days = cylinder_model.get_rental_days(cylinder)
-            
-            # Generate display serial number
-            cylinder_type = cylinder.get('type', 'Other')
-            display_serial = cylinder_model.get_serial_number(cylinder_type, i + 1)
-            
-            date_borrowed = cylinder.get('date_borrowed', '')
-            if date_borrowed:
-                try:
-                    date_obj = datetime.fromisoformat(date_borrowed.replace('Z', '+00:00'))
-                    date_borrowed = date_obj.strftime('%Y-%m-%d')
-                except:
-                    pass
-            
-            data.append([
-                display_serial,
-                cylinder.get('type', '')[:12],
-                (customer.get('customer_name', '') or customer.get('name', ''))[:15],
-                date_borrowed[:10],
-                cylinder.get('status', '')[:10],
-                str(rental_days)
-            ])
-        
-        table = Table(data)
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('FONTSIZE', (0, 1), (-1, -1), 8),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        story.append(table)
-    
-    # Build PDF
-    doc.build(story)
-    buffer.seek(0)
-    
-    return Response(
-        buffer.getvalue(),
-        mimetype='application/pdf',
-        headers={'Content-Disposition': f'attachment; filename=rental_activities_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'}
-    )
+    return start_pdf_export('rental_activities')
+
+@app.route('/export/jobs/<job_id>')
+@login_required
+def export_job_status(job_id):
+    """Show (or return as JSON) the status of a background PDF export"""
+    try:
+        status = pdf_engine.status(job_id)
+    except ValueError:
+        flash('Export job not found', 'error')
+        return redirect(url_for('reports'))
+
+    if request.args.get('format') == 'json':
+        return jsonify({'job_id': job_id, **status})
+
+    return render_template('export_job.html', job_id=job_id, status=status)
+
+@app.route('/export/jobs/<job_id>/download')
+@login_required
+def download_export_job(job_id):
+    """Download a finished PDF export"""
+    try:
+        ready = pdf_engine.file_path(job_id) is not None
+    except ValueError:
+        ready = False
+
+    report_type = job_id.rsplit('-', 1)[0]
+    response = export_cache.send(job_id, '.pdf', 'application/pdf',
+                                 f'{report_type}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf') if ready else None
+    if not response:
+        flash('Export is not ready yet', 'warning')
+        return redirect(url_for('export_job_status', job_id=job_id))
+    return response
 
 
 @app.route('/export/rental_history')
 @login_required
 def export_rental_history():
     """Export complete rental history to Excel"""
-    import io
-    from openpyxl import Workbook
-    from db_service import RentalHistoryService
+    from xlsx_reports import write_rental_history
     
     try:
-        with RentalHistoryService() as service:
-            all_history, _ = service.get_all()  # Get all history
-        
-        workbook = Workbook()
-        
-        # Create separate sheets for active and past rentals
-        active_sheet = workbook.active
-        active_sheet.title = "Active Rentals"
-        past_sheet = workbook.create_sheet("Past Rentals")
-        
-        # Headers
-        headers = [
-            'Customer No', 'Customer Name', 'Customer Phone', 'Customer Address',
-            'Cylinder ID', 'Cylinder Type', 'Cylinder Size', 
-            'Dispatch Date', 'Return Date', 'Rental Days'
-        ]
-        
-        # Active rentals sheet
-        for col, header in enumerate(headers, 1):
-            active_sheet.cell(row=1, column=col, value=header)
-        
-        row = 2
-        for record in all_history['active']:
-            active_sheet.cell(row=row, column=1, value=record.get('customer_no', ''))
-            active_sheet.cell(row=row, column=2, value=record.get('customer_name', ''))
-            active_sheet.cell(row=row, column=3, value=record.get('customer_phone', ''))
-            active_sheet.cell(row=row, column=4, value=record.get('customer_address', ''))
-            active_sheet.cell(row=row, column=5, value=record.get('cylinder_custom_id', '') or record.get('cylinder_serial', ''))
-            active_sheet.cell(row=row, column=6, value=record.get('cylinder_type', ''))
-            active_sheet.cell(row=row, column=7, value=record.get('cylinder_size', ''))
-            active_sheet.cell(row=row, column=8, value=record.get('date_borrowed', '')[:10] if record.get('date_borrowed') else '')
-            active_sheet.cell(row=row, column=9, value='')  # No return date for active
-            active_sheet.cell(row=row, column=10, value=record.get('rental_days', 0))
-            row += 1
-        
-        # Past rentals sheet
-        for col, header in enumerate(headers, 1):
-            past_sheet.cell(row=1, column=col, value=header)
-        
-        row = 2
-        for record in all_history['past']:
-            past_sheet.cell(row=row, column=1, value=record.get('customer_no', ''))
-            past_sheet.cell(row=row, column=2, value=record.get('customer_name', ''))
-            past_sheet.cell(row=row, column=3, value=record.get('customer_phone', ''))
-            past_sheet.cell(row=row, column=4, value=record.get('customer_address', ''))
-            past_sheet.cell(row=row, column=5, value=record.get('cylinder_custom_id', '') or record.get('cylinder_serial', ''))
-            past_sheet.cell(row=row, column=6, value=record.get('cylinder_type', ''))
-            past_sheet.cell(row=row, column=7, value=record.get('cylinder_size', ''))
-            past_sheet.cell(row=row, column=8, value=record.get('date_borrowed', '')[:10] if record.get('date_borrowed') else '')
-            past_sheet.cell(row=row, column=9, value=record.get('date_returned', '')[:10] if record.get('date_returned') else '')
-            past_sheet.cell(row=row, column=10, value=record.get('rental_days', 0))
-            row += 1
-        
-        # Save to memory
-        output = io.BytesIO()
-        workbook.save(output)
-        output.seek(0)
+        entry = export_cache.entry_name('rental_history_xlsx', ('cylinders', 'customers', 'rental_history'))
+        cached = export_cache.not_modified(entry)
+        if cached:
+            return cached
         
+        # Workbook is written straight to a cache file, never held in memory
         filename = f"rental_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        return export_cache.serve(entry, '.xlsx', write_rental_history,
+                                  'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', filename)
         
     except Exception as e:
         flash(f'Error exporting rental history: {str(e)}', 'error')
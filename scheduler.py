@@ -0,0 +1,412 @@
+# scheduler.py - Single-leader background job scheduler
+"""
+Periodic background jobs, run by exactly one process
+
+Every gunicorn worker imports routes.py and calls scheduler.start(), but
+only the worker that wins leader election runs jobs; the others retry the
+election every minute in case the leader exits. Leadership is held with
+a Postgres advisory lock on a dedicated connection when the database is
+Postgres (works across hosts), otherwise with an flock on a lock file
+(works across workers on one host). Either is released automatically
+when the holding process dies.
+
+Jobs run one at a time on the scheduler thread with lowered CPU and I/O
+priority. Per-job timing and last-run status are written to
+data/scheduler_state.json so any worker can show them on /admin/scheduler.
+Admins can queue an immediate run; the request is left as a file that the
+leader picks up on its next tick.
+
+Set SCHEDULER_ENABLED=0 to keep a process out of the election entirely
+(scripts, one-off shells).
+"""
+
+import fcntl
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import text
+
+from backup_engine import lower_thread_priority
+from db_models import engine
+
+logger = logging.getLogger(__name__)
+
+# Seconds between scheduler ticks (due-job checks and leader heartbeats)
+TICK_SECONDS = 30
+
+# Non-leaders retry the election this often
+ELECTION_RETRY_SECONDS = 60
+
+# Arbitrary constant identifying this app's advisory lock
+ADVISORY_LOCK_KEY = 727_114_001
+
+
+class Job:
+    """A named function run every interval seconds"""
+
+    def __init__(self, name: str, interval: int, func: Callable[[], Optional[str]], description: str = ''):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.description = description
+
+
+class LeaderLock:
+    """Non-blocking leader election; held until release() or process exit"""
+
+    def __init__(self, lock_path: str):
+        self.lock_path = lock_path
+        self._file = None
+        self._connection = None
+
+    @property
+    def kind(self) -> str:
+        return 'advisory lock' if engine.dialect.name == 'postgresql' else 'file lock'
+
+    def acquire(self) -> bool:
+        if engine.dialect.name == 'postgresql':
+            return self._acquire_advisory()
+        return self._acquire_file()
+
+    def _acquire_file(self) -> bool:
+        os.makedirs(os.path.dirname(self.lock_path) or '.', exist_ok=True)
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        return True
+
+    def _acquire_advisory(self) -> bool:
+        connection = engine.connect()
+        try:
+            acquired = connection.execute(text('SELECT pg_try_advisory_lock(:key)'), {'key': ADVISORY_LOCK_KEY}).scalar()
+            connection.commit()
+        except Exception:
+            connection.close()
+            raise
+        if not acquired:
+            connection.close()
+            return False
+        self._connection = connection
+        return True
+
+    def still_held(self) -> bool:
+        """False if the advisory lock connection was lost (the lock went with it)"""
+        if self._connection is None:
+            return self._file is not None
+        try:
+            self._connection.execute(text('SELECT 1'))
+            self._connection.commit()
+            return True
+        except Exception:
+            self.release()
+            return False
+
+    def release(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
+
+class Scheduler:
+    """Run registered jobs on the elected leader process"""
+
+    def __init__(self, data_dir: str = 'data'):
+        self.data_dir = data_dir
+        self.state_file = os.path.join(data_dir, 'scheduler_state.json')
+        self.request_dir = os.path.join(data_dir, 'scheduler_requests')
+        self.lock = LeaderLock(os.path.join(data_dir, 'scheduler.lock'))
+        self.jobs: Dict[str, Job] = {}
+        self.is_leader = False
+        self.running = False
+        self.thread = None
+        self._state = None
+
+    def register(self, name: str, interval: int, description: str = ''):
+        """Decorator registering a job function"""
+        def decorator(func):
+            self.jobs[name] = Job(name, interval, func, description)
+            return func
+        return decorator
+
+    def start(self):
+        """Start the election/scheduling thread (once per process)"""
+        if self.running or os.environ.get('SCHEDULER_ENABLED', '1') == '0':
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def _loop(self):
+        lower_thread_priority()
+        while self.running:
+            try:
+                if not self.is_leader:
+                    self.is_leader = self.lock.acquire()
+                    if self.is_leader:
+                        self._become_leader()
+                elif not self.lock.still_held():
+                    logger.warning('Scheduler lost leadership')
+                    self.is_leader = False
+
+                if self.is_leader:
+                    self._run_due_jobs()
+            except Exception as e:
+                logger.error(f"Scheduler error: {e}")
+            time.sleep(TICK_SECONDS if self.is_leader else ELECTION_RETRY_SECONDS)
+
+    def _become_leader(self):
+        self._state = self.read_state()
+        self._state['leader'] = {
+            'pid': os.getpid(),
+            'host': socket.gethostname(),
+            'lock': self.lock.kind,
+            'since': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        self._carry_over_last_backup()
+        # Jobs interrupted by the previous leader's exit are not running any more
+        for job_state in self._state['jobs'].values():
+            if job_state.get('status') == 'running':
+                job_state['status'] = 'interrupted'
+        self._save_state()
+        logger.info(f"Scheduler leader elected: pid {os.getpid()} ({self.lock.kind})")
+
+    def _carry_over_last_backup(self):
+        """Keep the daily backup on the schedule the old per-worker backup thread recorded"""
+        backup_state = self._state['jobs'].setdefault('backup', {})
+        legacy_file = os.path.join(self.data_dir, 'last_backup.json')
+        if 'next_run' in backup_state or not os.path.exists(legacy_file):
+            return
+        try:
+            with open(legacy_file) as f:
+                backup_state['next_run'] = json.load(f)['next_backup']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _run_due_jobs(self):
+        self._state['leader']['heartbeat'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        requested = self._take_run_requests()
+        now = datetime.now()
+        for job in self.jobs.values():
+            job_state = self._state['jobs'].setdefault(job.name, {})
+            next_run = job_state.get('next_run')
+            due = next_run is None or datetime.strptime(next_run, '%Y-%m-%d %H:%M:%S') <= now
+            if due or job.name in requested:
+                self.run_job(job)
+        self._save_state()
+
+    def run_job(self, job: Job):
+        """Run one job now, recording its timing and outcome"""
+        job_state = self._state['jobs'].setdefault(job.name, {})
+        started = datetime.now()
+        job_state.update(status='running', last_started=started.strftime('%Y-%m-%d %H:%M:%S'))
+        self._save_state()
+
+        started_clock = time.monotonic()
+        try:
+            message = job.func()
+            job_state.update(status='ok', message=message or '', error=None)
+        except Exception as e:
+            logger.error(f"Scheduled job {job.name} failed: {e}")
+            job_state.update(status='failed', message='', error=f"{e}\n{traceback.format_exc(limit=5)}")
+
+        finished = datetime.now()
+        job_state.update(
+            last_finished=finished.strftime('%Y-%m-%d %H:%M:%S'),
+            duration=round(time.monotonic() - started_clock, 3),
+            run_count=job_state.get('run_count', 0) + 1,
+            next_run=(finished + timedelta(seconds=job.interval)).strftime('%Y-%m-%d %H:%M:%S'),
+        )
+        self._save_state()
+
+    def request_run(self, job_name: str):
+        """Ask the leader (whichever process it is) to run a job on its next tick"""
+        if job_name not in self.jobs:
+            raise ValueError(f'Unknown job {job_name}')
+        os.makedirs(self.request_dir, exist_ok=True)
+        with open(os.path.join(self.request_dir, job_name), 'w') as f:
+            f.write(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+    def _take_run_requests(self) -> List[str]:
+        if not os.path.isdir(self.request_dir):
+            return []
+        requested = []
+        for name in os.listdir(self.request_dir):
+            os.remove(os.path.join(self.request_dir, name))
+            requested.append(name)
+        return requested
+
+    def read_state(self) -> Dict:
+        """Scheduler state as last saved by the leader"""
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault('leader', None)
+        state.setdefault('jobs', {})
+        return state
+
+    def _save_state(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        tmp_path = f'{self.state_file}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._state, f, indent=2)
+        os.replace(tmp_path, self.state_file)
+
+    def status(self) -> Dict:
+        """Leader and per-job status for the admin page"""
+        state = self.read_state()
+        pending = set(os.listdir(self.request_dir)) if os.path.isdir(self.request_dir) else set()
+        leader = state['leader']
+        if leader and leader.get('heartbeat'):
+            age = datetime.now() - datetime.strptime(leader['heartbeat'], '%Y-%m-%d %H:%M:%S')
+            busy = any(job_state.get('status') == 'running' for job_state in state['jobs'].values())
+            leader['stale'] = not busy and age.total_seconds() > ELECTION_RETRY_SECONDS + 2 * TICK_SECONDS
+        jobs = []
+        for job in self.jobs.values():
+            jobs.append({
+                'name': job.name,
+                'description': job.description,
+                'interval': job.interval,
+                'requested': job.name in pending,
+                **state['jobs'].get(job.name, {}),
+            })
+        return {'leader': leader, 'jobs': jobs, 'this_process': os.getpid(), 'is_leader': self.is_leader}
+
+
+# Global scheduler instance
+scheduler = Scheduler()
+
+
+# Dashboard rollup -----------------------------------------------------------
+
+DASHBOARD_TABLES = ('customers', 'cylinders')
+
+
+def compute_dashboard_rollup() -> Dict:
+    """Dashboard counters computed in SQL"""
+    from db_service import CustomerService, CylinderService, TableVersionService
+
+    with TableVersionService() as service:
+        versions = service.get_versions(DASHBOARD_TABLES)
+    with CylinderService() as service:
+        status_counts = {}
+        for status, count in service.get_status_counts().items():
+            status_counts[status.lower()] = status_counts.get(status.lower(), 0) + count
+        top_customer_count = service.get_top_customer_rental_count()
+    with CustomerService() as service:
+        total_customers = service.count()
+
+    return {
+        'versions': versions,
+        'computed_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'total_customers': total_customers,
+        'total_cylinders': sum(status_counts.values()),
+        'status_counts': status_counts,
+        'top_customer_count': top_customer_count,
+    }
+
+
+def load_dashboard_rollup() -> Dict:
+    """The stored rollup if no customer/cylinder write happened since, else a fresh one"""
+    from db_service import TableVersionService
+
+    path = os.path.join(scheduler.data_dir, 'dashboard_rollup.json')
+    try:
+        with open(path) as f:
+            rollup = json.load(f)
+        with TableVersionService() as service:
+            if rollup['versions'] == service.get_versions(DASHBOARD_TABLES):
+                return rollup
+    except (OSError, ValueError, KeyError):
+        pass
+    return compute_dashboard_rollup()
+
+
+# Jobs -------------------------------------------------------------------------
+
+@scheduler.register('backup', 24 * 60 * 60, 'Incremental backup snapshot and retention pruning')
+def run_backup():
+    from backup_store import backup_store
+
+    snapshot = backup_store.create_snapshot()
+    pruned = backup_store.prune()
+    return (f"Snapshot {snapshot['id']}: {snapshot['new_chunks']} new chunks, "
+            f"{len(pruned['removed_snapshots'])} old snapshots pruned")
+
+
+@scheduler.register('history_cleanup', 24 * 60 * 60, 'Remove rental history older than 6 months')
+def run_history_cleanup():
+    from db_service import RentalHistoryService
+
+    with RentalHistoryService() as service:
+        removed = service.cleanup_old_records()
+    return f'Removed {removed} old records'
+
+
+@scheduler.register('customer_field_reconciler', 60 * 60, 'Repair customer details copied onto rented cylinders')
+def run_customer_field_reconciler():
+    from db_service import CylinderService
+
+    with CylinderService() as service:
+        repaired = service.reconcile_customer_fields()
+    return f'Repaired {repaired} cylinders'
+
+
+@scheduler.register('history_partitions', 24 * 60 * 60, 'Create upcoming monthly rental history partitions')
+def run_history_partitions():
+    from history_partitions import history_partitions
+
+    if not history_partitions.is_partitioned():
+        return 'Rental history is not partitioned'
+    created = history_partitions.ensure_partitions()
+    return f"Created {', '.join(created)}" if created else 'Upcoming partitions already exist'
+
+
+@scheduler.register('dashboard_rollup', 5 * 60, 'Precompute dashboard counters')
+def run_dashboard_rollup():
+    rollup = compute_dashboard_rollup()
+    path = os.path.join(scheduler.data_dir, 'dashboard_rollup.json')
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(rollup, f, indent=2)
+    os.replace(tmp_path, path)
+    return f"{rollup['total_cylinders']} cylinders, {rollup['total_customers']} customers"
+
+
+@scheduler.register('export_cache_warmer', 15 * 60, 'Pre-build PDF reports and the rental history workbook')
+def run_export_cache_warmer():
+    from export_cache import export_cache
+    from pdf_reports import REPORTS, pdf_engine
+    from xlsx_reports import write_rental_history
+
+    # Each export is keyed by table versions, so unchanged data is not rebuilt
+    for report_type in REPORTS:
+        pdf_engine.submit(report_type)
+
+    built = 0
+    entry = export_cache.entry_name('rental_history_xlsx', ('cylinders', 'customers', 'rental_history'))
+    if not export_cache.get(entry, '.xlsx'):
+        export_cache.build(entry, '.xlsx', write_rental_history)
+        built += 1
+    return f'{len(REPORTS)} PDF reports queued, {built} workbook(s) built'
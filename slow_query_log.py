@@ -0,0 +1,168 @@
+# slow_query_log.py - Slow SQL statements with their plans, in a rotating file
+"""
+Slow-query log
+
+Statements slower than SLOW_QUERY_SECONDS are written as JSON lines to
+logs/slow_queries.log (rotated at 5 MB, five files kept). Each line has
+the SQL text, its shape (literals stripped, see performance_monitor), the
+bound parameters with every string redacted to its length (leading and
+trailing % wildcards are kept so LIKE/ILIKE patterns stay recognisable),
+the route or background thread that ran it and how long it took.
+
+The first time a statement shape is slow in a worker, its plan is captured
+with EXPLAIN (EXPLAIN QUERY PLAN on SQLite) on the same connection. The
+explain goes straight to the DBAPI cursor, so it is not itself timed or
+logged. On PostgreSQL it runs inside a savepoint, so a failed explain
+cannot abort the caller's transaction.
+"""
+
+import json
+import logging
+import os
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from logging.handlers import RotatingFileHandler
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_SECONDS', '1.0'))
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', os.path.join('logs', 'slow_queries.log'))
+SLOW_QUERY_LOG_BYTES = 5 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 5
+
+# Statement shapes explained per worker before new shapes are logged without a plan
+MAX_EXPLAINED_SHAPES = 1000
+MAX_STATEMENT_LENGTH = 10000
+
+EXPLAIN_PREFIXES = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN ',
+    'mysql': 'EXPLAIN ',
+    'mariadb': 'EXPLAIN ',
+}
+EXPLAINABLE_STATEMENTS = ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')
+
+
+def redact_value(value):
+    """Keep the type and size of a bound parameter but not its content"""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (Decimal, date, datetime)):
+        return str(value)
+    if isinstance(value, str):
+        start = '%' if value.startswith('%') else ''
+        end = '%' if value.endswith('%') and len(value) > 1 else ''
+        return f"{start}<str:{len(value) - len(start) - len(end)}>{end}"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<bytes:{len(value)}>"
+    if isinstance(value, (list, tuple)):
+        return [redact_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: redact_value(item) for key, item in value.items()}
+    return f"<{type(value).__name__}>"
+
+
+def _caller():
+    """Route (or background thread) the statement ran for"""
+    try:
+        from flask import has_request_context, request
+        if has_request_context():
+            return {'endpoint': request.endpoint, 'method': request.method, 'path': request.path}
+    except ImportError:
+        pass
+    return {'thread': threading.current_thread().name}
+
+
+class SlowQueryLog:
+    """Writes slow statements, with plans for new shapes, to a rotating file"""
+
+    def __init__(self, path=SLOW_QUERY_LOG):
+        self.path = path
+        self._explained = set()
+        self._lock = threading.Lock()
+        self._file_logger = None
+
+    def _get_file_logger(self):
+        if self._file_logger is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            file_logger = logging.getLogger(f'{__name__}.file')
+            file_logger.propagate = False
+            file_logger.setLevel(logging.INFO)
+            if not file_logger.handlers:
+                handler = RotatingFileHandler(self.path, maxBytes=SLOW_QUERY_LOG_BYTES,
+                                              backupCount=SLOW_QUERY_LOG_BACKUPS)
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                file_logger.addHandler(handler)
+            self._file_logger = file_logger
+        return self._file_logger
+
+    def _needs_plan(self, shape):
+        with self._lock:
+            if shape in self._explained or len(self._explained) >= MAX_EXPLAINED_SHAPES:
+                return False
+            self._explained.add(shape)
+            return True
+
+    def record(self, conn, statement, parameters, executemany, elapsed, shape):
+        """Log one slow statement; never raises into the caller's query"""
+        try:
+            entry = {
+                'ts': datetime.now().isoformat(timespec='milliseconds'),
+                'pid': os.getpid(),
+                'duration_ms': round(elapsed * 1000, 1),
+                **_caller(),
+                'shape': shape,
+                'statement': statement[:MAX_STATEMENT_LENGTH],
+                'parameters': redact_value(parameters) if not executemany
+                              else f'<executemany: {len(parameters)} rows>',
+            }
+            if not executemany and self._needs_plan(shape):
+                entry['plan'] = self.explain(conn, statement, parameters)
+            self._get_file_logger().info(json.dumps(entry, default=str))
+        except Exception as e:
+            logger.error(f"Could not write slow query log: {e}")
+
+    def explain(self, conn, statement, parameters):
+        """Plan rows for a statement, or None if the dialect or statement can't be explained"""
+        dialect = conn.dialect.name
+        prefix = EXPLAIN_PREFIXES.get(dialect)
+        if prefix is None or not statement.lstrip().upper().startswith(EXPLAINABLE_STATEMENTS):
+            return None
+
+        cursor = conn.connection.cursor()
+        savepoint = dialect == 'postgresql' and conn.in_transaction()
+        try:
+            if savepoint:
+                cursor.execute('SAVEPOINT slow_query_explain')
+            try:
+                cursor.execute(prefix + statement, parameters or ())
+                rows = [' | '.join(str(column) for column in row) for row in cursor.fetchall()]
+            except Exception as e:
+                if savepoint:
+                    cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+                return [f'EXPLAIN failed: {e}']
+            if savepoint:
+                cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+            return rows
+        finally:
+            cursor.close()
+
+    def recent(self, limit=50):
+        """Newest entries from the current log file"""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                lines = f.readlines()[-limit:]
+        except FileNotFoundError:
+            return []
+        entries = []
+        for line in reversed(lines):
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        return entries
+
+
+# Global slow query log instance
+slow_query_log = SlowQueryLog()
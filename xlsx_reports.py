@@ -0,0 +1,69 @@
+# xlsx_reports.py - Streaming Excel exports
+"""
+Excel exports built with openpyxl write-only worksheets
+
+Write-only sheets serialise each appended row straight to a temporary XML
+file instead of keeping a cell object per value, so memory stays flat no
+matter how many rows are exported. Rows come from batched server-side
+cursor queries and are appended whole.
+"""
+
+from datetime import datetime
+
+from openpyxl import Workbook
+
+RENTAL_HISTORY_HEADERS = [
+    'Customer No', 'Customer Name', 'Customer Phone', 'Customer Address',
+    'Cylinder ID', 'Cylinder Type', 'Cylinder Size',
+    'Dispatch Date', 'Return Date', 'Rental Days'
+]
+
+
+def _date_value(value):
+    """Excel date for a stored datetime (None stays an empty cell)"""
+    return value.date() if value else None
+
+
+def _active_rows(batch_size):
+    """Rows for cylinders currently out with customers"""
+    from db_service import CylinderService
+
+    now = datetime.utcnow()
+    with CylinderService() as service:
+        for (customer_no, customer_name, customer_phone, customer_address,
+             custom_id, serial_number, cylinder_type, cylinder_size, date_borrowed) in service.stream_active_rentals(batch_size):
+            yield [
+                customer_no or '', customer_name or '', customer_phone or '', customer_address or '',
+                custom_id or serial_number or '', cylinder_type or '', cylinder_size or '',
+                _date_value(date_borrowed), None,
+                max(0, (now - date_borrowed).days) if date_borrowed else 0
+            ]
+
+
+def _past_rows(batch_size):
+    """Rows for completed rentals from the history table"""
+    from db_service import RentalHistoryService
+
+    with RentalHistoryService() as service:
+        for (customer_no, customer_name, customer_phone, customer_address,
+             custom_id, serial_number, cylinder_type, cylinder_size,
+             dispatch_date, return_date, rental_days) in service.stream_export_rows(batch_size):
+            yield [
+                customer_no or '', customer_name or '', customer_phone or '', customer_address or '',
+                custom_id or serial_number or '', cylinder_type or '', cylinder_size or '',
+                _date_value(dispatch_date), _date_value(return_date), rental_days or 0
+            ]
+
+
+def write_rental_history(output, batch_size: int = 1000):
+    """Write the active and past rental sheets to a file path or binary file object"""
+    workbook = Workbook(write_only=True)
+
+    for title, rows in (("Active Rentals", _active_rows(batch_size)),
+                        ("Past Rentals", _past_rows(batch_size))):
+        sheet = workbook.create_sheet(title)
+        sheet.append(RENTAL_HISTORY_HEADERS)
+        for row in rows:
+            sheet.append(row)
+
+    workbook.save(output)